@@ -1,18 +1,25 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
 import json
+import uuid
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from utils.firebase_config import (
-    get_budget, create_budget, record_transaction, get_transactions,
-    get_emergency_fund, add_to_emergency_fund, get_spending_by_category,
+    get_budget, create_budget, get_transactions, get_transaction_aggregates,
+    commit_payment, get_emergency_fund, add_to_emergency_fund, get_spending_by_category,
     get_monthly_stats, get_spending_trend, get_savings_goals,
     set_savings_goal, update_goal_progress, delete_savings_goal,
-    update_transaction_bundle, get_user_bundles, create_custom_bundle,
-    update_budget_remaining
+    get_user_bundles, create_custom_bundle,
+    categorize_transactions, get_rejected_payments, get_data_health, warm_up, watch_user,
+    get_rollup, get_spending_accumulator, get_top_recipients
 )
-from utils.analytics import AdvancedAnalytics
+from utils.cache import begin_request
+from utils.call_policy import OUTCOME_UNKNOWN
+from utils.metrics import set_page
+from utils.analytics import AdvancedAnalytics, SpendingAccumulator, BURST_COUNT
 from utils.payment_processor import PaymentProcessor
 
 # ==================== PAGE CONFIG ====================
@@ -172,6 +179,19 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# ==================== STORAGE ====================
+@st.cache_resource(show_spinner=False)
+def storage_backend():
+    """Connect to the data store once per process; every session reuses it"""
+    return warm_up()
+
+storage_backend()
+
+# ==================== REQUEST SCOPE ====================
+# Budget, transactions and emergency fund are fetched once per rerun and
+# shared between the sidebar and the selected page.
+begin_request()
+
 # ==================== SESSION STATE ====================
 if 'user_id' not in st.session_state:
     st.session_state.user_id = "premium_user_" + datetime.now().strftime("%Y%m%d%H%M%S")
@@ -179,6 +199,9 @@ if 'user_id' not in st.session_state:
 if 'current_month' not in st.session_state:
     st.session_state.current_month = datetime.now().strftime('%Y-%m')
 
+# Live mirror (when enabled) follows whatever this session is looking at
+watch_user(get_script_run_ctx().session_id, st.session_state.user_id, st.session_state.current_month)
+
 if 'show_success' not in st.session_state:
     st.session_state.show_success = False
 
@@ -200,6 +223,7 @@ with st.sidebar:
         label_visibility="collapsed",
         key="nav"
     )
+    set_page(page)
     
     st.markdown("---")
     
@@ -218,6 +242,15 @@ with st.sidebar:
         st.markdown("### 📈 Quick Stats")
         st.metric("Total Remaining", f"₹{total_remaining:,.0f}")
         st.metric("Emergency Fund", f"₹{get_emergency_fund(st.session_state.user_id):,.0f}")
+    
+    # Payments confirmed locally but refused by the server later
+    for rejected in get_rejected_payments(st.session_state.user_id):
+        record = rejected['payload']['record']
+        st.error(f"❌ Payment of ₹{record['amount']:,.0f} to {record['recipient']} was not completed: {rejected['last_error']}")
+
+# Backend degraded: pages keep rendering from the last cached values
+if get_data_health()['state'] != 'closed':
+    st.warning("⚠️ Budget data is temporarily unavailable. Showing the last known values; new payments may fail.")
 
 # ==================== PAGE 1: DASHBOARD ====================
 if page == "🏠 Dashboard":
@@ -334,7 +367,8 @@ if page == "🏠 Dashboard":
     # Recent transactions
     st.markdown("### 📝 Recent Transactions")
     
-    transactions = get_transactions(st.session_state.user_id, st.session_state.current_month)
+    transactions = get_transactions(st.session_state.user_id, st.session_state.current_month,
+                                    limit=5, fields=['recipient', 'amount', 'bundle', 'timestamp'])
     
     if transactions:
         df_trans = pd.DataFrame([
@@ -553,8 +587,10 @@ elif page == "💵 Send Money":
         
         st.markdown("")
         
-        # Payment processor
-        processor = PaymentProcessor(budget)
+        # Payment processor, feeding this month's running aggregates
+        month_stats = SpendingAccumulator.from_rollup(
+            get_rollup(st.session_state.user_id, st.session_state.current_month), st.session_state.current_month)
+        processor = PaymentProcessor(budget, month_stats)
         validation = processor.validate_payment(amount, selected_bundle)
         
         # Validations and warnings
@@ -618,8 +654,32 @@ elif page == "💵 Send Money":
             remaining = budget.get(remaining_key, 0)
             st.success(f"After payment: **₹{remaining - amount:,.0f}** remaining")
         
+        # Unusual payment check against this month's history and the payees of the three before it
+        detector = AdvancedAnalytics(
+            get_transaction_aggregates(st.session_state.user_id, st.session_state.current_month), budget,
+            st.session_state.user_id, st.session_state.current_month).anomaly_detector(
+            get_spending_accumulator(st.session_state.user_id, months=3,
+                                     before=st.session_state.current_month).recipient_counts())
+        check = detector.score_payment(recipient, amount, selected_bundle)
+        if check['anomalous']:
+            st.markdown(f"""
+            <div class="warning-box">
+            🚨 <b>Unusual payment</b> - please double-check before paying:<br>
+            {'<br>'.join(check['reasons'])}
+            </div>
+            """, unsafe_allow_html=True)
+        
         st.markdown("")
         
+        # One idempotency key per payment: pressing pay again after an unclear
+        # failure returns the first result instead of charging twice
+        payment_details = (recipient, amount, selected_bundle, skip_bundle)
+        if st.session_state.get('payment_details') != payment_details:
+            st.session_state.payment_details = payment_details
+            st.session_state.payment_key = uuid.uuid4().hex[:20]
+        unconfirmed = ("⚠️ We couldn't confirm this payment. Check Recent Transactions before trying again - "
+                       "pressing Confirm & Pay again will not charge you twice.")
+        
         # Confirm button
         if st.button("✅ Confirm & Pay", use_container_width=True, type="primary", key="confirm_pay"):
             with st.spinner("Processing payment..."):
@@ -635,7 +695,10 @@ elif page == "💵 Send Money":
                 
                 if skip_bundle:
                     # For urgent mode, just record as pending
-                    if record_transaction(st.session_state.user_id, st.session_state.current_month, transaction_data):
+                    payment = commit_payment(st.session_state.user_id, st.session_state.current_month, transaction_data,
+                                             transaction_id=st.session_state.payment_key)
+                    if payment['success']:
+                        st.session_state.pop('payment_details', None)
                         st.success("✅ Payment Recorded (Uncategorized)")
                         st.balloons()
                         st.markdown(f"""
@@ -644,6 +707,8 @@ elif page == "💵 Send Money":
                         Go to **Pending Transactions** to categorize this payment later!
                         </div>
                         """, unsafe_allow_html=True)
+                    elif payment.get('error_code') == OUTCOME_UNKNOWN:
+                        st.warning(unconfirmed)
                     else:
                         st.error("❌ Failed to record transaction")
                 else:
@@ -651,15 +716,15 @@ elif page == "💵 Send Money":
                     result = processor.process_payment(recipient, amount, selected_bundle, note)
                     
                     if result['success']:
-                        # Record transaction
-                        if record_transaction(st.session_state.user_id, st.session_state.current_month, transaction_data):
-                            # Update budget in database
-                            from utils.firebase_config import update_budget_remaining
-                            remaining_key = f'{selected_bundle}_remaining'
-                            remaining = budget.get(remaining_key, 0)
-                            update_budget_remaining(st.session_state.user_id, st.session_state.current_month, 
-                                                  selected_bundle, remaining - amount)
-                            
+                        # Record and deduct in one atomic commit; re-checks the balance server-side
+                        payment = commit_payment(st.session_state.user_id, st.session_state.current_month,
+                                                 transaction_data, transaction_id=st.session_state.payment_key)
+                        new_balance = payment.get('new_balance')
+                        if new_balance is None:
+                            new_balance = result['new_balance']
+                        
+                        if payment['success']:
+                            st.session_state.pop('payment_details', None)
                             st.success("✅ Payment Successful!")
                             st.balloons()
                             
@@ -667,15 +732,18 @@ elif page == "💵 Send Money":
                             with col1:
                                 st.metric("Sent", f"₹{amount:,.0f}", "")
                             with col2:
-                                st.metric("New Balance", f"₹{remaining - amount:,.0f}", f"-₹{amount:,.0f}")
+                                st.metric("New Balance", f"₹{new_balance:,.0f}", f"-₹{amount:,.0f}")
                             
                             st.markdown(f"""
                             <div class="success-box">
                             ✅ **₹{amount:,.0f}** sent to **{recipient}** from **{selected_bundle}**
                             </div>
                             """, unsafe_allow_html=True)
+                            st.caption(f"Payment {month_stats.count} this month · average ₹{month_stats.mean:,.0f}")
+                        elif payment.get('error_code') == OUTCOME_UNKNOWN:
+                            st.warning(unconfirmed)
                         else:
-                            st.error("❌ Failed to record transaction")
+                            st.error(f"❌ {payment['error']}")
                     else:
                         st.error(f"❌ {result['error']}")
 
@@ -691,7 +759,8 @@ elif page == "⏳ Pending Transactions":
         st.stop()
     
     # Get all uncategorized/pending transactions
-    all_transactions = get_transactions(st.session_state.user_id, st.session_state.current_month)
+    all_transactions = get_transactions(st.session_state.user_id, st.session_state.current_month,
+                                        fields=['recipient', 'amount', 'bundle', 'status', 'timestamp'])
     pending_transactions = [t for t in all_transactions if t.get('bundle') == 'uncategorized' or t.get('status') == 'pending']
     
     if not pending_transactions:
@@ -700,9 +769,32 @@ elif page == "⏳ Pending Transactions":
         st.stop()
     
     st.warning(f"⏳ You have {len(pending_transactions)} uncategorized payment(s) to review")
+    
+    bundle_options = ['meals', 'groceries', 'rent', 'other', 'entertainment']
+    bundle_display = {
+        'meals': '🍽️ Meals & Dining',
+        'groceries': '🛒 Groceries',
+        'rent': '🏠 Rent',
+        'other': '🚗 Other Expenses',
+        'entertainment': '🎬 Entertainment',
+    }
+    
+    # Bulk shortcut: pre-set every payment's bundle in one go
+    bulk_col1, bulk_col2 = st.columns([3, 1])
+    with bulk_col1:
+        bulk_bundle = st.selectbox("Set all payments to:", options=bundle_options,
+                                   format_func=lambda x: bundle_display[x], key="pending_bulk_bundle")
+    with bulk_col2:
+        st.markdown("<br>", unsafe_allow_html=True)
+        if st.button("Apply to all", use_container_width=True):
+            for trans in pending_transactions:
+                st.session_state[f"pending_{trans['id']}"] = bulk_bundle
+                st.session_state[f"select_{trans['id']}"] = True
+    
     st.markdown("---")
     
     # Display each pending transaction
+    assignments = []
     for idx, trans in enumerate(pending_transactions):
         st.markdown(f"### Transaction {idx + 1}")
         
@@ -717,64 +809,48 @@ elif page == "⏳ Pending Transactions":
             st.metric("Status", "⏳ Pending")
         
         # Categorization form
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns([2, 2, 1])
         with col1:
-            bundle_options = ['meals', 'groceries', 'rent', 'other', 'entertainment']
-            bundle_display = {
-                'meals': '🍽️ Meals & Dining',
-                'groceries': '🛒 Groceries',
-                'rent': '🏠 Rent',
-                'other': '🚗 Other Expenses',
-                'entertainment': '🎬 Entertainment',
-            }
-            
             selected_bundle = st.selectbox(
                 "Categorize to bundle:",
                 options=bundle_options,
                 format_func=lambda x: bundle_display[x],
-                key=f"pending_{idx}"
+                key=f"pending_{trans['id']}"
             )
         
         with col2:
-            note = st.text_input("Add note (optional)", key=f"note_{idx}")
+            note = st.text_input("Add note (optional)", key=f"note_{trans['id']}")
         
-        # Show impact
-        allocated = budget.get(selected_bundle, 0)
-        remaining = budget.get(f'{selected_bundle}_remaining', 0)
-        amount = trans.get('amount', 0)
-        new_remaining = max(0, remaining - amount)
-        
-        col_info1, col_info2 = st.columns(2)
-        with col_info1:
-            st.info(f"**Bundle:** {bundle_display[selected_bundle]}")
-        with col_info2:
-            st.warning(f"**Impact:** ₹{amount:,.0f} will be deducted. New remaining: ₹{new_remaining:,.0f}")
-        
-        # Categorize button
-        if st.button(f"✅ Categorize Transaction {idx + 1}", key=f"categorize_{idx}", use_container_width=True):
-            with st.spinner("Updating transaction..."):
-                try:
-                    # Update budget remaining amount
-                    update_budget_remaining(st.session_state.user_id, st.session_state.current_month, 
-                                          selected_bundle, new_remaining)
-                    
-                    # Update transaction status
-                    update_transaction_bundle(st.session_state.user_id, st.session_state.current_month,
-                                            trans.get('id', ''), selected_bundle)
-                    
-                    st.success(f"✅ Transaction categorized to {bundle_display[selected_bundle]}!")
-                    st.balloons()
-                    st.markdown(f"""
-                    <div class="success-box">
-                    ✅ **₹{amount:,.0f}** to **{trans.get('recipient')}** categorized to **{bundle_display[selected_bundle]}**<br>
-                    New remaining: **₹{new_remaining:,.0f}**
-                    </div>
-                    """, unsafe_allow_html=True)
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Error updating transaction: {e}")
+        with col3:
+            st.markdown("<br>", unsafe_allow_html=True)
+            # Nothing is selected until the user ticks a row or uses "Apply to all"
+            if st.checkbox("Select", key=f"select_{trans['id']}"):
+                assignments.append((trans['id'], selected_bundle))
         
         st.markdown("---")
+    
+    # Combined impact of the selection, one line per bundle
+    amounts = {trans['id']: trans.get('amount', 0) for trans in pending_transactions}
+    charges = {}
+    for transaction_id, bundle in assignments:
+        charges[bundle] = charges.get(bundle, 0) + amounts[transaction_id]
+    
+    for bundle, charge in charges.items():
+        remaining = budget.get(f'{bundle}_remaining', 0)
+        st.warning(f"**{bundle_display[bundle]}:** ₹{charge:,.0f} will be deducted. New remaining: ₹{remaining - charge:,.0f}")
+    
+    # Categorize button
+    if st.button(f"✅ Categorize {len(assignments)} Selected", key="categorize_selected",
+                 disabled=not assignments, use_container_width=True):
+        with st.spinner("Updating transactions..."):
+            result = categorize_transactions(st.session_state.user_id, st.session_state.current_month, assignments)
+        
+        if result['success']:
+            st.success(f"✅ {result['categorized']} transaction(s) categorized!")
+            st.balloons()
+            st.rerun()
+        else:
+            st.error(f"Error updating transactions: {result['error']}")
 
 # ==================== PAGE 5: ANALYTICS ====================
 elif page == "📊 Analytics":
@@ -786,10 +862,10 @@ elif page == "📊 Analytics":
         st.error("No budget set up. Please go to 'Setup Budget' first.")
         st.stop()
     
-    transactions = get_transactions(st.session_state.user_id, st.session_state.current_month)
+    transactions = get_transaction_aggregates(st.session_state.user_id, st.session_state.current_month)
     
     # Create analytics instance
-    analytics = AdvancedAnalytics(transactions, budget)
+    analytics = AdvancedAnalytics(transactions, budget, st.session_state.user_id, st.session_state.current_month)
     
     # Health score
     health_score = analytics.get_budget_health_score()
@@ -877,6 +953,54 @@ elif page == "📊 Analytics":
     
     st.markdown("---")
     
+    # Unusual payments this month
+    st.markdown("### 🚨 Unusual Payments")
+    earlier = get_spending_accumulator(st.session_state.user_id, months=3, before=st.session_state.current_month)
+    scored = analytics.anomaly_detector(earlier.recipient_counts()).score()
+    flagged = scored[scored['anomalous']].sort_values('timestamp', ascending=False)
+    if len(flagged):
+        reasons = np.where(flagged['first_time_large'], 'First-time recipient, large amount',
+                           np.where(flagged['burst'] >= BURST_COUNT, 'Burst of payments', 'Amount far above usual'))
+        st.dataframe(pd.DataFrame({
+            'Recipient': flagged['recipient'].astype(str),
+            'Amount': [f"₹{value:,.0f}" for value in flagged['amount']],
+            'Category': flagged['bundle'].astype(str).str.title(),
+            'Time': flagged['timestamp'].astype(str).str[:16],
+            'Why': reasons,
+        }), use_container_width=True, hide_index=True)
+    else:
+        st.success("No unusual payments this month.")
+    
+    st.markdown("---")
+    
+    # Running aggregates over the last three months, merged from monthly rollups
+    st.markdown("### 📆 Last 3 Months")
+    recent = get_spending_accumulator(st.session_state.user_id, months=3)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Payments", f"{recent.count:,}")
+    with col2:
+        st.metric("Average Payment", f"₹{recent.mean:,.0f}")
+    with col3:
+        st.metric("Typical Spread", f"± ₹{recent.std:,.0f}")
+    
+    st.markdown("---")
+    
+    # Top payees from the fixed-size sketches stored with each month's budget
+    st.markdown("### 🏪 Top Payees")
+    period = st.radio("Period", ["This Month", "This Quarter"], horizontal=True, key="top_payees_period")
+    top = get_top_recipients(st.session_state.user_id, months=1 if period == "This Month" else 3)
+    if top:
+        st.dataframe(pd.DataFrame({
+            'Recipient': [row['recipient'] for row in top],
+            'Amount': [f"₹{row['amount']:,.0f}" + (f" (at least ₹{row['amount'] - row['error']:,.0f})" if row['error'] else '') for row in top],
+            'Payments': [row['count'] for row in top],
+        }), use_container_width=True, hide_index=True)
+    else:
+        st.info("No payments yet.")
+    
+    st.markdown("---")
+    
     # Insights
     st.markdown("### 💡 Smart Insights")
     
@@ -1070,9 +1194,9 @@ elif page == "⚡ Insights":
         st.error("No budget set up.")
         st.stop()
     
-    transactions = get_transactions(st.session_state.user_id, st.session_state.current_month)
+    transactions = get_transaction_aggregates(st.session_state.user_id, st.session_state.current_month)
     
-    analytics = AdvancedAnalytics(transactions, budget)
+    analytics = AdvancedAnalytics(transactions, budget, st.session_state.user_id, st.session_state.current_month)
     
     # Smart recommendations
     st.markdown("### 💡 Smart Recommendations")
@@ -1133,6 +1257,30 @@ elif page == "⚡ Insights":
         st.metric("Total Remaining", f"₹{daily_calc['total_remaining']:,.0f}")
     
     st.info(daily_calc['recommendation'])
+    
+    st.markdown("---")
+    
+    # Month-end projection
+    st.markdown("### 🔮 Month-End Projection")
+    
+    method_labels = {'ewma': 'Recent trend', 'burn_rate': 'Average burn rate', 'seasonal': 'Day-of-week pattern'}
+    method = st.radio("Projection method", list(method_labels), format_func=method_labels.get, horizontal=True)
+    projection = analytics.project_month_end(st.session_state.current_month, method)
+    
+    df_projection = pd.DataFrame({
+        'Bundle': [bundle.title() for bundle in projection.index],
+        'Spent So Far': [f"₹{value:,.0f}" for value in projection['spent']],
+        'Projected Month Total': [f"₹{value:,.0f}" for value in projection['total']],
+        'Likely Range': [f"₹{low:,.0f} - ₹{high:,.0f}" for low, high in zip(projection['low'], projection['high'])],
+        'Projected Balance': [f"₹{value:,.0f}" for value in projection['balance']],
+        'Safe Daily Spend': ["Fixed bill" if pace == 'fixed' else f"₹{value:,.0f}"
+                             for value, pace in zip(projection['safe_daily'], projection['pace'])],
+    })
+    st.dataframe(df_projection, use_container_width=True, hide_index=True)
+    
+    for bundle, row in projection[projection['pace'] == 'over'].iterrows():
+        st.warning(f"At this pace {bundle.title()} runs ₹{-row['balance']:,.0f} over by month end. "
+                   f"Keep to ₹{max(row['safe_daily'], 0):,.0f} per day to stay within budget.")
 
 # ==================== FOOTER ====================
 st.markdown("---")
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import firebase_config
+from utils.outbox import Outbox
+from utils.storage import create_backend
+
+USER = 'user-1'
+MONTH = '2026-10'
+BUDGET = {'income': 1000, 'meals': 500, 'groceries': 100, 'rent': 300, 'savings': 100}
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    """Fresh backend behind firebase_config, with USER's MONTH budget set up"""
+    active = create_backend(request.param, sqlite_path=str(tmp_path / 'budgetwise.db'))
+    firebase_config.set_backend(active)
+    firebase_config.create_budget(USER, MONTH, BUDGET)
+    yield active
+    firebase_config.set_backend(None)
+
+@pytest.fixture
+def outbox(backend, tmp_path, monkeypatch):
+    """Outbox journaling firebase_config's payments; nothing is delivered until flush()"""
+    journal = Outbox(str(tmp_path / 'outbox.db'), firebase_config._deliver, interval=0.01)
+    monkeypatch.setattr(firebase_config, 'outbox', journal)
+    return journal
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from utils.analytics import AdvancedAnalytics, AnomalyDetector
+from utils.transaction_frame import TransactionFrame
+
+START = datetime(2026, 10, 1, 12)
+
+def month_of_payments():
+    records = [{'recipient': 'DMart', 'amount': 200 + day, 'bundle': 'meals', 'timestamp': START + timedelta(days=day)}
+               for day in range(6)]
+    records.append({'recipient': 'Landlord', 'amount': 25000, 'bundle': 'rent', 'timestamp': START + timedelta(days=7)})
+    return records
+
+def flagged(detector):
+    scored = detector.score()
+    return list(scored[scored['anomalous']]['recipient'].astype(str))
+
+def test_first_time_large_recipient_is_flagged():
+    detector = AnomalyDetector(TransactionFrame.from_records(month_of_payments()))
+    
+    assert flagged(detector) == ['Landlord']
+    reasons = detector.score_payment('Newco', 9000, 'rent', START + timedelta(days=20))['reasons']
+    assert reasons == ['First payment to Newco and larger than usual']
+
+def test_recipients_paid_in_earlier_months_are_not_first_time():
+    detector = AnomalyDetector(TransactionFrame.from_records(month_of_payments()), history={'Landlord': 3})
+    
+    assert flagged(detector) == []
+    assert not detector.score_payment('Landlord', 25000, 'rent', START + timedelta(days=20))['anomalous']
+
+def test_amount_far_above_a_recipients_usual_is_flagged():
+    detector = AnomalyDetector(TransactionFrame.from_records(month_of_payments()), history={'Landlord': 3})
+    
+    check = detector.score_payment('DMart', 2000, 'meals', START + timedelta(days=20))
+    
+    assert check['anomalous'] and check['score'] > detector.threshold
+
+def test_burst_of_payments_is_flagged():
+    records = [{'recipient': 'Cafe', 'amount': 100, 'bundle': 'meals', 'timestamp': START + timedelta(minutes=5 * i)}
+               for i in range(5)]
+    
+    scored = AnomalyDetector(TransactionFrame.from_records(records)).score()
+    
+    assert list(scored['burst']) == [1, 2, 3, 4, 5]
+    assert list(scored['anomalous']) == [False] * 4 + [True]
+
+def test_cached_detector_follows_the_history():
+    analytics = AdvancedAnalytics(month_of_payments(), {}, 'anomaly-user', '2026-10')
+    
+    assert flagged(analytics.anomaly_detector()) == ['Landlord']
+    seeded = analytics.anomaly_detector({'Landlord': 3})
+    assert flagged(seeded) == []
+    assert analytics.anomaly_detector({'Landlord': 3}) is seeded
+    assert flagged(analytics.anomaly_detector()) == ['Landlord']
@@ -0,0 +1,61 @@
+import time
+
+from utils import firebase_config
+from utils.cache import TTLCache
+from tests.conftest import USER, MONTH
+
+def test_entries_expire_after_the_ttl():
+    cache = TTLCache(ttl=0.05)
+    cache.put(('budget', 'u', 'm'), 1)
+    assert cache.get(('budget', 'u', 'm')) == (True, 1)
+    
+    time.sleep(0.06)
+    
+    assert cache.get(('budget', 'u', 'm')) == (False, None)
+    assert cache.get_stale(('budget', 'u', 'm')) == (True, 1)
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(ttl=60, max_entries=2)
+    cache.put(('budget', 'u', 'a'), 'a')
+    cache.put(('budget', 'u', 'b'), 'b')
+    cache.get(('budget', 'u', 'a'))
+    
+    cache.put(('budget', 'u', 'c'), 'c')
+    
+    assert cache.get(('budget', 'u', 'b')) == (False, None)
+    assert cache.get(('budget', 'u', 'a')) == (True, 'a')
+    assert cache.stats()['evictions'] == 1
+
+def test_loader_runs_once_per_ttl():
+    cache = TTLCache(ttl=60)
+    calls = []
+    
+    def load():
+        calls.append(1)
+        return len(calls)
+    
+    assert [cache.get_or_load(('budget', 'u', 'm'), load) for _ in range(3)] == [1, 1, 1]
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
+    assert TTLCache(ttl=0).get_or_load(('budget', 'u', 'm'), load) == 2
+
+def test_invalidation_is_scoped_by_user_month_and_kind():
+    cache = TTLCache(ttl=60)
+    for key in (('budget', 'u', 'm1'), ('transactions', 'u', 'm1'), ('budget', 'u', 'm2'), ('budget', 'v', 'm1')):
+        cache.put(key, key)
+    
+    cache.invalidate('u', 'm1', kinds=('budget',))
+    assert not cache.get(('budget', 'u', 'm1'))[0]
+    assert all(cache.get(key)[0] for key in (('transactions', 'u', 'm1'), ('budget', 'u', 'm2'), ('budget', 'v', 'm1')))
+    
+    cache.invalidate('u')
+    assert cache.stats()['entries'] == 1
+
+def test_writes_invalidate_cached_reads(backend):
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 500
+    backend.update_budget(USER, MONTH, {'meals_remaining': 1})
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 500
+    
+    firebase_config.commit_payment(USER, MONTH, {'recipient': 'Cafe', 'amount': 1, 'bundle': 'meals'})
+    
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 0
+    assert [t['recipient'] for t in firebase_config.get_transactions(USER, MONTH)] == ['Cafe']
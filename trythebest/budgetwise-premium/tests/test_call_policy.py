@@ -0,0 +1,123 @@
+import time
+from unittest import mock
+
+import pytest
+from google.api_core.exceptions import DeadlineExceeded
+
+from utils.call_policy import (CallPolicy, CircuitBreaker, DataCallError, CIRCUIT_OPEN, DEADLINE_EXCEEDED,
+                               OUTCOME_UNKNOWN, UNAVAILABLE)
+from utils.storage.firestore_backend import FirestoreBackend
+
+def flaky(failures, error=ConnectionError('reset')):
+    """Callable failing failures times before returning 'ok'; calls are counted in .calls"""
+    def call():
+        call.calls += 1
+        if call.calls <= failures:
+            raise error
+        return 'ok'
+    call.calls = 0
+    return call
+
+@pytest.fixture
+def policy():
+    return CallPolicy(deadline=0.5, retries=2, base_delay=0.001, breaker=CircuitBreaker(2, reset_timeout=0.05))
+
+# ==================== CIRCUIT BREAKER ====================
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    
+    breaker.record_failure()
+    
+    assert breaker.state == 'open' and not breaker.allow()
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    
+    assert breaker.state == 'closed'
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    
+    assert breaker.state == 'half_open'
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+
+def test_open_breaker_refuses_calls(policy):
+    for _ in range(2):
+        with pytest.raises(DataCallError):
+            policy.call('read', flaky(10), idempotent=True)
+    call = flaky(0)
+    
+    with pytest.raises(DataCallError) as refused:
+        policy.call('read', call, idempotent=True)
+    
+    assert refused.value.code == CIRCUIT_OPEN and call.calls == 0
+    time.sleep(0.06)
+    assert policy.call('read', call, idempotent=True) == 'ok'
+    assert policy.breaker.state == 'closed'
+
+# ==================== READS ====================
+
+def test_reads_are_retried_on_transient_errors(policy):
+    call = flaky(2)
+    
+    assert policy.call('read', call, idempotent=True) == 'ok'
+    assert call.calls == 3
+
+def test_reads_give_up_after_the_retries(policy):
+    call = flaky(10)
+    
+    with pytest.raises(DataCallError) as failed:
+        policy.call('read', call, idempotent=True)
+    
+    assert failed.value.code == UNAVAILABLE and call.calls == 3
+
+def test_reads_stop_waiting_at_the_deadline(policy):
+    started = time.monotonic()
+    
+    with pytest.raises(DataCallError) as failed:
+        policy.call('read', lambda: time.sleep(2), idempotent=True)
+    
+    assert failed.value.code == DEADLINE_EXCEEDED
+    assert time.monotonic() - started < 1
+
+def test_other_errors_are_raised_as_is(policy):
+    with pytest.raises(KeyError):
+        policy.call('read', lambda: {}['missing'], idempotent=True)
+    assert policy.breaker.state == 'closed'
+
+# ==================== WRITES ====================
+
+def test_writes_are_not_retried_and_their_outcome_is_unknown(policy):
+    call = flaky(1)
+    
+    with pytest.raises(DataCallError) as failed:
+        policy.call('write', call)
+    
+    assert failed.value.code == OUTCOME_UNKNOWN and call.calls == 1
+
+def test_write_deadline_is_passed_to_firestore_and_reported_unknown(policy):
+    db = mock.MagicMock()
+    budget_ref = db.collection.return_value.document.return_value.collection.return_value.document.return_value
+    budget_ref.set.side_effect = DeadlineExceeded('commit timed out')
+    backend = FirestoreBackend(db, write_timeout=policy.write_deadline)
+    
+    with pytest.raises(DataCallError) as failed:
+        policy.call('set_budget', lambda: backend.set_budget('u', '2026-10', {'meals': 1}))
+    
+    budget_ref.set.assert_called_once_with({'meals': 1}, timeout=policy.write_deadline)
+    assert failed.value.code == OUTCOME_UNKNOWN
@@ -0,0 +1,74 @@
+from utils import firebase_config
+from utils.rollups import bundle_totals
+from tests.conftest import USER, MONTH
+
+def pay(recipient, amount, bundle, status='completed'):
+    result = firebase_config.commit_payment(USER, MONTH, {'recipient': recipient, 'amount': amount,
+                                                          'bundle': bundle, 'status': status})
+    return result['transaction_id']
+
+def skipped(recipient, amount):
+    """A payment made with the bundle skipped (uncategorized, nothing deducted)"""
+    return pay(recipient, amount, 'uncategorized', status='pending')
+
+def test_charges_are_coalesced_per_bundle(backend):
+    first, second = skipped('Cafe', 30), skipped('Diner', 20)
+    moved = pay('Shop', 10, 'groceries')
+    
+    result = firebase_config.categorize_transactions(USER, MONTH, [(first, 'meals'), (second, 'meals'), (moved, 'meals')])
+    
+    assert result == {'success': True, 'categorized': 3,
+                      'balances': {'meals_remaining': 440, 'groceries_remaining': 100}}
+    budget = firebase_config.get_budget(USER, MONTH)
+    assert (budget['meals_remaining'], budget['groceries_remaining']) == (440, 100)
+    assert {t['status'] for t in firebase_config.get_transactions(USER, MONTH)} == {'categorized'}
+    totals = bundle_totals(firebase_config.get_rollup(USER, MONTH))
+    assert (totals['meals'], totals.get('groceries', 0), totals.get('uncategorized', 0)) == (60, 0, 0)
+
+def test_last_assignment_wins_and_overspending_goes_negative(backend):
+    transaction_id = skipped('Landlord', 400)
+    
+    result = firebase_config.categorize_transactions(USER, MONTH, [(transaction_id, 'meals'),
+                                                                   (transaction_id, 'groceries')])
+    
+    assert result['categorized'] == 1
+    assert result['balances'] == {'groceries_remaining': -300}
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 500
+
+def test_recategorizing_refunds_exactly_what_was_charged(backend):
+    transaction_id = skipped('Landlord', 400)
+    firebase_config.categorize_transactions(USER, MONTH, [(transaction_id, 'groceries')])
+    
+    result = firebase_config.categorize_transactions(USER, MONTH, [(transaction_id, 'meals')])
+    
+    assert result['balances'] == {'groceries_remaining': 100, 'meals_remaining': 100}
+    budget = firebase_config.get_budget(USER, MONTH)
+    assert (budget['groceries_remaining'], budget['meals_remaining']) == (100, 100)
+    assert bundle_totals(firebase_config.get_rollup(USER, MONTH)).get('groceries', 0) == 0
+
+def test_unknown_ids_are_ignored(backend):
+    assert firebase_config.categorize_transactions(USER, MONTH, [('missing', 'meals')]) == {
+        'success': True, 'categorized': 0, 'balances': {}}
+    assert firebase_config.categorize_transactions(USER, MONTH, []) == {
+        'success': True, 'categorized': 0, 'balances': {}}
+
+def test_payments_in_the_outbox_are_delivered_first(backend, outbox):
+    transaction_id = skipped('Cafe', 30)
+    assert backend.list_transactions(USER, MONTH) == []
+    
+    result = firebase_config.categorize_transactions(USER, MONTH, [(transaction_id, 'meals')])
+    
+    assert result['categorized'] == 1
+    assert outbox.pending(USER, MONTH) == []
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 470
+
+def test_undeliverable_outbox_payments_are_not_categorized(backend, outbox):
+    transaction_id = skipped('Cafe', 30)
+    
+    def down(entry):
+        raise ConnectionError('offline')
+    outbox.apply = down
+    result = firebase_config.categorize_transactions(USER, MONTH, [(transaction_id, 'meals')])
+    
+    assert result['success'] is False and 'still being sent' in result['error']
+    assert [entry['key'] for entry in outbox.pending(USER, MONTH)] == [transaction_id]
@@ -0,0 +1,61 @@
+from utils.heavy_hitters import SKETCH_FIELD, SpaceSaving, record_payment
+
+def _recipients(sketch):
+    return [counter['recipient'] for counter in sketch.top()]
+
+def test_counts_exactly_below_capacity():
+    sketch = SpaceSaving(capacity=3)
+    for recipient, amount in (('cafe', 10), ('rent', 300), ('cafe', 5)):
+        sketch.add(recipient, amount)
+    
+    assert sketch.top() == [
+        {'recipient': 'rent', 'amount': 300, 'count': 1, 'error': 0},
+        {'recipient': 'cafe', 'amount': 15, 'count': 2, 'error': 0},
+    ]
+    assert sketch.total == 315
+
+def test_new_recipient_takes_over_the_smallest_counter():
+    sketch = SpaceSaving(capacity=2)
+    for recipient, amount in (('a', 50), ('b', 5), ('c', 7)):
+        sketch.add(recipient, amount)
+    
+    assert len(sketch) == 2
+    assert sketch.top() == [
+        {'recipient': 'a', 'amount': 50, 'count': 1, 'error': 0},
+        {'recipient': 'c', 'amount': 12, 'count': 1, 'error': 5},
+    ]
+
+def test_heavy_hitters_are_always_tracked():
+    sketch = SpaceSaving(capacity=4)
+    for i in range(200):
+        sketch.add(f'payee-{i}', 1)
+        if i % 10 == 0:
+            sketch.add('landlord', 20)
+    
+    top = sketch.top(1)[0]
+    assert top['recipient'] == 'landlord'
+    assert top['amount'] - top['error'] <= 400 <= top['amount']
+
+def test_merge_keeps_capacity_and_totals():
+    october, november = SpaceSaving(capacity=2), SpaceSaving(capacity=2)
+    october.add('cafe', 30).add('gym', 20)
+    november.add('cafe', 25).add('books', 40)
+    
+    merged = october.merge(november)
+    
+    assert len(merged) == 2 and merged.total == 115
+    # books may have had up to october's floor (20) there, so it is overestimated by that much
+    assert merged.top() == [
+        {'recipient': 'books', 'amount': 60, 'count': 1, 'error': 20},
+        {'recipient': 'cafe', 'amount': 55, 'count': 2, 'error': 0},
+    ]
+
+def test_round_trips_through_the_budget_document():
+    budget = {}
+    for recipient, amount in (('cafe', 10), ('gym', 20), ('cafe', 5)):
+        budget[SKETCH_FIELD] = record_payment(budget, {'recipient': recipient, 'amount': amount})
+    
+    sketch = SpaceSaving.from_dict(budget[SKETCH_FIELD])
+    assert sketch.to_dict() == budget[SKETCH_FIELD]
+    assert _recipients(sketch) == ['gym', 'cafe'] and sketch.total == 35
+    assert SpaceSaving.from_dict(None).top() == []
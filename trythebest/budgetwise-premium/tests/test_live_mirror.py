@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from utils.live_mirror import LiveMirror
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+class FakeBackend:
+    """watch_* deliver one snapshot right away and record when their listener is stopped"""
+    name = 'fake'
+    
+    def __init__(self):
+        self.stopped = []
+    
+    def watch_budget(self, user_id, month, callback):
+        callback({'meals_remaining': 100})
+        return lambda: self.stopped.append(('budget', user_id, month))
+    
+    def watch_transactions(self, user_id, month, callback):
+        callback([])
+        return lambda: self.stopped.append(('transactions', user_id, month))
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def mirror(clock):
+    backend = FakeBackend()
+    live = LiveMirror(backend, max_subscriptions=2, idle_timeout=60, reap_interval=0.01, clock=clock)
+    yield live
+    live.close()
+
+def test_idle_listeners_are_stopped_without_further_requests(mirror, clock):
+    mirror.touch('s1', 'u1', '2026-10')
+    clock.now += 30
+    time.sleep(0.05)
+    assert mirror.stats()['subscriptions'] == 1
+    
+    clock.now += 31
+    
+    assert wait_for(lambda: mirror.stats()['subscriptions'] == 0)
+    assert sorted(mirror.backend.stopped) == [('budget', 'u1', '2026-10'), ('transactions', 'u1', '2026-10')]
+    assert mirror.get_budget('u1', '2026-10') == (False, None)
+
+def test_a_recently_seen_session_keeps_shared_listeners(mirror, clock):
+    mirror.touch('s1', 'u1', '2026-10')
+    clock.now += 50
+    mirror.touch('s2', 'u1', '2026-10')
+    clock.now += 20
+    
+    time.sleep(0.05)
+    assert mirror.stats() == {'subscriptions': 1, 'sessions': 1, 'transactions': 0}
+    assert mirror.backend.stopped == []
+
+def test_reaper_restarts_for_new_subscriptions(mirror, clock):
+    mirror.touch('s1', 'u1', '2026-10')
+    clock.now += 61
+    assert wait_for(lambda: mirror._reaper is None)
+    
+    mirror.touch('s2', 'u2', '2026-10')
+    clock.now += 61
+    
+    assert wait_for(lambda: mirror.stats()['subscriptions'] == 0)
+
+def test_release_and_cap(mirror):
+    mirror.touch('s1', 'u1', '2026-10')
+    mirror.release('s1')
+    assert len(mirror.backend.stopped) == 2
+    
+    for session, user in (('a', 'u2'), ('b', 'u3'), ('c', 'u4')):
+        mirror.touch(session, user, '2026-10')
+    assert mirror.stats()['subscriptions'] == 2
+    assert mirror.get_budget('u2', '2026-10') == (False, None)
@@ -0,0 +1,87 @@
+import time
+
+from utils import firebase_config
+from tests.conftest import USER, MONTH
+
+def pay(recipient, amount, bundle='meals', **options):
+    return firebase_config.commit_payment(USER, MONTH, {'recipient': recipient, 'amount': amount, 'bundle': bundle},
+                                          **options)
+
+def stored_transactions(backend):
+    return backend.list_transactions(USER, MONTH)
+
+# ==================== DELIVERY ====================
+
+def test_redelivery_after_timeout_is_idempotent(backend, outbox):
+    deliveries = []
+    
+    def lost_ack(entry):
+        # The backend commits, but the reply never reaches the flusher
+        deliveries.append(firebase_config._deliver(entry))
+        if len(deliveries) == 1:
+            raise TimeoutError('no reply')
+        return deliveries[-1]
+    outbox.apply = lost_ack
+    
+    assert pay('Cafe', 200)['queued']
+    outbox.flush()
+    assert outbox.pending(USER, MONTH)[0]['attempts'] == 1
+    time.sleep(0.02)
+    outbox.flush()
+    
+    assert deliveries[1]['duplicate']
+    assert outbox.pending(USER, MONTH) == []
+    assert len(stored_transactions(backend)) == 1
+    assert backend.get_budget(USER, MONTH)['meals_remaining'] == 300
+    assert firebase_config.get_rollup(USER, MONTH)['total_spent'] == 200
+
+def test_same_key_is_journaled_once(backend, outbox):
+    first = pay('Cafe', 200, transaction_id='pay-1')
+    again = pay('Cafe', 200, transaction_id='pay-1')
+    
+    assert first['transaction_id'] == 'pay-1' and again['duplicate']
+    assert len(outbox.pending(USER, MONTH)) == 1
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 300
+
+def test_direct_commit_with_same_key_charges_once(backend):
+    first = pay('Cafe', 200, transaction_id='pay-1')
+    again = pay('Cafe', 200, transaction_id='pay-1')
+    
+    assert first['success'] and again['duplicate']
+    assert len(stored_transactions(backend)) == 1
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 300
+
+def test_refused_payment_is_marked_rejected(backend, outbox):
+    assert pay('Cafe', 400)['queued']
+    # Another device spends most of the bundle before the flusher runs
+    backend.update_budget(USER, MONTH, {'meals_remaining': 50})
+    firebase_config.shared_cache.clear()
+    outbox.flush()
+    
+    rejected = firebase_config.get_rejected_payments(USER)
+    assert [entry['payload']['record']['recipient'] for entry in rejected] == ['Cafe']
+    assert 'Insufficient balance' in rejected[0]['last_error']
+    assert outbox.pending(USER, MONTH) == []
+    assert stored_transactions(backend) == []
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 50
+
+# ==================== PENDING READS ====================
+
+def test_pending_payments_fold_into_reads(backend, outbox):
+    firebase_config.get_rollup(USER, MONTH)
+    assert pay('Cafe', 200)['new_balance'] == 300
+    assert firebase_config.record_transaction(USER, MONTH, {'recipient': 'Shop', 'amount': 10,
+                                                            'bundle': 'uncategorized', 'status': 'pending'})
+    
+    assert stored_transactions(backend) == []
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 300
+    assert [t['recipient'] for t in firebase_config.get_transactions(USER, MONTH)] == ['Shop', 'Cafe']
+    rollup = firebase_config.get_rollup(USER, MONTH)
+    assert rollup['total_spent'] == 210 and rollup['transaction_count'] == 2
+    assert pay('Diner', 400)['error_code'] == 'INSUFFICIENT_BALANCE'
+    
+    outbox.flush()
+    assert len(stored_transactions(backend)) == 2
+    assert firebase_config.get_budget(USER, MONTH)['meals_remaining'] == 300
+    assert [t['recipient'] for t in firebase_config.get_transactions(USER, MONTH)] == ['Shop', 'Cafe']
+    assert firebase_config.get_rollup(USER, MONTH)['total_spent'] == 210
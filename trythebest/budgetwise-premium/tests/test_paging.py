@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from utils import firebase_config
+from tests.conftest import USER, MONTH
+
+def _add(backend, count, ties=False, start=datetime(2026, 10, 1)):
+    for i in range(count):
+        # With ties, every third payment shares its predecessor's timestamp and is paged by id
+        timestamp = start + timedelta(hours=i - i // 3 if ties else i)
+        backend.add_transaction(USER, {'month': MONTH, 'recipient': f'payee-{i}', 'amount': i + 1,
+                                       'bundle': 'meals', 'timestamp': timestamp})
+
+def _pages(read, limit):
+    pages, cursor = [], None
+    while True:
+        page = read(limit=limit, start_after=cursor)
+        if not page:
+            return pages
+        pages.append(page)
+        cursor = page[-1]
+
+def test_pages_cover_every_transaction_once(backend):
+    _add(backend, 10, ties=True)
+    everything = backend.list_transactions(USER, MONTH)
+    
+    pages = _pages(lambda **page: backend.list_transactions(USER, MONTH, **page), 3)
+    
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert [record['id'] for page in pages for record in page] == [record['id'] for record in everything]
+
+def test_fields_restrict_paged_records(backend):
+    _add(backend, 4)
+    
+    page = backend.list_transactions(USER, MONTH, limit=2, fields=('amount',))
+    
+    assert [set(record) for record in page] == [{'amount', 'timestamp', 'id', 'update_time'}] * 2
+    assert [record['amount'] for record in page] == [4, 3]
+
+def test_cached_pages_follow_the_cursor(backend):
+    _add(backend, 5)
+    
+    pages = _pages(lambda **page: firebase_config.get_transactions(USER, MONTH, **page), 2)
+    
+    assert [[record['recipient'] for record in page] for page in pages] == [
+        ['payee-4', 'payee-3'], ['payee-2', 'payee-1'], ['payee-0']]
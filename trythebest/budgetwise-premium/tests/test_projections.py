@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from utils import fleet_report, projections
+from utils.transaction_frame import TransactionFrame
+
+MONTH = '2026-10'
+TODAY = datetime(2026, 10, 10, 18)
+
+def test_burn_rate_extrapolates_the_average_day():
+    result = projections.project_spend(np.full(10, 100.0), 31, method='burn_rate')
+    
+    assert result['spent'] == 1000 and result['projected'] == pytest.approx(2100)
+    assert result['total'] == pytest.approx(3100) and result['daily_rate'] == pytest.approx(100)
+    # No variation, no band
+    assert result['low'] == pytest.approx(3100) and result['high'] == pytest.approx(3100)
+
+def test_ewma_follows_recent_days():
+    daily = np.array([0.0] * 5 + [200.0] * 5)
+    
+    ewma = projections.project_spend(daily, 31, method='ewma')
+    burn = projections.project_spend(daily, 31, method='burn_rate')
+    
+    assert burn['daily_rate'] == pytest.approx(100)
+    assert 150 < ewma['daily_rate'] < 200
+
+def test_seasonal_weighs_the_weekdays_still_to_come():
+    # October 2026 starts on a Thursday; spend only on weekends
+    days, first_weekday = projections.month_calendar(MONTH)
+    weekdays = (first_weekday + np.arange(14)) % 7
+    daily = np.where(weekdays >= 5, 300.0, 0.0)
+    
+    seasonal = projections.project_spend(daily, days, first_weekday, method='seasonal')
+    burn = projections.project_spend(daily, days, first_weekday, method='burn_rate')
+    
+    # 17 days left hold 5 weekend days: more than the 17 * 4/14 an average day implies
+    assert seasonal['projected'] > burn['projected']
+    assert seasonal['low'] <= seasonal['total'] <= seasonal['high']
+
+def test_batch_shapes_and_empty_months():
+    daily = np.random.default_rng(0).uniform(0, 100, size=(4, 3, 10))
+    
+    result = projections.project_spend(daily, 31)
+    
+    assert all(values.shape == (4, 3) for values in result.values())
+    assert projections.project_spend(np.zeros((2, 0)), 31)['total'].tolist() == [0, 0]
+    with pytest.raises(ValueError):
+        projections.project_spend(daily, 31, method='guess')
+
+def test_fixed_bundles_are_not_extrapolated():
+    records = [{'amount': 25000, 'bundle': 'rent', 'timestamp': datetime(2026, 10, 1, 9)}]
+    records += [{'amount': 200, 'bundle': 'meals', 'timestamp': datetime(2026, 10, day, 13)} for day in range(1, 11)]
+    budget = {'meals_remaining': 6000, 'groceries_remaining': 6000, 'rent_remaining': 0}
+    
+    table = projections.bundle_projection(TransactionFrame.from_records(records), budget, MONTH,
+                                          ['meals', 'groceries', 'rent'], method='burn_rate', today=TODAY)
+    
+    assert table.loc['rent', 'total'] == 25000 and table.loc['rent', 'pace'] == 'fixed'
+    assert table.loc['meals', 'projected'] == pytest.approx(200 * 21)
+    assert table.loc['meals', 'balance'] == pytest.approx(6000 - 4200)
+    assert list(table['pace']) == ['on track', 'on track', 'fixed']
+
+def test_unpaid_fixed_bundle_is_projected_as_due():
+    budget = {'meals_remaining': 100, 'rent_remaining': 25000}
+    
+    table = projections.bundle_projection(TransactionFrame.from_records([]), budget, MONTH, ['meals', 'rent'],
+                                          today=TODAY)
+    
+    assert table.loc['rent', 'projected'] == 25000 and table.loc['rent', 'balance'] == 0
+
+def test_fleet_projection_flags_a_blown_bundle_despite_savings():
+    budget = {'meals': 3000, 'rent': 25000, 'savings': 50000,
+              'meals_remaining': 500, 'rent_remaining': 0, 'savings_remaining': 50000}
+    summary = fleet_report._empty_summary(10)
+    rows = [('u1', {'amount': 250, 'bundle': 'meals', 'timestamp': datetime(2026, 10, day, 12)}) for day in range(1, 11)]
+    rows.append(('u1', {'amount': 25000, 'bundle': 'rent', 'timestamp': datetime(2026, 10, 1, 9)}))
+    for _, partial in fleet_report.summarize_chunk(rows, 10):
+        fleet_report.merge_summary(summary, partial)
+    report = fleet_report.user_report('u1', MONTH, budget, summary, 10)
+    
+    projection = fleet_report._project([report], MONTH, 10, 'burn_rate')[0]['projection']
+    
+    assert projection['balances'] == {'meals': pytest.approx(500 - 250 * 21), 'rent': 0}
+    assert projection['total'] == pytest.approx(2500 + 250 * 21 + 25000)
+    fleet = fleet_report._empty_fleet(MONTH)
+    fleet_report._add_to_fleet(fleet, report)
+    assert fleet['projected_over_budget_users'] == 1
@@ -0,0 +1,91 @@
+import pytest
+
+from google.cloud import firestore_admin_v1
+from google.cloud.firestore_admin_v1.types import Field, Index
+
+from utils.storage import query_shapes
+
+READY = Index.State.READY
+
+def composite(shape, state=READY):
+    fields = [Index.IndexField(field_path=field['fieldPath'], order=Index.IndexField.Order[field['order']])
+              for field in shape.index_fields()]
+    return Index(query_scope=Index.QueryScope[shape.scope], fields=fields, state=state)
+
+def group_index(state=READY):
+    return Index(query_scope=Index.QueryScope.COLLECTION_GROUP, state=state,
+                 fields=[Index.IndexField(field_path='month', order=Index.IndexField.Order.ASCENDING)])
+
+class FakeAdminClient:
+    """Stands in for FirestoreAdminClient, serving the class's indexes and field overrides per collection group"""
+    indexes = {}
+    fields = {}
+    instances = []
+    
+    def __init__(self, credentials=None):
+        self.credentials = credentials
+        FakeAdminClient.instances.append(self)
+    
+    def list_indexes(self, parent):
+        return self.indexes.get(parent.rsplit('/', 1)[-1], [])
+    
+    def get_field(self, name):
+        return Field(name=name, index_config=Field.IndexConfig(indexes=self.fields.get(name.split('/')[-3], [])))
+
+@pytest.fixture
+def admin(monkeypatch):
+    FakeAdminClient.instances, FakeAdminClient.indexes, FakeAdminClient.fields = [], {}, {}
+    monkeypatch.setattr(firestore_admin_v1, 'FirestoreAdminClient', FakeAdminClient)
+    monkeypatch.delenv('FIRESTORE_EMULATOR_HOST', raising=False)
+    return FakeAdminClient
+
+def test_admin_client_uses_the_app_credentials(admin, monkeypatch):
+    key = object()
+    monkeypatch.setattr(query_shapes, 'app_credentials', lambda: key)
+    
+    query_shapes.validate(None, 'demo-project')
+    
+    assert [client.credentials for client in admin.instances] == [key]
+
+def test_explicit_credentials_win(admin, monkeypatch):
+    key, other = object(), object()
+    monkeypatch.setattr(query_shapes, 'app_credentials', lambda: key)
+    
+    query_shapes.validate(None, 'demo-project', credentials=other)
+    
+    assert admin.instances[0].credentials is other
+
+def test_missing_and_building_indexes_are_reported(admin):
+    admin.indexes = {'records': [composite(query_shapes.TRANSACTIONS_BY_MONTH, state=Index.State.CREATING)]}
+    admin.fields = {'records': [group_index()]}
+    
+    problems = query_shapes.validate(None, 'demo-project')
+    
+    reported = sorted(problem.split(':')[0] for problem in problems)
+    assert reported == ['fleet_budgets', 'transactions_by_month']
+
+def test_no_problems_when_every_index_is_ready(admin):
+    for shape in query_shapes.QUERY_SHAPES:
+        if shape.needs_composite_index():
+            admin.indexes.setdefault(shape.collection_group, []).append(composite(shape))
+    admin.fields = {'records': [group_index()], 'monthly': [group_index()]}
+    
+    assert query_shapes.validate(None, 'demo-project') == []
+
+def test_app_credentials_come_from_the_firebase_app(monkeypatch):
+    import firebase_admin
+    key = object()
+    
+    class Credential:
+        def get_credential(self):
+            return key
+    
+    class App:
+        credential = Credential()
+    monkeypatch.setattr(firebase_admin, 'get_app', lambda: App())
+    assert query_shapes.app_credentials() is key
+    
+    def no_app():
+        raise ValueError('The default Firebase app does not exist.')
+    monkeypatch.setattr(firebase_admin, 'get_app', no_app)
+    assert query_shapes.app_credentials() is None
@@ -0,0 +1,114 @@
+import threading
+from datetime import datetime
+
+from utils import firebase_config, rollups
+from utils.storage.base import apply_increments
+from tests.conftest import USER, MONTH
+
+RECORDS = [
+    {'recipient': 'cafe@okaxis', 'amount': 200, 'bundle': 'meals', 'timestamp': datetime(2026, 10, 7, 9)},
+    {'recipient': 'cafe@okaxis', 'amount': 250, 'bundle': 'meals', 'timestamp': datetime(2026, 10, 12, 13)},
+    {'recipient': 'Landlord', 'amount': 800, 'bundle': 'rent', 'timestamp': datetime(2026, 10, 12, 18)},
+]
+
+def pay(record):
+    return firebase_config.commit_payment(USER, MONTH, record)
+
+def stored(backend):
+    return backend.get_rollup(USER, MONTH)
+
+def rebuilt(backend):
+    return rollups.build_rollup(MONTH, backend.list_transactions(USER, MONTH))
+
+# ==================== INCREMENTS ====================
+
+def test_build_rollup_sums_every_field():
+    rollup = rollups.build_rollup(MONTH, RECORDS)
+    
+    assert (rollup['total_spent'], rollup['transaction_count']) == (1250, 3)
+    assert rollup['sum_squares'] == 200 ** 2 + 250 ** 2 + 800 ** 2
+    assert rollup['bundles'] == {'meals': {'amount': 450, 'count': 2}, 'rent': {'amount': 800, 'count': 1}}
+    assert rollup['recipients']['cafe@okaxis'] == {'amount': 450, 'count': 2}
+    assert rollup['days'] == {'07': 200, '12': 1050}
+
+def test_recipient_keys_never_contain_dots():
+    key = rollups.recipient_key('shop.example 100%')
+    
+    assert '.' not in key and rollups.recipient_name(key) == 'shop.example 100%'
+    rollup = rollups.build_rollup(MONTH, [{'recipient': 'shop.example', 'amount': 5, 'bundle': 'meals'}])
+    assert list(rollup['recipients']) == [rollups.recipient_key('shop.example')]
+
+def test_removing_a_transaction_undoes_its_delta():
+    rollup = rollups.build_rollup(MONTH, RECORDS)
+    
+    apply_increments(rollup, rollups.transaction_delta(RECORDS[2], sign=-1))
+    
+    assert rollup['total_spent'] == 450 and rollup['bundles']['rent'] == {'amount': 0, 'count': 0}
+    assert rollup['days'] == {'07': 200, '12': 250}
+
+def test_recategorize_moves_amount_between_bundles():
+    rollup = rollups.build_rollup(MONTH, RECORDS)
+    
+    apply_increments(rollup, rollups.recategorize_delta(250, 'meals', 'groceries'))
+    
+    assert rollups.bundle_totals(rollup) == {'meals': 200, 'rent': 800, 'groceries': 250}
+    assert rollups.recategorize_delta(250, 'meals', 'meals') == {}
+
+# ==================== STORED ROLLUPS ====================
+
+def test_payments_keep_the_stored_rollup_equal_to_a_rebuild(backend):
+    pay(RECORDS[0])
+    assert firebase_config.get_rollup(USER, MONTH)['complete']
+    for record in RECORDS[1:]:
+        pay(record)
+    
+    rollup = stored(backend)
+    expected = rebuilt(backend)
+    
+    for field in ('total_spent', 'transaction_count', 'sum_squares', 'bundles', 'recipients', 'days'):
+        assert rollup[field] == expected[field], field
+    assert rollup['complete'] and rollup['version'] == rollups.ROLLUP_VERSION
+
+def test_rollup_started_by_increments_is_rebuilt_on_read(backend):
+    pay({'recipient': 'Cafe', 'amount': 100, 'bundle': 'meals'})
+    assert not stored(backend).get('complete')
+    pay({'recipient': 'Cafe', 'amount': 50, 'bundle': 'meals'})
+    
+    rollup = firebase_config.get_rollup(USER, MONTH)
+    
+    assert rollup['complete'] and rollup['total_spent'] == 150
+    assert stored(backend)['complete']
+
+def test_outdated_rollup_version_is_rebuilt_on_read(backend):
+    pay({'recipient': 'Cafe', 'amount': 100, 'bundle': 'meals'})
+    backend.set_rollup(USER, MONTH, {'month': MONTH, 'complete': True, 'version': 1, 'total_spent': 999})
+    firebase_config.shared_cache.clear()
+    
+    rollup = firebase_config.get_rollup(USER, MONTH)
+    
+    assert rollup['total_spent'] == 100 and rollup['version'] == rollups.ROLLUP_VERSION
+    assert rollup['recipients'] == {'Cafe': {'amount': 100, 'count': 1}}
+
+def test_rebuilding_an_empty_month_stores_nothing(backend):
+    rollup = firebase_config.rebuild_rollup(USER, '2026-09')
+    
+    assert rollup['transaction_count'] == 0
+    assert backend.get_rollup(USER, '2026-09') is None
+
+def test_rebuilds_racing_payments_lose_nothing(backend):
+    def payments():
+        for _ in range(40):
+            backend.commit_payment(USER, MONTH, {'recipient': 'Cafe', 'amount': 1, 'bundle': 'meals', 'month': MONTH,
+                                                 'timestamp': datetime(2026, 10, 3)},
+                                   rollup=rollups.transaction_delta({'recipient': 'Cafe', 'amount': 1, 'bundle': 'meals'}))
+    
+    def rebuilds():
+        for _ in range(20):
+            backend.rebuild_rollup(USER, MONTH)
+    threads = [threading.Thread(target=payments), threading.Thread(target=payments), threading.Thread(target=rebuilds)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert stored(backend)['transaction_count'] == 80 and stored(backend)['total_spent'] == 80
@@ -1,37 +1,108 @@
+import copy
+import os
+from collections import deque
+from datetime import datetime
+
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+
+from utils import projections, rollups
+from utils.cache import TTLCache
+from utils.storage.base import apply_increments
+from utils.transaction_frame import TransactionFrame
+
+# Spending bundles scored by insights and the health score (savings is tracked separately)
+SPENDING_BUNDLES = ['meals', 'groceries', 'rent']
+
+# Summaries keyed by ('analytics', user_id, month, data version); a new version is a new key
+summary_cache = TTLCache(
+    ttl=float(os.getenv('BUDGETWISE_ANALYTICS_TTL', '3600')),
+    max_entries=int(os.getenv('BUDGETWISE_ANALYTICS_SIZE', '256')),
+)
+
+def data_version(transactions, budget):
+    """Fingerprint of the inputs; changes when any record or budget field changes"""
+    records = tuple((t.get('id'), t.get('update_time'), t.get('amount'), t.get('bundle')) for t in transactions)
+    fields = tuple(sorted((key, value) for key, value in budget.items() if not isinstance(value, (dict, list))))
+    return hash((records, fields))
+
+class AnalyticsSummary:
+    """Everything AdvancedAnalytics reports, computed in one pass over budget and transactions"""
+    
+    def __init__(self, frame, budget):
+        self.frame = frame
+        self.transaction_count = len(frame)
+        self.average_transaction = frame.mean
+        self.bundles = self._bundle_table(frame, budget)
+        self.total_remaining = float(self.bundles['remaining'].sum())
+        self.monthly_income = budget.get('monthly_income', 1)
+        # Savings count as untouched when remaining equals the allocation (both missing included)
+        self.savings_untouched = budget.get('savings_remaining') == budget.get('savings')
+        self.health_score = self._health_score()
+        # (history key, AnomalyDetector) of the last anomaly_detector() call
+        self.anomalies = None
+    
+    @staticmethod
+    def _bundle_table(frame, budget):
+        """Per-bundle budget usage joined with transaction stats, one row per spending bundle"""
+        allocated = np.array([budget.get(bundle, 0) for bundle in SPENDING_BUNDLES], dtype='float64')
+        remaining = np.array([budget.get(f'{bundle}_remaining', 0) for bundle in SPENDING_BUNDLES], dtype='float64')
+        spent = allocated - remaining
+        percentage = np.divide(spent * 100, allocated, out=np.zeros_like(spent), where=allocated > 0)
+        table = pd.DataFrame({'allocated': allocated, 'remaining': remaining, 'spent': spent, 'percentage': percentage},
+                             index=SPENDING_BUNDLES)
+        stats = frame.bundle_stats()
+        return table.join(stats[['count', 'mean']]).fillna({'count': 0, 'mean': 0.0})
+    
+    def _health_score(self):
+        percentage = self.bundles['percentage'].to_numpy()
+        
+        # Deduct for overspending
+        score = 100 - 10 * int((percentage > 100).sum()) - 5 * int(((percentage > 90) & (percentage <= 100)).sum())
+        
+        # Add points for savings protection
+        if self.savings_untouched:
+            score += 10
+        
+        return max(0, min(100, score))
+
+def get_summary(transactions, budget, user_id=None, month=None):
+    """AnalyticsSummary for the inputs, memoized per (user, month, data version) when both are given"""
+    if user_id is None or month is None or isinstance(transactions, TransactionFrame):
+        frame = transactions if isinstance(transactions, TransactionFrame) else TransactionFrame.from_records(transactions)
+        return AnalyticsSummary(frame, budget)
+    key = ('analytics', user_id, month, data_version(transactions, budget))
+    return summary_cache.get_or_load(key, lambda: AnalyticsSummary(TransactionFrame.from_records(transactions), budget))
 
 class AdvancedAnalytics:
-    """Advanced analytics for spending patterns"""
+    """Advanced analytics for spending patterns
     
-    def __init__(self, transactions, budget):
-        self.transactions = transactions
+    Pass user_id and month to share the summary between pages and reruns;
+    it is recomputed only when the budget or a transaction changes.
+    """
+    
+    def __init__(self, transactions, budget, user_id=None, month=None):
+        # Only amount and bundle are read, so callers can pass the
+        # projected records from get_transaction_aggregates()
         self.budget = budget
+        self.summary = get_summary(transactions, budget, user_id, month)
     
     def get_spending_insights(self):
         """Get intelligent spending insights"""
         insights = []
+        bundles = self.summary.bundles
         
         # Insight 1: Overspending alert
-        for bundle in ['meals', 'groceries', 'rent']:
-            allocated = self.budget.get(bundle, 0)
-            remaining = self.budget.get(f'{bundle}_remaining', 0)
-            spent = allocated - remaining
-            percentage = (spent / allocated * 100) if allocated > 0 else 0
-            
-            if percentage > 90:
-                insights.append({
-                    'type': 'warning',
-                    'bundle': bundle,
-                    'message': f'⚠️ {bundle.title()} is 90%+ spent!',
-                    'action': 'Reduce spending or adjust budget'
-                })
+        for bundle in bundles.index[bundles['percentage'].to_numpy() > 90]:
+            insights.append({
+                'type': 'warning',
+                'bundle': bundle,
+                'message': f'⚠️ {bundle.title()} is 90%+ spent!',
+                'action': 'Reduce spending or adjust budget'
+            })
         
         # Insight 2: Savings progress
-        savings_remaining = self.budget.get('savings_remaining', 0)
-        savings_allocated = self.budget.get('savings', 0)
-        if savings_remaining == savings_allocated:
+        if self.summary.savings_untouched:
             insights.append({
                 'type': 'success',
                 'message': '💚 Great! You haven\'t touched savings this month!',
@@ -39,55 +110,34 @@ class AdvancedAnalytics:
             })
         
         # Insight 3: Spending pattern
-        if len(self.transactions) > 0:
-            avg_transaction = sum(t['amount'] for t in self.transactions) / len(self.transactions)
+        if self.summary.transaction_count > 0:
             insights.append({
                 'type': 'info',
-                'message': f'📊 Average transaction: ₹{avg_transaction:.0f}',
-                'action': f'You made {len(self.transactions)} transactions this month'
+                'message': f'📊 Average transaction: ₹{self.summary.average_transaction:.0f}',
+                'action': f'You made {self.summary.transaction_count} transactions this month'
             })
         
         return insights
     
     def predict_savings(self):
         """Predict potential savings"""
-        total_remaining = (self.budget.get('meals_remaining', 0) +
-                          self.budget.get('groceries_remaining', 0) +
-                          self.budget.get('rent_remaining', 0))
+        total_remaining = self.summary.total_remaining
         
         return {
             'current_remaining': total_remaining,
             'potential_emergency_fund': total_remaining,
-            'savings_percentage': (total_remaining / self.budget.get('monthly_income', 1) * 100)
+            'savings_percentage': (total_remaining / self.summary.monthly_income * 100)
         }
     
     def get_budget_health_score(self):
         """Calculate budget health score (0-100)"""
-        score = 100
-        
-        # Deduct for overspending
-        for bundle in ['meals', 'groceries', 'rent']:
-            allocated = self.budget.get(bundle, 0)
-            remaining = self.budget.get(f'{bundle}_remaining', 0)
-            spent = allocated - remaining
-            percentage = (spent / allocated * 100) if allocated > 0 else 0
-            
-            if percentage > 100:
-                score -= 10
-            elif percentage > 90:
-                score -= 5
-        
-        # Add points for savings protection
-        if self.budget.get('savings_remaining') == self.budget.get('savings'):
-            score += 10
-        
-        return max(0, min(100, score))
+        return self.summary.health_score
     
     def get_recommendations(self):
         """Get AI-like recommendations"""
         recommendations = []
         
-        health_score = self.get_budget_health_score()
+        health_score = self.summary.health_score
         
         if health_score < 50:
             recommendations.append("🔴 Your budget health is low. Consider reducing spending.")
@@ -97,10 +147,244 @@ class AdvancedAnalytics:
             recommendations.append("🟢 Excellent budget management! Keep it up!")
         
         # Check for specific issues
-        meals_spent = self.budget.get('meals', 0) - self.budget.get('meals_remaining', 0)
-        if meals_spent > 0:
-            avg_meal = meals_spent / len([t for t in self.transactions if t['bundle'] == 'meals']) if any(t['bundle'] == 'meals' for t in self.transactions) else 0
+        meals = self.summary.bundles.loc['meals']
+        if meals['spent'] > 0 and meals['count'] > 0:
+            avg_meal = meals['spent'] / meals['count']
             if avg_meal > 300:
                 recommendations.append("💡 Your average meal cost is high. Try cooking at home?")
         
         return recommendations
+    
+    def anomaly_detector(self, history=None):
+        """AnomalyDetector over this month's transactions, shared through the memoized summary
+        
+        history is {recipient: payment count} from earlier months (see
+        SpendingAccumulator.recipient_counts); the detector is rebuilt when
+        it differs from the cached one's.
+        """
+        key = frozenset((history or {}).items())
+        if self.summary.anomalies is None or self.summary.anomalies[0] != key:
+            self.summary.anomalies = (key, AnomalyDetector(self.summary.frame, history=history))
+        return self.summary.anomalies[1]
+    
+    def project_month_end(self, month, method='ewma', today=None):
+        """Projected end-of-month spend and balance per spending bundle (see utils.projections)"""
+        return projections.bundle_projection(self.summary.frame, self.budget, month, SPENDING_BUNDLES, method, today)
+
+# ==================== ANOMALY DETECTION ====================
+
+# Robust z-score (0.6745 * deviation / MAD) above which an amount is unusual
+ANOMALY_THRESHOLD = 3.5
+# Payments a recipient or bundle needs before its typical amount is trusted
+MIN_HISTORY = 5
+# This many payments inside the window make a burst
+BURST_COUNT = 5
+BURST_WINDOW = pd.Timedelta(hours=1)
+# A first payment to a recipient is large above this multiple of the overall median
+FIRST_TIME_MULTIPLE = 3.0
+
+def _robust_z(amounts, median, mad):
+    # A MAD of 0 (identical payments) falls back to a tenth of the median so jumps still register
+    scale = np.maximum(mad, np.maximum(0.1 * np.abs(median), 1.0))
+    return 0.6745 * (amounts - median) / scale
+
+class AnomalyDetector:
+    """Flags unusual payments against a TransactionFrame of history
+    
+    An amount is unusual when its robust z-score (median/MAD) within the
+    recipient's or the bundle's payments exceeds the threshold; bursts are
+    BURST_COUNT payments within BURST_WINDOW; a first-time recipient is
+    flagged when paid more than FIRST_TIME_MULTIPLE times the median.
+    Recipients in history ({recipient: payment count} from earlier months)
+    are never first-time. score() rescans the whole frame; score_payment() checks one payment
+    in O(1) against statistics computed once here.
+    """
+    
+    def __init__(self, frame, threshold=ANOMALY_THRESHOLD, history=None):
+        self.frame = frame
+        self.threshold = threshold
+        self.history = history or {}
+        df = frame.df
+        self.median = float(np.median(frame.amounts)) if len(frame) else 0.0
+        self._stats = {column: self._group_stats(df, column) for column in ('recipient', 'bundle')}
+        self._lookup = {column: {key: tuple(row) for key, row in zip(stats.index, stats.to_numpy())}
+                        for column, stats in self._stats.items()}
+        self._seen = set(df['recipient'].dropna().unique()) | set(self.history)
+        times = df['timestamp'].dropna().sort_values()
+        self._recent = deque((timestamp.to_pydatetime() for timestamp in times.iloc[-BURST_COUNT:]), maxlen=BURST_COUNT)
+    
+    @staticmethod
+    def _group_stats(df, column):
+        """DataFrame indexed by group with median, mad and count of amounts"""
+        grouped = df.groupby(column, observed=True)['amount']
+        deviation = (df['amount'] - grouped.transform('median')).abs()
+        return pd.DataFrame({
+            'median': grouped.median(),
+            'mad': deviation.groupby(df[column], observed=True).median(),
+            'count': grouped.count(),
+        })
+    
+    def _group_z(self, column):
+        df = self.frame.df
+        stats = self._stats[column].reindex(df[column].cat.categories)
+        codes = df[column].cat.codes.to_numpy()
+        known = codes >= 0
+        median, mad, count = (stats[name].to_numpy(dtype='float64')[codes] for name in ('median', 'mad', 'count'))
+        z = _robust_z(df['amount'].to_numpy(), median, mad)
+        return np.where(known & (count >= MIN_HISTORY), z, 0.0)
+    
+    def score(self):
+        """Score every payment in the frame
+        
+        Returns a DataFrame aligned with the frame: recipient, bundle, amount,
+        timestamp, recipient_z, bundle_z, burst (payments in the window up to
+        this one), first_time_large, score and anomalous.
+        """
+        df = self.frame.df
+        result = df[['recipient', 'bundle', 'amount', 'timestamp']].copy()
+        result['recipient_z'] = self._group_z('recipient')
+        result['bundle_z'] = self._group_z('bundle')
+        
+        times = df['timestamp'].dropna().sort_values()
+        counts = pd.Series(1.0, index=times.to_numpy()).rolling(BURST_WINDOW).sum().to_numpy()
+        result['burst'] = 0
+        result.loc[times.index, 'burst'] = counts.astype(int)
+        
+        recipients = df.loc[times.index, 'recipient']
+        first = ~recipients.duplicated() & ~recipients.isin(list(self.history))
+        result['first_time_large'] = False
+        if len(df) >= MIN_HISTORY:
+            result.loc[times.index, 'first_time_large'] = (
+                first & (df.loc[times.index, 'amount'] > FIRST_TIME_MULTIPLE * self.median)).to_numpy()
+        
+        result['score'] = result[['recipient_z', 'bundle_z']].max(axis=1)
+        result['anomalous'] = ((result['score'] > self.threshold) | (result['burst'] >= BURST_COUNT)
+                               | result['first_time_large'])
+        return result
+    
+    def score_payment(self, recipient, amount, bundle, timestamp=None):
+        """Score one prospective payment in O(1)
+        
+        Returns {'score', 'anomalous', 'reasons'} where reasons are short
+        messages for the user.
+        """
+        timestamp = timestamp or datetime.now()
+        reasons = []
+        score = 0.0
+        for column, key, label in (('recipient', recipient, recipient), ('bundle', bundle, f'{bundle} payments')):
+            stats = self._lookup[column].get(key)
+            if stats is None or stats[2] < MIN_HISTORY:
+                continue
+            median, mad, _ = stats
+            z = float(_robust_z(amount, median, mad))
+            score = max(score, z)
+            if z > self.threshold:
+                reasons.append(f'₹{amount:,.0f} is far above your usual ₹{median:,.0f} for {label}')
+        
+        recent = sum(1 for seen in self._recent if timestamp - seen <= BURST_WINDOW)
+        if recent + 1 >= BURST_COUNT:
+            reasons.append(f'{recent + 1} payments within {BURST_WINDOW.seconds // 60} minutes')
+        
+        if (recipient not in self._seen and len(self.frame) >= MIN_HISTORY
+                and amount > FIRST_TIME_MULTIPLE * self.median):
+            reasons.append(f'First payment to {recipient} and larger than usual')
+        
+        return {'score': score, 'anomalous': bool(reasons), 'reasons': reasons}
+
+# ==================== INCREMENTAL AGGREGATES ====================
+
+# Rollup fields that add up when accumulators are merged
+MERGED_FIELDS = ('total_spent', 'transaction_count', 'sum_squares', 'bundles', 'recipients', 'days')
+
+def _numeric_paths(doc, prefix=''):
+    """Flatten nested numeric fields into (dotted path, value) pairs"""
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            yield from _numeric_paths(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f'{prefix}{key}', value
+
+class SpendingAccumulator:
+    """Running spending aggregates updated in O(1) per transaction
+    
+    The state is a rollup document (see utils.rollups): counts, sums, sum
+    of squares, per-bundle and per-recipient totals and a day-of-month
+    histogram. Stored monthly rollups load directly, to_dict() serializes
+    it, and merge() combines months without touching any transactions.
+    """
+    
+    def __init__(self, state=None, month=None):
+        self.state = state if state is not None else rollups.empty_rollup(month)
+    
+    @classmethod
+    def from_rollup(cls, rollup, month=None):
+        return cls(copy.deepcopy(rollup)) if rollup else cls(month=month)
+    
+    from_dict = from_rollup
+    
+    def to_dict(self):
+        return copy.deepcopy(self.state)
+    
+    # ==================== UPDATES ====================
+    
+    def add(self, transaction):
+        apply_increments(self.state, rollups.transaction_delta(transaction))
+        return self
+    
+    def remove(self, transaction):
+        apply_increments(self.state, rollups.transaction_delta(transaction, sign=-1))
+        return self
+    
+    def recategorize(self, amount, old_bundle, new_bundle):
+        apply_increments(self.state, rollups.recategorize_delta(amount, old_bundle, new_bundle))
+        return self
+    
+    def merge(self, other):
+        """Add another accumulator's totals (e.g. another month) into this one"""
+        months = sorted(set(self.months) | set(other.months))
+        apply_increments(self.state, dict(_numeric_paths({field: other.state[field] for field in MERGED_FIELDS
+                                                          if field in other.state})))
+        self.state['months'] = months
+        return self
+    
+    # ==================== READS ====================
+    
+    @property
+    def months(self):
+        return self.state.get('months') or ([self.state['month']] if self.state.get('month') else [])
+    
+    @property
+    def count(self):
+        return self.state.get('transaction_count', 0)
+    
+    @property
+    def total(self):
+        return self.state.get('total_spent', 0)
+    
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+    
+    @property
+    def variance(self):
+        if not self.count:
+            return 0.0
+        return max(0.0, self.state.get('sum_squares', 0) / self.count - self.mean ** 2)
+    
+    @property
+    def std(self):
+        return self.variance ** 0.5
+    
+    def bundle_totals(self):
+        return rollups.bundle_totals(self.state)
+    
+    def recipient_totals(self):
+        return {rollups.recipient_name(key): totals.get('amount', 0)
+                for key, totals in self.state.get('recipients', {}).items() if totals.get('count', 0)}
+    
+    def recipient_counts(self):
+        return {rollups.recipient_name(key): totals['count']
+                for key, totals in self.state.get('recipients', {}).items() if totals.get('count', 0)}
+    
+    def day_totals(self):
+        return dict(sorted(self.state.get('days', {}).items()))
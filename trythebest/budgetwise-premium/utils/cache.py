@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cache keys are (kind, user_id, month) tuples; month is None for
+# user-level documents such as the emergency fund or savings goals.
+
+# ==================== REQUEST SCOPE ====================
+
+# Every Streamlit rerun executes app.py on its own script thread, so a
+# thread-local dict gives each rerun (and each session) a private scope.
+_request_local = threading.local()
+
+def begin_request():
+    """Start a fresh request scope; call once at the top of every rerun"""
+    _request_local.entries = {}
+
+def end_request():
+    """Drop the current request scope"""
+    _request_local.entries = None
+
+def request_cached(key, loader):
+    """Return the value for key, calling loader at most once per request scope
+
+    Outside a request scope (background threads, scripts) the loader is
+    called every time.
+    """
+    entries = getattr(_request_local, 'entries', None)
+    if entries is None:
+        return loader()
+    if key not in entries:
+        entries[key] = loader()
+    return entries[key]
+
+def _matches(key, user_id, month, kinds):
+    return (key[1] == user_id
+            and (month is None or key[2] == month)
+            and (kinds is None or key[0] in kinds))
+
+def invalidate_request(user_id, month=None, kinds=None):
+    """Forget cached reads for a user (optionally one month or some kinds)"""
+    entries = getattr(_request_local, 'entries', None)
+    if not entries:
+        return
+    for key in list(entries):
+        if _matches(key, user_id, month, kinds):
+            del entries[key]
+
+# ==================== SHARED TTL CACHE ====================
+
+class TTLCache:
+    """Process-wide LRU cache whose entries expire after ttl seconds
+
+    Values are shared between sessions, so callers must treat them as
+    read-only.
+    """
+    
+    def __init__(self, ttl=30.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """Return (found, value) for a live entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+    
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entry"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def get_stale(self, key):
+        """Return (found, value) even if the entry has expired (degraded reads)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return (False, None) if entry is None else (True, entry[1])
+    
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, loading and storing it on a miss"""
+        if self.ttl <= 0:
+            return loader()
+        found, value = self.get(key)
+        if found:
+            return value
+        value = loader()
+        self.put(key, value)
+        return value
+    
+    def invalidate(self, user_id, month=None, kinds=None):
+        """Drop entries for a user (optionally one month or some kinds)"""
+        with self._lock:
+            for key in list(self._entries):
+                if _matches(key, user_id, month, kinds):
+                    del self._entries[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            }
+
+shared_cache = TTLCache(
+    ttl=float(os.getenv('BUDGETWISE_CACHE_TTL', '30')),
+    max_entries=int(os.getenv('BUDGETWISE_CACHE_SIZE', '1024')),
+)
+
+# ==================== COMBINED ====================
+
+def cached_read(key, loader):
+    """Read through the request scope, then the shared TTL cache"""
+    return request_cached(key, lambda: shared_cache.get_or_load(key, loader))
+
+def cache_write(key, value):
+    """Write-through: store a freshly written document in both layers"""
+    shared_cache.put(key, value)
+    entries = getattr(_request_local, 'entries', None)
+    if entries is not None:
+        entries[key] = value
+
+def invalidate(user_id, month=None, kinds=None):
+    """Invalidate both cache layers after a write"""
+    invalidate_request(user_id, month, kinds)
+    shared_cache.invalidate(user_id, month, kinds)
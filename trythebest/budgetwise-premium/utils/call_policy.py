@@ -0,0 +1,191 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+
+logger = logging.getLogger('budgetwise.data')
+
+# Error codes for DataCallError and the structured results built from it
+DEADLINE_EXCEEDED = 'DEADLINE_EXCEEDED'
+UNAVAILABLE = 'UNAVAILABLE'
+CIRCUIT_OPEN = 'CIRCUIT_OPEN'
+CALL_FAILED = 'CALL_FAILED'
+# A write failed in a way that leaves unknown whether it was applied
+OUTCOME_UNKNOWN = 'OUTCOME_UNKNOWN'
+
+class DataCallError(Exception):
+    """A data call the policy gave up on"""
+
+    def __init__(self, op, code, message):
+        super().__init__(f'{op}: {message}')
+        self.op = op
+        self.code = code
+        self.message = message
+        self.time = datetime.now()
+
+    def as_result(self):
+        """Failure dict in the shape payment and write helpers return"""
+        return {'success': False, 'error': self.message, 'error_code': self.code}
+
+    def as_dict(self):
+        return {'op': self.op, 'code': self.code, 'message': self.message, 'time': self.time}
+
+def is_transient(error):
+    """True for failures worth retrying: timeouts, dropped connections, throttling, busy locks"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, sqlite3.OperationalError):
+        return 'locked' in str(error) or 'busy' in str(error)
+    try:
+        from google.api_core import exceptions as api_exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (api_exceptions.ServiceUnavailable, api_exceptions.DeadlineExceeded,
+                              api_exceptions.InternalServerError, api_exceptions.TooManyRequests,
+                              api_exceptions.Aborted))
+
+class CircuitBreaker:
+    """Stops calling a backend that keeps failing
+
+    Opens after failure_threshold consecutive failed calls. Once open,
+    calls are refused until reset_timeout seconds have passed; then a
+    single trial call is let through (half-open) and its outcome closes
+    or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return 'open'
+            return 'half_open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+class CallPolicy:
+    """Deadline, retry and circuit-breaker rules for backend calls
+
+    Idempotent calls (reads) run on a worker thread so the caller stops
+    waiting at the deadline; the worker cannot be interrupted and finishes
+    in the background. They are retried on transient errors with
+    full-jitter exponential backoff inside the same deadline.
+
+    Other calls (writes) run on the caller's thread and are not retried:
+    abandoning a write that then commits would report a failure that did
+    not happen. Backends bound each write RPC with write_deadline instead,
+    so a hung write ends in a DeadlineExceeded. That, like any transient
+    error during a write, is raised as OUTCOME_UNKNOWN, since the backend
+    may have applied it.
+
+    Errors that are not transient (missing documents, bad input) are
+    re-raised as-is and do not count against the breaker. Every call,
+    including the ones refused by the breaker, is reported to metrics (a
+    utils.metrics.Metrics).
+    """
+
+    def __init__(self, deadline=5.0, retries=2, base_delay=0.1, max_delay=1.0, breaker=None, max_workers=16,
+                 metrics=None, write_deadline=10.0):
+        self.deadline = deadline
+        self.write_deadline = write_deadline
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics
+        self.recent_errors = deque(maxlen=50)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='budgetwise-data')
+
+    def failed(self, op, code, message):
+        """Log and remember a failure; returns the DataCallError for it"""
+        error = DataCallError(op, code, message)
+        self.recent_errors.append(error.as_dict())
+        logger.warning('%s failed (%s): %s', op, code, message)
+        return error
+
+    def call(self, op, fn, idempotent=False):
+        """Run fn() under the policy, raising DataCallError when it gives up"""
+        if self.metrics is None:
+            return self._call(op, fn, idempotent)
+        kind = 'read' if idempotent else 'write'
+        started = time.perf_counter()
+        try:
+            result = self._call(op, fn, idempotent)
+        except Exception as e:
+            self.metrics.observe(op, kind, time.perf_counter() - started, error=e)
+            raise
+        self.metrics.observe(op, kind, time.perf_counter() - started, result=result)
+        return result
+
+    def _call(self, op, fn, idempotent):
+        if not self.breaker.allow():
+            raise self.failed(op, CIRCUIT_OPEN, 'backend unavailable, not retrying yet')
+        if not idempotent:
+            return self._write(op, fn)
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            future = self._pool.submit(fn)
+            try:
+                result = future.result(timeout=max(0.0, deadline_at - time.monotonic()))
+            except FutureTimeout:
+                self.breaker.record_failure()
+                raise self.failed(op, DEADLINE_EXCEEDED, f'no response within {self.deadline:g}s')
+            except Exception as e:
+                if not is_transient(e):
+                    self.breaker.record_success()
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if attempt < self.retries and time.monotonic() + delay < deadline_at:
+                    attempt += 1
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_failure()
+                raise self.failed(op, UNAVAILABLE, str(e)) from e
+            self.breaker.record_success()
+            return result
+
+    def _write(self, op, fn):
+        try:
+            result = fn()
+        except Exception as e:
+            if not is_transient(e):
+                self.breaker.record_success()
+                raise
+            self.breaker.record_failure()
+            raise self.failed(op, OUTCOME_UNKNOWN, f'{e} (the write may or may not have been saved)') from e
+        self.breaker.record_success()
+        return result
@@ -1,34 +1,259 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import copy
 import os
 import json
+import threading
+from utils.analytics import SpendingAccumulator
+from utils.heavy_hitters import SpaceSaving, SKETCH_FIELD
+from utils.cache import cached_read, cache_write, invalidate, shared_cache
+from utils.call_policy import CallPolicy, CircuitBreaker, DataCallError, CALL_FAILED, UNAVAILABLE, logger
+from utils.live_mirror import LiveMirror
+from utils.metrics import metrics, current_page, set_page
+from utils.outbox import Outbox
+from utils.storage import create_backend, AGGREGATE_FIELDS
+from utils.storage.base import apply_increments, duplicate_payment, insufficient_balance, listed, page_key, project, projection
+from utils.rollups import transaction_delta, recategorize_delta, rebuild_rollup as _rebuild_rollup, bundle_totals, ROLLUP_VERSION
 
-# Initialize Firebase
-try:
-    cred = credentials.Certificate('firebase-key.json')
-except FileNotFoundError:
+# ==================== CLIENT ====================
+
+# Nothing touches Firebase at import time: the Firestore client and the
+# storage backend are built on first use (or by warm_up) and then shared
+# by every session and thread in the process.
+FIREBASE_KEY_PATH = 'firebase-key.json'
+
+_client_lock = threading.RLock()
+_db = None
+backend = None
+
+def has_firebase_credentials():
+    """True when a service-account key file or FIREBASE_KEY_JSON is available"""
+    return os.path.exists(FIREBASE_KEY_PATH) or bool(os.getenv('FIREBASE_KEY_JSON'))
+
+def _firebase_credentials():
+    from firebase_admin import credentials
+    if os.path.exists(FIREBASE_KEY_PATH):
+        return credentials.Certificate(FIREBASE_KEY_PATH)
     firebase_json = os.getenv('FIREBASE_KEY_JSON')
     if firebase_json:
-        cred = credentials.Certificate(json.loads(firebase_json))
-    else:
-        cred = None
+        return credentials.Certificate(json.loads(firebase_json))
+    raise RuntimeError(f"Firebase credentials not found: add {FIREBASE_KEY_PATH} or set FIREBASE_KEY_JSON")
+
+def get_db():
+    """Return the process-wide Firestore client, creating it on first use"""
+    global _db
+    if _db is None:
+        with _client_lock:
+            if _db is None:
+                import firebase_admin
+                from firebase_admin import firestore
+                try:
+                    app = firebase_admin.get_app()
+                except ValueError:
+                    app = firebase_admin.initialize_app(_firebase_credentials())
+                _db = firestore.client(app)
+    return _db
+
+def _backend_kind():
+    kind = os.getenv('BUDGETWISE_BACKEND')
+    if kind:
+        return kind
+    if has_firebase_credentials():
+        return 'firestore'
+    logger.warning('Firebase credentials not found; using the in-memory backend (data is lost on restart)')
+    return 'memory'
+
+def get_backend():
+    """Return the active storage backend, building it on first use
+
+    BUDGETWISE_BACKEND=firestore|memory|sqlite picks the store; without it
+    the app uses Firestore when credentials exist and memory otherwise.
+    """
+    global backend
+    if backend is None:
+        with _client_lock:
+            if backend is None:
+                kind = _backend_kind()
+                backend = create_backend(
+                    kind,
+                    db=get_db() if kind == 'firestore' else None,
+                    sqlite_path=os.getenv('BUDGETWISE_SQLITE_PATH', 'budgetwise.db'),
+                    validate_indexes=bool(os.getenv('BUDGETWISE_VALIDATE_INDEXES')),
+                    partition_by_month=os.getenv('BUDGETWISE_TRANSACTION_LAYOUT') == 'month',
+                    write_timeout=call_policy.write_deadline,
+                )
+    return backend
+
+def set_backend(new_backend):
+    """Swap the storage backend (tests, benchmarks, offline runs)"""
+    global backend
+    with _client_lock:
+        backend = new_backend
+    shared_cache.clear()
+
+def warm_up():
+    """Build the backend and open its connection before the first request"""
+    active = get_backend()
+    try:
+        active.warm_up()
+    except Exception as e:
+        _report('warm_up', e)
+    if os.getenv('BUDGETWISE_LIVE_MIRROR'):
+        enable_live_mirror()
+    if os.getenv('BUDGETWISE_METRICS_PATH'):
+        metrics.start_exporter(os.getenv('BUDGETWISE_METRICS_PATH'),
+                               fmt=os.getenv('BUDGETWISE_METRICS_FORMAT', 'prometheus'),
+                               interval=float(os.getenv('BUDGETWISE_METRICS_INTERVAL', '60')))
+    return active
+
+# ==================== CALL POLICY ====================
+
+# Every backend call gets a deadline (writes through the backend's RPC
+# timeout); reads are retried on transient errors, and once the backend keeps failing the circuit breaker makes
+# calls fail fast while reads fall back to the last cached value.
+call_policy = CallPolicy(
+    deadline=float(os.getenv('BUDGETWISE_CALL_DEADLINE', '5')),
+    retries=int(os.getenv('BUDGETWISE_CALL_RETRIES', '2')),
+    write_deadline=float(os.getenv('BUDGETWISE_WRITE_DEADLINE', '10')),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv('BUDGETWISE_BREAKER_FAILURES', '5')),
+        reset_timeout=float(os.getenv('BUDGETWISE_BREAKER_RESET', '30')),
+    ),
+    metrics=metrics,
+)
+
+def _read(op, key, loader):
+    # Stale values are re-cached for one TTL, which keeps a degraded
+    # backend from being asked again on every rerun.
+    def load():
+        try:
+            return call_policy.call(op, loader, idempotent=True)
+        except DataCallError:
+            found, value = shared_cache.get_stale(key)
+            if not found:
+                raise
+            return value
+    return cached_read(key, load)
+
+def _write(op, fn, user_id, month=None, kinds=None):
+    """Run a backend write; the caches are invalidated however it ends
+
+    A write that raised may still have been applied, so its cached reads
+    are stale either way.
+    """
+    try:
+        return call_policy.call(op, fn)
+    finally:
+        invalidate(user_id, month, kinds=kinds)
+
+def _report(op, error):
+    """Structured error for a failed data function (already logged)"""
+    if isinstance(error, DataCallError):
+        return error
+    return call_policy.failed(op, CALL_FAILED, str(error))
+
+def get_data_metrics():
+    """Per (op, page, kind) call counts, documents, bytes and latency buckets"""
+    return metrics.snapshot()
+
+def export_data_metrics(path, fmt='prometheus'):
+    """Write data-call metrics as Prometheus text or append them as JSON lines"""
+    metrics.export(path, fmt)
+
+def get_data_health():
+    """Circuit breaker state and the most recent data-call errors"""
+    return {'state': call_policy.breaker.state, 'recent_errors': list(call_policy.recent_errors)}
+
+# ==================== WRITE-BEHIND OUTBOX ====================
+
+# With BUDGETWISE_OUTBOX_PATH set, payments are journaled locally and
+# confirmed right away; a background thread delivers them to the backend.
+outbox = None
+
+def _deliver(entry):
+    payload = entry['payload']
+    return _write('deliver_payment', lambda: get_backend().commit_payment(
+        entry['user_id'], entry['month'], payload['record'],
+        deduct=payload['deduct'], rollup=payload['rollup'], transaction_id=entry['key']),
+        entry['user_id'], entry['month'], kinds=('budget', 'transactions', 'rollup'))
+
+def enable_outbox(path):
+    """Start journaling payments to a local outbox at path"""
+    global outbox
+    if outbox is None:
+        outbox = Outbox(path, _deliver)
+        outbox.start()
+    return outbox
+
+def _pending_payments(user_id, month):
+    if outbox is None:
+        return []
+    return [{**entry['payload'], 'id': entry['key']} for entry in outbox.pending(user_id, month) if entry['op'] == 'payment']
+
+def get_rejected_payments(user_id):
+    """Queued payments the backend refused after they were confirmed locally"""
+    return outbox.rejected(user_id) if outbox is not None else []
+
+if os.getenv('BUDGETWISE_OUTBOX_PATH'):
+    enable_outbox(os.getenv('BUDGETWISE_OUTBOX_PATH'))
+
+# ==================== LIVE MIRROR ====================
 
-if cred:
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
-else:
-    db = None
+# Opt-in (BUDGETWISE_LIVE_MIRROR=1, Firestore only): snapshot listeners keep
+# the viewed users' budgets and transactions in process, so reads skip the
+# network and edits from other tabs or devices land without a refetch.
+live_mirror = None
+
+def _mirror_changed(user_id, month):
+    invalidate(user_id, month, kinds=('budget', 'transactions', 'rollup'))
+
+def enable_live_mirror(max_subscriptions=None, idle_timeout=None):
+    """Serve budget and transaction reads from snapshot listeners"""
+    global live_mirror
+    with _client_lock:
+        if live_mirror is None:
+            active = get_backend()
+            if active.name != 'firestore':
+                logger.warning('Live mirror needs the firestore backend, not %s; reading directly', active.name)
+                return None
+            live_mirror = LiveMirror(
+                active,
+                max_subscriptions=max_subscriptions or int(os.getenv('BUDGETWISE_MIRROR_SIZE', '64')),
+                idle_timeout=idle_timeout or float(os.getenv('BUDGETWISE_MIRROR_IDLE', '300')),
+                on_change=_mirror_changed,
+            )
+    return live_mirror
+
+def watch_user(session_id, user_id, month):
+    """Keep listeners attached while this session views user_id's month"""
+    if live_mirror is None:
+        return
+    try:
+        live_mirror.touch(session_id, user_id, month)
+    except Exception as e:
+        _report('watch_user', e)
+
+def _load_budget(user_id, month):
+    if live_mirror is not None:
+        found, budget = live_mirror.get_budget(user_id, month)
+        if found:
+            return budget
+    return get_backend().get_budget(user_id, month)
+
+def _load_transactions(user_id, month, limit, start_after, fields):
+    if live_mirror is not None:
+        found, transactions = live_mirror.get_transactions(user_id, month, limit=limit,
+                                                           start_after=start_after, fields=fields)
+        if found:
+            return transactions
+    return get_backend().list_transactions(user_id, month, limit=limit, start_after=start_after, fields=fields)
 
 # ==================== USER OPERATIONS ====================
 
 def create_user(user_id, email, name):
     """Create new user profile"""
     try:
-        if not db:
-            return True
-        
-        db.collection('users').document(user_id).set({
+        profile = {
             'email': email,
             'name': name,
             'created_at': datetime.now(),
@@ -36,22 +261,20 @@ def create_user(user_id, email, name):
             'savings_goal': 0,
             'spending_habits': {},
             'notifications_enabled': True,
-        })
+        }
+        _write('create_user', lambda: get_backend().create_user(user_id, profile),
+               user_id, kinds=('emergency_fund', 'user'))
         return True
     except Exception as e:
-        print(f"Error creating user: {e}")
+        _report('create_user', e)
         return False
 
 def get_user_profile(user_id):
     """Get user profile"""
     try:
-        if not db:
-            return {'name': 'Demo User', 'emergency_fund': 2870}
-        
-        doc = db.collection('users').document(user_id).get()
-        return doc.to_dict() if doc.exists else None
+        return call_policy.call('get_user', lambda: get_backend().get_user(user_id), idempotent=True)
     except Exception as e:
-        print(f"Error fetching user: {e}")
+        _report('get_user_profile', e)
         return None
 
 # ==================== BUDGET OPERATIONS ====================
@@ -59,10 +282,7 @@ def get_user_profile(user_id):
 def create_budget(user_id, month, budget_data):
     """Create monthly budget"""
     try:
-        if not db:
-            return True
-        
-        db.collection('budgets').document(user_id).collection('monthly').document(month).set({
+        budget = {
             'monthly_income': budget_data['income'],
             'meals': budget_data['meals'],
             'groceries': budget_data['groceries'],
@@ -75,102 +295,221 @@ def create_budget(user_id, month, budget_data):
             'created_at': datetime.now(),
             'month': month,
             'alerts_sent': 0,
-        })
+        }
+        previous = get_budget(user_id, month)
+        if previous and SKETCH_FIELD in previous:
+            budget[SKETCH_FIELD] = previous[SKETCH_FIELD]
+        _write('create_budget', lambda: get_backend().set_budget(user_id, month, budget),
+               user_id, month, kinds=('budget',))
+        cache_write(('budget', user_id, month), budget)
         return True
     except Exception as e:
-        print(f"Error creating budget: {e}")
+        _report('create_budget', e)
         return False
 
 def get_budget(user_id, month):
-    """Get monthly budget"""
+    """Get monthly budget (cached), including deductions still in the outbox"""
     try:
-        if not db:
-            return {
-                'monthly_income': 45000,
-                'meals': 8000,
-                'groceries': 6000,
-                'rent': 25000,
-                'savings': 6000,
-                'meals_remaining': 7800,
-                'groceries_remaining': 5920,
-                'rent_remaining': 25000,
-                'savings_remaining': 6000,
-            }
-        
-        doc = db.collection('budgets').document(user_id).collection('monthly').document(month).get()
-        return doc.to_dict() if doc.exists else None
+        budget = _read('get_budget', ('budget', user_id, month), lambda: _load_budget(user_id, month))
+        pending = [payment for payment in _pending_payments(user_id, month) if payment['deduct']]
+        if budget and pending:
+            budget = dict(budget)
+            for payment in pending:
+                field_name = f"{payment['record']['bundle']}_remaining"
+                budget[field_name] = budget.get(field_name, 0) - payment['record']['amount']
+        return budget
     except Exception as e:
-        print(f"Error fetching budget: {e}")
+        _report('get_budget', e)
         return None
 
 def update_budget_remaining(user_id, month, bundle, new_amount):
     """Update remaining amount in bundle"""
     try:
-        if not db:
-            return True
-        
-        field_name = f'{bundle}_remaining'
-        db.collection('budgets').document(user_id).collection('monthly').document(month).update({
-            field_name: new_amount
-        })
+        fields = {f'{bundle}_remaining': new_amount}
+        _write('update_budget', lambda: get_backend().update_budget(user_id, month, fields),
+               user_id, month, kinds=('budget',))
+        return True
+    except Exception as e:
+        _report('update_budget_remaining', e)
+        return False
+
+def adjust_budget_remaining(user_id, month, bundle, delta):
+    """Atomically add delta (negative to spend) to a bundle's remaining amount"""
+    try:
+        _write('adjust_budget', lambda: get_backend().increment_budget(user_id, month, f'{bundle}_remaining', delta),
+               user_id, month, kinds=('budget',))
         return True
     except Exception as e:
-        print(f"Error updating budget: {e}")
+        _report('adjust_budget_remaining', e)
         return False
 
+def spend_from_bundle(user_id, month, bundle, amount):
+    """Deduct amount from a bundle only if enough is left, in one transaction"""
+    try:
+        return _write('spend_from_bundle', lambda: get_backend().spend_from_bundle(user_id, month, bundle, amount),
+                      user_id, month, kinds=('budget',))
+    except Exception as e:
+        return _report('spend_from_bundle', e).as_result()
+
 # ==================== TRANSACTION OPERATIONS ====================
 
+def _transaction_record(month, transaction_data):
+    return {
+        'recipient': transaction_data['recipient'],
+        'amount': transaction_data['amount'],
+        'bundle': transaction_data['bundle'],
+        'note': transaction_data.get('note', ''),
+        'timestamp': datetime.now(),
+        'month': month,
+        'status': transaction_data.get('status', 'completed'),
+        'upi_id': transaction_data.get('upi_id', ''),
+        'category': transaction_data.get('category', transaction_data['bundle']),
+    }
+
 def record_transaction(user_id, month, transaction_data):
     """Record a transaction"""
     try:
-        if not db:
+        record = _transaction_record(month, transaction_data)
+        if outbox is not None:
+            outbox.enqueue(user_id, month, 'payment',
+                           {'record': record, 'deduct': False, 'rollup': transaction_delta(record)})
             return True
         
-        db.collection('transactions').document(user_id).collection('records').add({
-            'recipient': transaction_data['recipient'],
-            'amount': transaction_data['amount'],
-            'bundle': transaction_data['bundle'],
-            'note': transaction_data.get('note', ''),
-            'timestamp': datetime.now(),
-            'month': month,
-            'status': 'completed',
-            'upi_id': transaction_data.get('upi_id', ''),
-            'category': transaction_data.get('category', transaction_data['bundle']),
-        })
+        _write('record_transaction', lambda: get_backend().commit_payment(
+            user_id, month, record, deduct=False, rollup=transaction_delta(record)),
+            user_id, month, kinds=('budget', 'transactions', 'rollup'))
         return True
     except Exception as e:
-        print(f"Error recording transaction: {e}")
+        _report('record_transaction', e)
         return False
 
-def get_transactions(user_id, month):
-    """Get all transactions for a month"""
+def commit_payment(user_id, month, transaction_data, update_rollup=True, transaction_id=None):
+    """Record a payment and deduct it from its bundle in one atomic commit
+
+    The bundle balance is re-checked inside the commit. Uncategorized
+    payments are recorded without a deduction. With update_rollup the
+    monthly rollup is bumped as part of the same commit.
+    
+    transaction_id is the payment's idempotency key: committing the same
+    key again returns the first result with 'duplicate': True instead of
+    charging twice, so a payment whose outcome was OUTCOME_UNKNOWN can be
+    retried safely with it.
+    
+    When the outbox is enabled the payment is checked against the locally
+    known balance, journaled and confirmed with 'queued': True; the
+    backend commit happens in the background.
+    """
     try:
-        if not db:
-            return [
-                {'recipient': 'Starbucks', 'amount': 200, 'bundle': 'meals', 'timestamp': datetime.now() - timedelta(hours=2), 'status': 'completed'},
-                {'recipient': 'DMart', 'amount': 80, 'bundle': 'groceries', 'timestamp': datetime.now() - timedelta(days=1), 'status': 'completed'},
-            ]
-        
-        docs = db.collection('transactions').document(user_id).collection('records').where('month', '==', month).order_by('timestamp', direction=firestore.Query.DESCENDING).stream()
-        return [doc.to_dict() for doc in docs]
+        record = _transaction_record(month, transaction_data)
+        rollup = transaction_delta(record) if update_rollup else None
+        deduct = record['bundle'] != 'uncategorized'
+        if outbox is not None:
+            return _queue_payment(user_id, month, record, deduct, rollup, transaction_id)
+        return _write('commit_payment', lambda: get_backend().commit_payment(
+            user_id, month, record, deduct=deduct, rollup=rollup, transaction_id=transaction_id),
+            user_id, month, kinds=('budget', 'transactions', 'rollup'))
+    except Exception as e:
+        return _report('commit_payment', e).as_result()
+
+def _queue_payment(user_id, month, record, deduct, rollup, transaction_id=None):
+    if transaction_id and any(payment['id'] == transaction_id for payment in _pending_payments(user_id, month)):
+        return {**duplicate_payment(transaction_id), 'queued': True}
+    new_balance = None
+    if deduct:
+        budget = get_budget(user_id, month)
+        if not budget:
+            return {'success': False, 'error': 'No budget set up', 'error_code': 'NO_BUDGET'}
+        remaining = budget.get(f"{record['bundle']}_remaining", 0)
+        if record['amount'] > remaining:
+            return insufficient_balance(remaining)
+        new_balance = remaining - record['amount']
+    key = outbox.enqueue(user_id, month, 'payment', {'record': record, 'deduct': deduct, 'rollup': rollup},
+                         key=transaction_id)
+    return {'success': True, 'transaction_id': key, 'new_balance': new_balance, 'queued': True}
+
+def get_transactions(user_id, month, limit=None, start_after=None, fields=None):
+    """Get transactions for a month, newest first (cached)
+
+    limit caps the number of records, start_after is the last record of the
+    previous page and fields restricts each record to those keys. Payments
+    still waiting in the outbox are merged in.
+    """
+    try:
+        fields = tuple(fields) if fields else None
+        cursor = page_key(start_after) if start_after else None
+        transactions = _read('get_transactions', ('transactions', user_id, month, limit, cursor, fields),
+                             lambda: _load_transactions(user_id, month, limit, start_after, fields))
+        pending = [
+            listed(project(payment['record'], projection(fields)), payment['id'], None)
+            for payment in _pending_payments(user_id, month)
+        ]
+        pending = [record for record in pending if cursor is None or page_key(record) < cursor]
+        if pending:
+            transactions = sorted(pending + transactions, key=page_key, reverse=True)[:limit]
+        return transactions
     except Exception as e:
-        print(f"Error fetching transactions: {e}")
+        _report('get_transactions', e)
         return []
 
+def get_transaction_aggregates(user_id, month):
+    """Get a month's transactions projected to amount, bundle and timestamp (cached)"""
+    return get_transactions(user_id, month, fields=AGGREGATE_FIELDS)
+
+def iter_transaction_pages(user_id, month, page_size=100, fields=None):
+    """Yield a month's transactions lazily, one page (list) at a time"""
+    start_after = None
+    while True:
+        page = call_policy.call('list_transactions', lambda: get_backend().list_transactions(
+            user_id, month, limit=page_size, start_after=start_after, fields=fields), idempotent=True)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        start_after = page[-1]
+
+# ==================== ROLLUPS ====================
+
+def get_rollup(user_id, month):
+    """Get the month's spending rollup, rebuilding it if it was never completed (cached)"""
+    try:
+        rollup = _read('get_rollup', ('rollup', user_id, month), lambda: _load_rollup(user_id, month))
+        return _with_pending(rollup, user_id, month) if rollup else rollup
+    except Exception as e:
+        _report('get_rollup', e)
+        return None
+
+def _load_rollup(user_id, month):
+    rollup = get_backend().get_rollup(user_id, month)
+    if not rollup or not rollup.get('complete') or rollup.get('version', 1) < ROLLUP_VERSION:
+        rollup = _rebuild_rollup(get_backend(), user_id, month)
+    return rollup
+
+def _with_pending(rollup, user_id, month):
+    pending = [payment['rollup'] for payment in _pending_payments(user_id, month) if payment['rollup']]
+    if not pending:
+        return rollup
+    rollup = copy.deepcopy(rollup)
+    for increments in pending:
+        apply_increments(rollup, increments)
+    return rollup
+
+def rebuild_rollup(user_id, month):
+    """Recompute the month's rollup from the raw transaction records"""
+    try:
+        return _write('rebuild_rollup', lambda: _rebuild_rollup(get_backend(), user_id, month),
+                      user_id, month, kinds=('rollup',))
+    except Exception as e:
+        _report('rebuild_rollup', e)
+        return None
+
 def get_spending_by_category(user_id, month):
     """Get spending breakdown by category"""
     try:
-        transactions = get_transactions(user_id, month)
-        breakdown = {'meals': 0, 'groceries': 0, 'rent': 0}
-        
-        for trans in transactions:
-            bundle = trans.get('bundle', '')
-            if bundle in breakdown:
-                breakdown[bundle] += trans.get('amount', 0)
-        
-        return breakdown
+        rollup = get_rollup(user_id, month)
+        spent = bundle_totals(rollup) if rollup else {}
+        return {bundle: spent.get(bundle, 0) for bundle in ['meals', 'groceries', 'rent']}
     except Exception as e:
-        print(f"Error getting spending breakdown: {e}")
+        _report('get_spending_by_category', e)
         return {'meals': 0, 'groceries': 0, 'rent': 0}
 
 # ==================== ANALYTICS ====================
@@ -179,70 +518,120 @@ def get_monthly_stats(user_id, month):
     """Get monthly statistics"""
     try:
         budget = get_budget(user_id, month)
-        transactions = get_transactions(user_id, month)
         
         if not budget:
             return None
         
+        rollup = get_rollup(user_id, month) or {}
+        
         return {
             'total_income': budget['monthly_income'],
             'total_allocated': budget['meals'] + budget['groceries'] + budget['rent'] + budget['savings'],
-            'total_spent': sum(t['amount'] for t in transactions),
+            'total_spent': rollup.get('total_spent', 0),
             'total_remaining': (budget['meals_remaining'] + budget['groceries_remaining'] + 
                               budget['rent_remaining'] + budget['savings_remaining']),
-            'transaction_count': len(transactions),
+            'transaction_count': rollup.get('transaction_count', 0),
             'bundles_used': len([b for b in ['meals', 'groceries', 'rent'] 
                                 if budget[f'{b}_remaining'] < budget[b]]),
         }
     except Exception as e:
-        print(f"Error getting monthly stats: {e}")
+        _report('get_monthly_stats', e)
         return None
 
+TREND_MAX_MONTHS = 36
+TREND_WORKERS = int(os.getenv('BUDGETWISE_TREND_WORKERS', '8'))
+
+def _recent_months(count, today=None):
+    """Calendar month keys (YYYY-MM), newest first, starting with today's month"""
+    today = today or datetime.now()
+    year, month = today.year, today.month
+    keys = []
+    for _ in range(count):
+        keys.append(f'{year:04d}-{month:02d}')
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return keys
+
 def get_spending_trend(user_id, months=3):
-    """Get spending trend over multiple months"""
+    """Get spending trend over multiple months (newest first, up to 36)
+
+    Months are fetched concurrently on a bounded thread pool.
+    """
     try:
-        trends = []
-        today = datetime.now()
+        month_keys = _recent_months(max(1, min(months, TREND_MAX_MONTHS)))
+        page = current_page()
         
-        for i in range(months):
-            month = (today - timedelta(days=30*i)).strftime('%Y-%m')
-            stats = get_monthly_stats(user_id, month)
-            if stats:
-                trends.append({'month': month, **stats})
+        def month_stats(month):
+            set_page(page)
+            return get_monthly_stats(user_id, month)
         
-        return trends
+        with ThreadPoolExecutor(max_workers=min(TREND_WORKERS, len(month_keys))) as pool:
+            all_stats = list(pool.map(month_stats, month_keys))
+        
+        return [{'month': month, **stats} for month, stats in zip(month_keys, all_stats) if stats]
     except Exception as e:
-        print(f"Error getting spending trend: {e}")
+        _report('get_spending_trend', e)
+        return []
+
+def get_spending_accumulator(user_id, months=3, before=None):
+    """SpendingAccumulator for the last months merged from their rollups (no transactions are read)
+
+    With before (YYYY-MM), merges the months just before that one instead
+    of the months up to today's.
+    """
+    count = max(1, min(months, TREND_MAX_MONTHS))
+    if before:
+        month_keys = _recent_months(count + 1, datetime.strptime(before, '%Y-%m'))[1:]
+    else:
+        month_keys = _recent_months(count)
+    accumulator = SpendingAccumulator()
+    for month in month_keys:
+        accumulator.merge(SpendingAccumulator.from_rollup(get_rollup(user_id, month), month))
+    return accumulator
+
+def get_top_recipients(user_id, months=1, limit=10):
+    """Largest payees over the last months, merged from the sketches on their budgets
+
+    Returns the sketch's counters (recipient, amount, count, error),
+    including payments still in the outbox.
+    """
+    try:
+        sketch = SpaceSaving()
+        for month in _recent_months(max(1, min(months, TREND_MAX_MONTHS))):
+            budget = get_budget(user_id, month) or {}
+            month_sketch = SpaceSaving.from_dict(budget.get(SKETCH_FIELD))
+            if budget:
+                for payment in _pending_payments(user_id, month):
+                    month_sketch.add(payment['record']['recipient'], payment['record']['amount'])
+            sketch.merge(month_sketch)
+        return sketch.top(limit)
+    except Exception as e:
+        _report('get_top_recipients', e)
         return []
 
 # ==================== EMERGENCY FUND ====================
 
 def get_emergency_fund(user_id):
-    """Get emergency fund balance"""
+    """Get emergency fund balance (cached)"""
     try:
-        if not db:
-            return 2870.0
-        
-        doc = db.collection('users').document(user_id).get()
-        return doc.get('emergency_fund', 0.0) if doc.exists else 0.0
+        return _read('get_emergency_fund', ('emergency_fund', user_id, None), lambda: _load_emergency_fund(user_id))
     except Exception as e:
-        print(f"Error fetching emergency fund: {e}")
+        _report('get_emergency_fund', e)
         return 0.0
 
+def _load_emergency_fund(user_id):
+    profile = get_backend().get_user(user_id)
+    return profile.get('emergency_fund', 0.0) if profile else 0.0
+
 def add_to_emergency_fund(user_id, amount):
     """Add to emergency fund"""
     try:
-        if not db:
-            return True
-        
-        current = get_emergency_fund(user_id)
-        db.collection('users').document(user_id).set({
-            'emergency_fund': current + amount,
-            'emergency_fund_updated': datetime.now(),
-        }, merge=True)
+        updates = {'emergency_fund_updated': datetime.now()}
+        _write('add_to_emergency_fund',
+               lambda: get_backend().increment_user(user_id, 'emergency_fund', amount, updates=updates),
+               user_id, kinds=('emergency_fund', 'user'))
         return True
     except Exception as e:
-        print(f"Error updating emergency fund: {e}")
+        _report('add_to_emergency_fund', e)
         return False
 
 # ==================== SAVINGS GOALS ====================
@@ -250,121 +639,130 @@ def add_to_emergency_fund(user_id, amount):
 def set_savings_goal(user_id, goal_amount, goal_name):
     """Set a savings goal"""
     try:
-        if not db:
-            return True
-        
-        db.collection('users').document(user_id).collection('goals').add({
+        goal = {
             'name': goal_name,
             'target_amount': goal_amount,
             'current_amount': 0,
             'created_at': datetime.now(),
             'status': 'active',
-        })
+        }
+        _write('set_savings_goal', lambda: get_backend().add_goal(user_id, goal), user_id, kinds=('goals',))
         return True
     except Exception as e:
-        print(f"Error setting goal: {e}")
+        _report('set_savings_goal', e)
         return False
 
 def get_savings_goals(user_id):
-    """Get all savings goals"""
+    """Get all savings goals (cached)"""
     try:
-        if not db:
-            return [
-                {'name': 'Vacation', 'target_amount': 50000, 'current_amount': 15000, 'id': '1', 'status': 'active'},
-                {'name': 'New Laptop', 'target_amount': 100000, 'current_amount': 45000, 'id': '2', 'status': 'active'},
-            ]
-        
-        docs = db.collection('users').document(user_id).collection('goals').where('status', '==', 'active').stream()
-        goals = []
-        for doc in docs:
-            goal_data = doc.to_dict()
-            goal_data['id'] = doc.id
-            goals.append(goal_data)
-        return goals
+        return _read('get_savings_goals', ('goals', user_id, None),
+                     lambda: get_backend().list_goals(user_id, status='active'))
     except Exception as e:
-        print(f"Error fetching goals: {e}")
+        _report('get_savings_goals', e)
         return []
 
 def update_goal_progress(user_id, goal_id, amount):
     """Update goal progress by adding amount"""
     try:
-        if not db:
-            return True
-        
-        goal_ref = db.collection('users').document(user_id).collection('goals').document(goal_id)
-        goal = goal_ref.get()
-        if goal.exists:
-            current = goal.get('current_amount', 0)
-            goal_ref.update({'current_amount': current + amount})
-            return True
-        return False
+        return bool(_write('update_goal_progress',
+                           lambda: get_backend().increment_goal(user_id, goal_id, 'current_amount', amount),
+                           user_id, kinds=('goals',)))
     except Exception as e:
-        print(f"Error updating goal progress: {e}")
+        _report('update_goal_progress', e)
         return False
 
 def delete_savings_goal(user_id, goal_id):
     """Delete a savings goal"""
     try:
-        if not db:
-            return True
-        
-        db.collection('users').document(user_id).collection('goals').document(goal_id).update({
+        fields = {
             'status': 'deleted',
             'deleted_at': datetime.now(),
-        })
+        }
+        _write('delete_savings_goal', lambda: get_backend().update_goal(user_id, goal_id, fields),
+               user_id, kinds=('goals',))
         return True
     except Exception as e:
-        print(f"Error deleting goal: {e}")
+        _report('delete_savings_goal', e)
         return False
 
-def update_transaction_bundle(user_id, month, transaction_id, new_bundle):
-    """Update transaction bundle after categorization"""
+def update_transaction_bundle(user_id, month, transaction_id, new_bundle, amount=None, old_bundle=None):
+    """Update transaction bundle after categorization
+
+    Pass the transaction's amount and previous bundle so the monthly rollup
+    can be adjusted in place; otherwise it is rebuilt from the records.
+    """
     try:
-        if not db:
-            return True
-        
-        db.collection('transactions').document(transaction_id).update({
+        fields = {
             'bundle': new_bundle,
             'status': 'categorized',
             'categorized_at': datetime.now(),
-        })
+        }
+        
+        def write():
+            get_backend().update_transaction(user_id, transaction_id, fields, month=month)
+            if amount is not None and old_bundle is not None:
+                get_backend().increment_rollup(user_id, month, recategorize_delta(amount, old_bundle, new_bundle))
+            else:
+                _rebuild_rollup(get_backend(), user_id, month)
+        _write('update_transaction_bundle', write, user_id, month, kinds=('transactions', 'rollup'))
         return True
     except Exception as e:
-        print(f"Error updating transaction: {e}")
+        _report('update_transaction_bundle', e)
         return False
 
+def categorize_transactions(user_id, month, assignments):
+    """Move transactions into bundles in one atomic write
+
+    assignments is a list of (transaction_id, bundle). Record updates,
+    per-bundle balance changes (coalesced) and rollup moves commit together.
+    Payments still in the outbox are delivered first; if any cannot be yet,
+    nothing is categorized. Returns {'success', 'categorized', 'balances'}
+    or {'success': False, 'error'}.
+    """
+    if not assignments:
+        return {'success': True, 'categorized': 0, 'balances': {}}
+    try:
+        if outbox is not None:
+            queued = {payment['id'] for payment in _pending_payments(user_id, month)}
+            waiting = outbox.deliver_now([key for key, _ in assignments if key in queued])
+            if waiting:
+                return {'success': False, 'error_code': UNAVAILABLE,
+                        'error': f'{len(waiting)} payment(s) are still being sent; try again in a moment'}
+        return _write('categorize_transactions',
+                      lambda: get_backend().categorize_transactions(user_id, month, list(assignments)),
+                      user_id, month, kinds=('budget', 'transactions', 'rollup'))
+    except Exception as e:
+        return _report('categorize_transactions', e).as_result()
+
 # ==================== CUSTOM BUNDLES ====================
 
 def get_user_bundles(user_id):
-    """Get custom bundles created by user"""
+    """Get custom bundles created by user (cached)"""
     try:
-        if not db:
-            return []
-        
-        docs = db.collection('users').document(user_id).collection('custom_bundles').stream()
-        bundles = []
-        for doc in docs:
-            bundle_data = doc.to_dict()
-            bundle_data['id'] = doc.id
-            bundles.append(bundle_data)
-        return bundles
+        return _read('get_user_bundles', ('bundles', user_id, None),
+                     lambda: get_backend().list_custom_bundles(user_id))
     except Exception as e:
-        print(f"Error fetching custom bundles: {e}")
+        _report('get_user_bundles', e)
         return []
 
 def create_custom_bundle(user_id, bundle_name, emoji='📦'):
     """Create a custom bundle"""
     try:
-        if not db:
-            return True
-        
-        db.collection('users').document(user_id).collection('custom_bundles').add({
+        bundle = {
             'name': bundle_name,
             'emoji': emoji,
             'created_at': datetime.now(),
             'active': True,
-        })
+        }
+        _write('create_custom_bundle', lambda: get_backend().add_custom_bundle(user_id, bundle),
+               user_id, kinds=('bundles',))
         return True
     except Exception as e:
-        print(f"Error creating custom bundle: {e}")
+        _report('create_custom_bundle', e)
         return False
+
+# ==================== CACHE ====================
+
+def get_cache_stats():
+    """Hit/miss counters of the shared read cache"""
+    return shared_cache.stats()
@@ -0,0 +1,262 @@
+"""Fleet-wide monthly report over every user
+
+    python -m utils.fleet_report <YYYY-MM> [--out reports] [--chunk-size 2000] [--workers N]
+                                 [--project burn_rate|ewma|seasonal]
+
+Budgets and transactions are streamed from the backend in user id order,
+chunk_size documents at a time (collection-group queries on Firestore).
+Transaction chunks are summarised on a process pool while the next ones are
+fetched; at most two chunks per worker are in flight, so memory stays flat
+however many users there are. Partial summaries come back in order, are
+merged per user and joined with that user's budget as the stream passes.
+
+Writes <out>/users-<month>.jsonl (one line per user with a budget or
+spending) and <out>/summary-<month>.json (fleet totals). With --project,
+workers also return each user's daily spend per bundle and every chunk of
+users gets an end-of-month projection (utils.projections) in one vectorized
+call over a (users, bundles, days) array. A user is projected over budget
+when any spending bundle is; savings never count towards the balance.
+"""
+import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils import projections
+from utils.analytics import SPENDING_BUNDLES
+
+# Fields the report reads from each transaction
+REPORT_FIELDS = ('amount', 'bundle', 'status')
+
+# Upper bounds of the spent / income buckets in the fleet summary
+UTILIZATION_BUCKETS = (0.25, 0.5, 0.75, 0.9, 1.0)
+
+# Rows of the projection array: each spending bundle, then every other bundle's spend together
+PROJECTED_BUNDLES = tuple(SPENDING_BUNDLES) + ('_other',)
+
+def _projected_row(bundle):
+    return bundle if bundle in SPENDING_BUNDLES else '_other'
+
+def _empty_summary(days=0):
+    summary = {'transaction_count': 0, 'total_spent': 0, 'pending_count': 0, 'largest': 0, 'bundles': {}}
+    if days:
+        summary['daily'] = {}
+    return summary
+
+def summarize_chunk(rows, days=0):
+    """Per-user partial summaries for [(user_id, record), ...], in the order users appear
+
+    With days, each summary also carries 'daily': {PROJECTED_BUNDLES row:
+    spend on each of the month's first days days}. Runs in a worker process.
+    """
+    summaries = {}
+    for user_id, record in rows:
+        summary = summaries.get(user_id)
+        if summary is None:
+            summary = summaries[user_id] = _empty_summary(days)
+        amount = record.get('amount', 0)
+        bundle = record.get('bundle', 'uncategorized')
+        summary['transaction_count'] += 1
+        summary['total_spent'] += amount
+        summary['pending_count'] += record.get('status') == 'pending'
+        summary['largest'] = max(summary['largest'], amount)
+        summary['bundles'][bundle] = summary['bundles'].get(bundle, 0) + amount
+        timestamp = record.get('timestamp')
+        if days and timestamp is not None and timestamp.day <= days:
+            summary['daily'].setdefault(_projected_row(bundle), [0] * days)[timestamp.day - 1] += amount
+    return list(summaries.items())
+
+def merge_summary(summary, other):
+    """Fold another partial summary of the same user into summary"""
+    for field in ('transaction_count', 'total_spent', 'pending_count'):
+        summary[field] += other[field]
+    summary['largest'] = max(summary['largest'], other['largest'])
+    for bundle, amount in other['bundles'].items():
+        summary['bundles'][bundle] = summary['bundles'].get(bundle, 0) + amount
+    for row, amounts in other.get('daily', {}).items():
+        if row in summary['daily']:
+            amounts = [a + b for a, b in zip(summary['daily'][row], amounts)]
+        summary['daily'][row] = amounts
+    return summary
+
+def _chunk_summaries(backend, month, chunk_size, pool, max_in_flight, days=0):
+    """Yield (user_id, partial summary) in user order, chunks summarised on pool"""
+    in_flight = deque()
+    fields = REPORT_FIELDS + ('timestamp',) if days else REPORT_FIELDS
+    for chunk in backend.scan_transactions(month, chunk_size, fields=fields):
+        in_flight.append(pool.submit(summarize_chunk, chunk, days))
+        if len(in_flight) >= max_in_flight:
+            yield from in_flight.popleft().result()
+    while in_flight:
+        yield from in_flight.popleft().result()
+
+def _per_user(partials):
+    """Merge consecutive partial summaries of the same user"""
+    current_id = current = None
+    for user_id, partial in partials:
+        if user_id == current_id:
+            merge_summary(current, partial)
+            continue
+        if current_id is not None:
+            yield current_id, current
+        current_id, current = user_id, partial
+    if current_id is not None:
+        yield current_id, current
+
+def _budgets(backend, month, chunk_size):
+    for chunk in backend.scan_budgets(month, chunk_size):
+        yield from chunk
+
+def _join(budgets, summaries):
+    """Merge-join two user-ordered streams into (user_id, budget or None, summary or None)"""
+    budget_row, summary_row = next(budgets, None), next(summaries, None)
+    while budget_row or summary_row:
+        if summary_row is None or (budget_row and budget_row[0] < summary_row[0]):
+            yield budget_row[0], budget_row[1], None
+            budget_row = next(budgets, None)
+        elif budget_row is None or summary_row[0] < budget_row[0]:
+            yield summary_row[0], None, summary_row[1]
+            summary_row = next(summaries, None)
+        else:
+            yield budget_row[0], budget_row[1], summary_row[1]
+            budget_row, summary_row = next(budgets, None), next(summaries, None)
+
+def user_report(user_id, month, budget, summary, days=0):
+    """One line of the per-user output"""
+    summary = summary or _empty_summary(days)
+    report = {'user_id': user_id, 'month': month, **summary}
+    if budget:
+        bundles = [field[:-len('_remaining')] for field in budget if field.endswith('_remaining')]
+        report['income'] = budget.get('monthly_income', 0)
+        report['allocated'] = sum(budget.get(bundle, 0) for bundle in bundles)
+        report['remaining'] = sum(budget[f'{bundle}_remaining'] for bundle in bundles)
+        report['utilization'] = summary['total_spent'] / report['income'] if report['income'] else None
+    if days:
+        report['bundle_remaining'] = {bundle: budget[f'{bundle}_remaining'] for bundle in SPENDING_BUNDLES
+                                      if budget and f'{bundle}_remaining' in budget}
+    return report
+
+def _empty_fleet(month):
+    return {
+        'month': month, 'users': 0, 'users_with_budget': 0, 'active_users': 0,
+        'transaction_count': 0, 'pending_count': 0, 'total_spent': 0, 'total_income': 0,
+        'over_budget_users': 0, 'projected_spent': 0, 'projected_over_budget_users': 0, 'bundles': {},
+        'utilization': {**{f'<={bound:g}': 0 for bound in UTILIZATION_BUCKETS}, '>1': 0},
+    }
+
+def _add_to_fleet(fleet, report):
+    fleet['users'] += 1
+    fleet['active_users'] += report['transaction_count'] > 0
+    fleet['transaction_count'] += report['transaction_count']
+    fleet['pending_count'] += report['pending_count']
+    fleet['total_spent'] += report['total_spent']
+    for bundle, amount in report['bundles'].items():
+        fleet['bundles'][bundle] = fleet['bundles'].get(bundle, 0) + amount
+    projection = report.get('projection')
+    if projection:
+        fleet['projected_spent'] += projection['total']
+        fleet['projected_over_budget_users'] += any(balance < 0 for balance in projection.get('balances', {}).values())
+    if 'income' not in report:
+        return
+    fleet['users_with_budget'] += 1
+    fleet['total_income'] += report['income']
+    utilization = report['utilization']
+    if utilization is None:
+        return
+    fleet['over_budget_users'] += report['total_spent'] > report['allocated']
+    bucket = next((f'<={bound:g}' for bound in UTILIZATION_BUCKETS if utilization <= bound), '>1')
+    fleet['utilization'][bucket] += 1
+
+def _project(reports, month, days, method):
+    """Attach an end-of-month projection to each report, all users and bundles in one vectorized call
+
+    The projection holds the user's projected, total (with a low/high band)
+    and daily_rate; with a budget also balances (per spending bundle) and
+    balance (their sum).
+    """
+    days_in_month, first_weekday = projections.month_calendar(month)
+    rows = {bundle: index for index, bundle in enumerate(PROJECTED_BUNDLES)}
+    daily = np.zeros((len(reports), len(rows), days))
+    remaining = np.zeros((len(reports), len(rows)))
+    budgeted = np.zeros((len(reports), len(rows)), dtype=bool)
+    for index, report in enumerate(reports):
+        for row, amounts in report.pop('daily').items():
+            daily[index, rows[row]] = amounts
+        for bundle, value in report.pop('bundle_remaining').items():
+            remaining[index, rows[bundle]] = value
+            budgeted[index, rows[bundle]] = True
+    fixed = np.isin(PROJECTED_BUNDLES, projections.FIXED_BUNDLES)
+    result = projections.project_balances(daily, remaining, fixed, days_in_month, first_weekday, method)
+    
+    # Bundle bands are combined as independent errors
+    spent, projected, total = (result[key].sum(axis=-1) for key in ('spent', 'projected', 'total'))
+    band = np.sqrt(((result['high'] - result['total']) ** 2).sum(axis=-1))
+    summed = {
+        'projected': projected,
+        'total': total,
+        'low': spent + np.maximum(projected - band, 0),
+        'high': total + band,
+        'daily_rate': result['daily_rate'].sum(axis=-1),
+    }
+    for index, report in enumerate(reports):
+        projection = {key: round(float(values[index]), 2) for key, values in summed.items()}
+        if budgeted[index].any():
+            projection['balances'] = {bundle: round(float(result['balance'][index, row]), 2)
+                                      for bundle, row in rows.items() if budgeted[index, row]}
+            projection['balance'] = round(sum(projection['balances'].values()), 2)
+        report['projection'] = projection
+    return reports
+
+def run_report(backend, month, out_dir='reports', chunk_size=2000, workers=None, project=None, today=None):
+    """Stream the month's data through the pool and write both outputs; returns the fleet summary
+
+    project names a utils.projections method to add month-end projections
+    as of today (default now).
+    """
+    workers = workers or os.cpu_count() or 1
+    days = projections.days_elapsed(month, today) if project else 0
+    os.makedirs(out_dir, exist_ok=True)
+    fleet = _empty_fleet(month)
+    users_path = os.path.join(out_dir, f'users-{month}.jsonl')
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(users_path, 'w', encoding='utf-8') as out:
+        def write(reports):
+            if project:
+                _project(reports, month, days, project)
+            for report in reports:
+                out.write(json.dumps(report) + '\n')
+                _add_to_fleet(fleet, report)
+
+        summaries = _per_user(_chunk_summaries(backend, month, chunk_size, pool, 2 * workers, days))
+        batch = []
+        for user_id, budget, summary in _join(_budgets(backend, month, chunk_size), summaries):
+            batch.append(user_report(user_id, month, budget, summary, days))
+            if len(batch) >= chunk_size:
+                write(batch)
+                batch = []
+        write(batch)
+
+    fleet['average_spent'] = fleet['total_spent'] / fleet['active_users'] if fleet['active_users'] else 0
+    with open(os.path.join(out_dir, f'summary-{month}.json'), 'w', encoding='utf-8') as f:
+        json.dump(fleet, f, indent=2)
+    return fleet
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Monthly spending report across every user')
+    parser.add_argument('month', help='month as YYYY-MM')
+    parser.add_argument('--out', default='reports')
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--project', choices=projections.METHODS, help='add month-end projections')
+    args = parser.parse_args(argv)
+
+    from utils.firebase_config import get_backend
+    fleet = run_report(get_backend(), args.month, args.out, args.chunk_size, args.workers, args.project)
+    print(f"{args.month}: {fleet['users']} users, {fleet['transaction_count']} transactions, "
+          f"₹{fleet['total_spent']:,.0f} spent")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Top recipients per user and month in fixed memory
+
+A Space-Saving sketch keeps at most `capacity` counters however many
+distinct recipients a user pays. A payment to a tracked recipient adds to
+its counter; a new recipient takes over the smallest counter, inheriting
+its amount as error. Every recipient who received more than
+total / capacity is guaranteed a counter, and a counter's amount
+overestimates the true amount by at most its error.
+
+The sketch is stored on the month's budget document, updated in the same
+commit as each payment:
+
+    'top_recipients': {
+        'capacity': 32,
+        'total': 12450,
+        'counters': [{'recipient': 'cafe@okaxis', 'amount': 450, 'count': 2, 'error': 0}, ...],
+    }
+
+Sketches of several months merge into one of the same capacity (the
+mergeable summaries construction of Agarwal et al.), so "top payees this
+quarter" reads three budget documents and no transactions.
+"""
+
+# Budget document field holding the sketch
+SKETCH_FIELD = 'top_recipients'
+
+# Counters kept per sketch; recipients above 1/CAPACITY of the spend are always tracked
+CAPACITY = 32
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter sketch of amounts paid per recipient"""
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.total = 0
+        # recipient -> [amount, count, error]
+        self.counters = {}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls((data or {}).get('capacity', CAPACITY))
+        if data:
+            sketch.total = data.get('total', 0)
+            sketch.counters = {counter['recipient']: [counter['amount'], counter['count'], counter['error']]
+                               for counter in data.get('counters', [])}
+        return sketch
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'total': self.total, 'counters': self.top()}
+
+    def __len__(self):
+        return len(self.counters)
+
+    def _floor(self):
+        """Amount a recipient without a counter may have had (0 until the sketch is full)"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(amount for amount, _, _ in self.counters.values())
+
+    def add(self, recipient, amount):
+        recipient = recipient or 'unknown'
+        self.total += amount
+        counter = self.counters.get(recipient)
+        if counter is not None:
+            counter[0] += amount
+            counter[1] += 1
+        elif len(self.counters) < self.capacity:
+            self.counters[recipient] = [amount, 1, 0]
+        else:
+            smallest = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(smallest)[0]
+            self.counters[recipient] = [floor + amount, 1, floor]
+        return self
+
+    def merge(self, other):
+        """Fold another sketch (e.g. another month) into this one, keeping this capacity"""
+        floor, other_floor = self._floor(), other._floor()
+        merged = {}
+        for recipient in self.counters.keys() | other.counters.keys():
+            amount, count, error = self.counters.get(recipient, (floor, 0, floor))
+            other_amount, other_count, other_error = other.counters.get(recipient, (other_floor, 0, other_floor))
+            merged[recipient] = [amount + other_amount, count + other_count, error + other_error]
+        kept = sorted(merged, key=lambda key: merged[key][0], reverse=True)[:self.capacity]
+        self.counters = {recipient: merged[recipient] for recipient in kept}
+        self.total += other.total
+        return self
+
+    def top(self, limit=None):
+        """Counters by amount, largest first: recipient, amount, count, error"""
+        ranked = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [{'recipient': recipient, 'amount': amount, 'count': count, 'error': error}
+                for recipient, (amount, count, error) in ranked]
+
+def record_payment(budget, record):
+    """The budget's sketch with record added, as stored in SKETCH_FIELD"""
+    sketch = SpaceSaving.from_dict(budget.get(SKETCH_FIELD))
+    return sketch.add(record.get('recipient'), record.get('amount', 0)).to_dict()
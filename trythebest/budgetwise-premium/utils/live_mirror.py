@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import OrderedDict
+
+from utils.call_policy import logger
+from utils.storage.base import listed, page_key, project, projection
+
+def _stop_all(stops):
+    for stop in stops:
+        try:
+            stop()
+        except Exception as e:
+            logger.warning('Error stopping listener: %s', e)
+
+class _Subscription:
+    """Listeners and mirrored documents for one (user, month)"""
+
+    def __init__(self, user_id, month):
+        self.user_id = user_id
+        self.month = month
+        self.sessions = {}
+        self.budget = None
+        self.transactions = None
+        self.budget_ready = False
+        self.stops = []
+
+class LiveMirror:
+    """In-process copy of the active users' budgets and transactions
+
+    Each (user, month) gets a budget listener and a transactions listener
+    from backend.watch_budget/watch_transactions; pages then read the
+    mirror instead of the network. Subscriptions are reference-counted by
+    session, dropped once every session has been idle for idle_timeout
+    seconds, and capped at max_subscriptions (least recently used first).
+    A daemon thread reaps idle sessions every reap_interval seconds (half
+    the idle timeout by default) while any subscription is open, so
+    listeners go away even when no further requests arrive.
+    on_change(user_id, month) is called after each snapshot is applied.
+    """
+
+    def __init__(self, backend, max_subscriptions=64, idle_timeout=300.0, on_change=None, reap_interval=None,
+                 clock=time.monotonic):
+        self.backend = backend
+        self.max_subscriptions = max_subscriptions
+        self.idle_timeout = idle_timeout
+        self.on_change = on_change
+        self.reap_interval = reap_interval or idle_timeout / 2
+        self.clock = clock
+        self._subscriptions = OrderedDict()
+        self._session_keys = {}
+        self._lock = threading.RLock()
+        self._stopping = threading.Event()
+        self._reaper = None
+
+    # ==================== REFERENCES ====================
+
+    def touch(self, session_id, user_id, month):
+        """Mark a session as viewing (user, month), attaching listeners if needed"""
+        key = (user_id, month)
+        with self._lock:
+            previous = self._session_keys.get(session_id)
+            if previous is not None and previous != key:
+                stops = self._drop_session(session_id, previous)
+            else:
+                stops = []
+            self._session_keys[session_id] = key
+            subscription = self._subscriptions.get(key)
+            if subscription is None:
+                subscription = self._attach(user_id, month)
+            subscription.sessions[session_id] = self.clock()
+            self._subscriptions.move_to_end(key)
+            self._start_reaper()
+        _stop_all(stops)
+        self.reap()
+
+    def release(self, session_id):
+        """Forget a session; its listeners go once no other session uses them"""
+        with self._lock:
+            key = self._session_keys.pop(session_id, None)
+            stops = self._drop_session(session_id, key) if key is not None else []
+        _stop_all(stops)
+
+    def _drop_session(self, session_id, key):
+        subscription = self._subscriptions.get(key)
+        if subscription is None:
+            return []
+        subscription.sessions.pop(session_id, None)
+        return [] if subscription.sessions else self._detach(key)
+
+    def reap(self):
+        """Drop idle sessions and enforce the subscription cap"""
+        cutoff = self.clock() - self.idle_timeout
+        stops = []
+        with self._lock:
+            for key, subscription in list(self._subscriptions.items()):
+                for session_id, last_seen in list(subscription.sessions.items()):
+                    if last_seen < cutoff:
+                        del subscription.sessions[session_id]
+                        self._session_keys.pop(session_id, None)
+                if not subscription.sessions:
+                    stops += self._detach(key)
+            while len(self._subscriptions) > self.max_subscriptions:
+                stops += self._detach(next(iter(self._subscriptions)))
+        _stop_all(stops)
+
+    def close(self):
+        self._stopping.set()
+        stops = []
+        with self._lock:
+            for key in list(self._subscriptions):
+                stops += self._detach(key)
+            self._session_keys.clear()
+        _stop_all(stops)
+
+    def _start_reaper(self):
+        if self._reaper is None or not self._reaper.is_alive():
+            self._stopping.clear()
+            self._reaper = threading.Thread(target=self._run_reaper, name='budgetwise-mirror-reaper', daemon=True)
+            self._reaper.start()
+
+    def _run_reaper(self):
+        while not self._stopping.wait(self.reap_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                logger.exception('Live mirror reap failed: %s', e)
+            with self._lock:
+                if not self._subscriptions:
+                    # touch() starts a new reaper with the next subscription
+                    self._reaper = None
+                    return
+
+    # ==================== LISTENERS ====================
+
+    def _attach(self, user_id, month):
+        subscription = _Subscription(user_id, month)
+        self._subscriptions[(user_id, month)] = subscription
+
+        def on_budget(budget):
+            with self._lock:
+                subscription.budget = budget
+                subscription.budget_ready = True
+            self._changed(subscription)
+
+        def on_transactions(records):
+            records = sorted(records, key=page_key, reverse=True)
+            with self._lock:
+                subscription.transactions = records
+            self._changed(subscription)
+
+        subscription.stops = [
+            self.backend.watch_budget(user_id, month, on_budget),
+            self.backend.watch_transactions(user_id, month, on_transactions),
+        ]
+        return subscription
+
+    def _detach(self, key):
+        # Returns the listeners' stop functions; callers run them after
+        # releasing the lock, because stopping waits for in-flight callbacks.
+        subscription = self._subscriptions.pop(key, None)
+        if subscription is None:
+            return []
+        for session_id in subscription.sessions:
+            self._session_keys.pop(session_id, None)
+        return subscription.stops
+
+    def _changed(self, subscription):
+        if self.on_change is not None:
+            self.on_change(subscription.user_id, subscription.month)
+
+    # ==================== READS ====================
+
+    def get_budget(self, user_id, month):
+        """Return (found, budget); found is False until the first snapshot"""
+        with self._lock:
+            subscription = self._subscriptions.get((user_id, month))
+            if subscription is None or not subscription.budget_ready:
+                return False, None
+            return True, subscription.budget
+
+    def get_transactions(self, user_id, month, limit=None, start_after=None, fields=None):
+        """Return (found, records) with the same paging as list_transactions"""
+        with self._lock:
+            subscription = self._subscriptions.get((user_id, month))
+            if subscription is None or subscription.transactions is None:
+                return False, None
+            records = subscription.transactions
+        if start_after is not None:
+            cursor = page_key(start_after)
+            records = [record for record in records if page_key(record) < cursor]
+        if limit is not None:
+            records = records[:limit]
+        fields = projection(fields)
+        return True, [listed(project(record, fields), record.get('id'), record.get('update_time')) for record in records]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscriptions': len(self._subscriptions),
+                'sessions': len(self._session_keys),
+                'transactions': sum(len(s.transactions or ()) for s in self._subscriptions.values()),
+            }
@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from utils.call_policy import logger
+
+# Latency bucket upper bounds in seconds (Prometheus histogram style)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The Streamlit page being rendered, per script thread
+_page_local = threading.local()
+
+def set_page(page):
+    """Tag data calls made by this thread with a page name"""
+    _page_local.page = page
+
+def current_page():
+    return getattr(_page_local, 'page', '-')
+
+def result_size(result):
+    """(documents, bytes) for a backend result
+
+    bytes is an estimate: the JSON length of the first document times the
+    document count, so a month of records is not serialized a second time
+    just to be measured.
+    """
+    if result is None:
+        return 0, 0
+    if isinstance(result, list):
+        if not result:
+            return 0, 0
+        documents, sample = len(result), result[0]
+    else:
+        documents, sample = 1, result
+    try:
+        return documents, documents * len(json.dumps(sample, default=str))
+    except (TypeError, ValueError):
+        return documents, 0
+
+class Metrics:
+    """Call counters, document/byte totals and latency histograms for data calls
+
+    Series are keyed by (op, page, kind) where kind is 'read' or 'write'.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, op, kind, seconds, result=None, error=None):
+        """Record one finished call"""
+        documents, size = result_size(result) if error is None else (0, 0)
+        key = (op, current_page(), kind)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'calls': 0, 'errors': 0, 'documents': 0, 'bytes': 0,
+                    'seconds_sum': 0.0, 'buckets': [0] * len(BUCKETS),
+                }
+            series['calls'] += 1
+            series['errors'] += error is not None
+            series['documents'] += documents
+            series['bytes'] += size
+            series['seconds_sum'] += seconds
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series['buckets'][index] += 1
+
+    def snapshot(self):
+        """List of series dicts, one per (op, page, kind)"""
+        with self._lock:
+            return [
+                {'op': op, 'page': page, 'kind': kind, **series, 'buckets': list(series['buckets'])}
+                for (op, page, kind), series in sorted(self._series.items())
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    # ==================== EXPORT ====================
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = [
+            '# HELP budgetwise_data_calls_total Backend calls made by the data layer',
+            '# TYPE budgetwise_data_calls_total counter',
+        ]
+        series = self.snapshot()
+
+        def labels(entry, **extra):
+            pairs = {'op': entry['op'], 'page': entry['page'], 'kind': entry['kind'], **extra}
+            return ','.join(f'{name}="{_escape(value)}"' for name, value in pairs.items())
+
+        for entry in series:
+            lines.append(f"budgetwise_data_calls_total{{{labels(entry)}}} {entry['calls']}")
+        for name, field, help_text in (
+            ('budgetwise_data_errors_total', 'errors', 'Backend calls that failed'),
+            ('budgetwise_data_documents_total', 'documents', 'Documents returned by backend calls'),
+            ('budgetwise_data_bytes_total', 'bytes', 'Estimated JSON size of backend results'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            lines += [f"{name}{{{labels(entry)}}} {entry[field]}" for entry in series]
+        lines += [
+            '# HELP budgetwise_data_call_seconds Backend call latency',
+            '# TYPE budgetwise_data_call_seconds histogram',
+        ]
+        for entry in series:
+            for bound, count in zip(BUCKETS, entry['buckets']):
+                lines.append(f"budgetwise_data_call_seconds_bucket{{{labels(entry, le=f'{bound:g}')}}} {count}")
+            lines.append(f"budgetwise_data_call_seconds_bucket{{{labels(entry, le='+Inf')}}} {entry['calls']}")
+            lines.append(f"budgetwise_data_call_seconds_sum{{{labels(entry)}}} {entry['seconds_sum']:.6f}")
+            lines.append(f"budgetwise_data_call_seconds_count{{{labels(entry)}}} {entry['calls']}")
+        return '\n'.join(lines) + '\n'
+
+    def to_jsonl(self):
+        """One JSON object per series, stamped with the export time"""
+        exported_at = datetime.now().isoformat(timespec='seconds')
+        return ''.join(json.dumps({'time': exported_at, **entry}) + '\n' for entry in self.snapshot())
+
+    def export(self, path, fmt='prometheus'):
+        """Write the metrics to path: Prometheus text replaces the file, JSON lines append"""
+        if fmt == 'jsonl':
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(self.to_jsonl())
+            return
+        if fmt != 'prometheus':
+            raise ValueError(f'Unknown metrics format {fmt!r}; expected prometheus or jsonl')
+        # Write then rename so scrapers (e.g. a textfile collector) never see half a file
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def start_exporter(self, path, fmt='prometheus', interval=60.0):
+        """Export every interval seconds from a daemon thread"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.export(path, fmt)
+                except Exception as e:
+                    logger.warning('Error exporting metrics to %s: %s', path, e)
+
+        thread = threading.Thread(target=run, name='budgetwise-metrics', daemon=True)
+        thread.start()
+        return thread
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = Metrics()
@@ -0,0 +1,162 @@
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils.call_policy import logger
+from utils.storage.sqlite_backend import dumps_document, loads_document
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    op TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, next_attempt);
+CREATE INDEX IF NOT EXISTS idx_outbox_user_month ON outbox (user_id, month, status);
+"""
+
+class Outbox:
+    """Durable local journal of writes waiting to reach the storage backend
+    
+    Entries are appended to a SQLite file (fsync'd before enqueue returns)
+    and drained by a background flusher that calls apply(entry) for each.
+    apply must be idempotent on entry['key']; it returns a result dict
+    (success False marks a permanent rejection) or raises to retry with
+    exponential backoff.
+    """
+    
+    def __init__(self, path, apply, batch_size=50, interval=0.5, max_backoff=60.0):
+        self.path = path
+        self.apply = apply
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+    
+    # ==================== JOURNAL ====================
+    
+    def enqueue(self, user_id, month, op, payload, key=None):
+        """Append a write and return its idempotency key"""
+        key = key or uuid.uuid4().hex[:20]
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO outbox (key, user_id, month, op, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, user_id, month, op, dumps_document(payload), time.time()))
+        self._wake.set()
+        return key
+    
+    def _entries(self, sql, params, limit=-1):
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT key, user_id, month, op, payload, attempts, last_error FROM outbox WHERE {sql} ORDER BY seq LIMIT ?',
+                (*params, limit)).fetchall()
+        return [
+            {'key': key, 'user_id': user_id, 'month': month, 'op': op,
+             'payload': loads_document(payload), 'attempts': attempts, 'last_error': last_error}
+            for key, user_id, month, op, payload, attempts, last_error in rows
+        ]
+    
+    def pending(self, user_id, month=None):
+        """Entries for a user that have not reached the backend yet"""
+        if month is None:
+            return self._entries("user_id = ? AND status = 'pending'", (user_id,))
+        return self._entries("user_id = ? AND month = ? AND status = 'pending'", (user_id, month))
+    
+    def rejected(self, user_id):
+        """Entries the backend refused (e.g. the balance ran out meanwhile)"""
+        return self._entries("user_id = ? AND status = 'rejected'", (user_id,))
+    
+    def _mark(self, key, status, error=None):
+        with self._lock:
+            self._conn.execute('UPDATE outbox SET status = ?, last_error = ? WHERE key = ?', (status, error, key))
+    
+    def _retry_later(self, key, attempts, error):
+        delay = min(self.max_backoff, 2 ** attempts * self.interval)
+        with self._lock:
+            self._conn.execute(
+                'UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE key = ?',
+                (attempts + 1, time.time() + delay, error, key))
+    
+    def purge(self, older_than=86400):
+        """Delete delivered entries older than older_than seconds"""
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE status = 'done' AND created_at < ?",
+                               (time.time() - older_than,))
+    
+    # ==================== FLUSHER ====================
+    
+    def flush(self):
+        """Deliver one batch of due entries; returns how many were attempted"""
+        batch = self._entries("status = 'pending' AND next_attempt <= ?", (time.time(),), self.batch_size)
+        self._deliver(batch)
+        return len(batch)
+    
+    def deliver_now(self, keys):
+        """Deliver the pending entries with these keys, ignoring their backoff; returns the keys still pending"""
+        keys = list(keys)
+        if not keys:
+            return set()
+        marks = ', '.join('?' * len(keys))
+        self._deliver(self._entries(f"status = 'pending' AND key IN ({marks})", keys))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT key FROM outbox WHERE status = 'pending' AND key IN ({marks})",
+                                      keys).fetchall()
+        return {key for key, in rows}
+    
+    def _deliver(self, batch):
+        for entry in batch:
+            try:
+                result = self.apply(entry)
+            except Exception as e:
+                logger.warning('Outbox delivery failed for %s: %s', entry['key'], e)
+                self._retry_later(entry['key'], entry['attempts'], str(e))
+                continue
+            if result.get('success', True):
+                self._mark(entry['key'], 'done')
+            else:
+                self._mark(entry['key'], 'rejected', result.get('error'))
+    
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if self.flush() >= self.batch_size:
+                    continue
+            except Exception as e:
+                logger.exception('Outbox flush error: %s', e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+    
+    def start(self):
+        """Start the background flusher thread (idempotent)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='budgetwise-outbox', daemon=True)
+                self._thread.start()
+    
+    def stop(self, drain=True, timeout=5.0):
+        """Stop the flusher, optionally delivering what is due first"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if drain:
+            deadline = time.time() + timeout
+            while time.time() < deadline and self.flush():
+                pass
@@ -3,9 +3,11 @@ from datetime import datetime
 class PaymentProcessor:
     """Advanced payment processing and validation"""
     
-    def __init__(self, budget):
+    def __init__(self, budget, accumulator=None):
         self.budget = budget
         self.transaction_history = []
+        # Optional utils.analytics.SpendingAccumulator fed with every processed payment
+        self.accumulator = accumulator
     
     def validate_payment(self, amount, bundle):
         """Validate if payment can be made from bundle"""
@@ -51,6 +53,8 @@ class PaymentProcessor:
         }
         
         self.transaction_history.append(transaction)
+        if self.accumulator is not None:
+            self.accumulator.add(transaction)
         
         return {
             'success': True,
@@ -0,0 +1,132 @@
+"""End-of-month spend projections
+
+Every function works on a daily spend array shaped (..., days elapsed):
+one row per bundle for a single user, or (users, bundles, days) for batch
+runs, so a whole fleet chunk is projected with a handful of array ops.
+
+Methods:
+    burn_rate   average daily spend so far
+    ewma        exponentially weighted daily spend (recent days count more)
+    seasonal    average daily spend reweighted by day of week, shrunk
+                towards the overall average while a weekday has few samples
+
+Bands assume independent days: z * daily standard deviation * sqrt(days left).
+
+Fixed bundles (rent and other once-a-month bills) are not spent at a daily
+rate, so they are never extrapolated: what is still unpaid of their
+allocation is projected as due, and they cannot run over.
+"""
+import calendar
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+METHODS = ('burn_rate', 'ewma', 'seasonal')
+
+# Samples per weekday at which its own average and the overall average weigh the same
+SEASONAL_SHRINKAGE = 2.0
+
+# Bundles paid as a lump sum once a month
+FIXED_BUNDLES = ('rent',)
+
+def month_calendar(month):
+    """(days in month, weekday of the 1st with Monday=0) for 'YYYY-MM'"""
+    year, number = map(int, month.split('-'))
+    first_weekday, days = calendar.monthrange(year, number)
+    return days, first_weekday
+
+def days_elapsed(month, today=None):
+    """Days of month that have fully or partly passed as of today (0 before it starts)"""
+    today = today or datetime.now()
+    days, _ = month_calendar(month)
+    current = today.strftime('%Y-%m')
+    if current < month:
+        return 0
+    if current > month:
+        return days
+    return today.day
+
+def project_spend(daily, days_in_month, first_weekday=0, method='ewma', alpha=0.3, z=1.645):
+    """Project the rest of the month from daily spend so far
+
+    Returns a dict of arrays shaped like daily without its last axis:
+    spent, projected (spend still to come), total, low and high (band on
+    total) and daily_rate (expected spend per remaining day).
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unknown projection method {method!r}; expected one of {METHODS}')
+    daily = np.asarray(daily, dtype='float64')
+    elapsed = daily.shape[-1]
+    days_left = max(days_in_month - elapsed, 0)
+    spent = daily.sum(axis=-1)
+    if elapsed == 0:
+        zeros = np.zeros(daily.shape[:-1])
+        return {'spent': zeros, 'projected': zeros, 'total': zeros, 'low': zeros, 'high': zeros, 'daily_rate': zeros}
+
+    if method == 'seasonal':
+        weekdays = (first_weekday + np.arange(days_in_month)) % 7
+        past = np.eye(7)[weekdays[:elapsed]]
+        base = spent / elapsed
+        weekday_rate = (daily @ past + SEASONAL_SHRINKAGE * base[..., None]) / (past.sum(axis=0) + SEASONAL_SHRINKAGE)
+        projected = weekday_rate @ np.bincount(weekdays[elapsed:], minlength=7).astype('float64')
+        residuals = daily - weekday_rate @ past.T
+    else:
+        if method == 'burn_rate':
+            rate = spent / elapsed
+        else:
+            weights = (1 - alpha) ** np.arange(elapsed)[::-1]
+            rate = daily @ weights / weights.sum()
+        projected = rate * days_left
+        residuals = daily - daily.mean(axis=-1, keepdims=True)
+
+    deviation = np.sqrt((residuals ** 2).sum(axis=-1) / max(elapsed - 1, 1))
+    band = z * deviation * np.sqrt(days_left)
+    total = spent + projected
+    return {
+        'spent': spent,
+        'projected': projected,
+        'total': total,
+        'low': spent + np.maximum(projected - band, 0),
+        'high': total + band,
+        'daily_rate': projected / days_left if days_left else np.zeros_like(projected),
+    }
+
+def project_balances(daily, remaining, fixed, days_in_month, first_weekday=0, method='ewma', **options):
+    """project_spend per budget bundle, plus balance (remaining minus projected)
+
+    daily is shaped (..., bundles, days elapsed) and remaining (..., bundles);
+    fixed is a boolean mask over the bundle axis. Fixed bundles are not
+    extrapolated: their unpaid allocation is projected, with no band and
+    no daily rate.
+    """
+    result = project_spend(daily, days_in_month, first_weekday, method, **options)
+    remaining = np.asarray(remaining, dtype='float64')
+    fixed = np.broadcast_to(np.asarray(fixed, dtype=bool), remaining.shape)
+    due = np.maximum(remaining, 0)
+    result['projected'] = np.where(fixed, due, result['projected'])
+    for key in ('total', 'low', 'high'):
+        result[key] = np.where(fixed, result['spent'] + due, result[key])
+    result['daily_rate'] = np.where(fixed, 0.0, result['daily_rate'])
+    result['balance'] = remaining - result['projected']
+    return result
+
+def bundle_projection(frame, budget, month, bundles, method='ewma', today=None, fixed=FIXED_BUNDLES, **options):
+    """DataFrame indexed by bundle: spent, projected, total, low, high, balance, safe_daily and pace
+
+    frame is a TransactionFrame of the month; balance is the projected
+    remaining at month end and safe_daily what can be spent per day from
+    now without running out. Bundles in fixed get their unpaid allocation
+    as projected spend, a zero balance and pace 'fixed'.
+    """
+    days, first_weekday = month_calendar(month)
+    elapsed = days_elapsed(month, today)
+    remaining = np.array([budget.get(f'{bundle}_remaining', 0) for bundle in bundles], dtype='float64')
+    is_fixed = np.isin(list(bundles), list(fixed))
+    result = project_balances(frame.daily_matrix(bundles, elapsed), remaining, is_fixed, days, first_weekday, method,
+                              **options)
+    table = pd.DataFrame(result, index=list(bundles))
+    days_left = days - elapsed
+    table['safe_daily'] = np.where(is_fixed, 0.0, remaining / days_left if days_left else remaining)
+    table['pace'] = np.where(is_fixed, 'fixed', np.where(table['balance'] < 0, 'over', 'on track'))
+    return table
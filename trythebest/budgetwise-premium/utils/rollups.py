@@ -0,0 +1,151 @@
+"""Per-(user, month) spending rollups
+
+A rollup document summarises a month of transactions so analytics read one
+document instead of scanning every record:
+
+    {
+        'month': '2024-05',
+        'complete': True,
+        'version': 2,
+        'total_spent': 1250,
+        'transaction_count': 3,
+        'sum_squares': 1142500,
+        'bundles': {'meals': {'amount': 450, 'count': 2}, ...},
+        'recipients': {'cafe@okaxis': {'amount': 450, 'count': 2}, ...},
+        'days': {'07': 200, '12': 1050},
+    }
+
+Writers apply deltas (dotted field paths mapped to increments) so every
+backend can update a rollup atomically. 'complete' is only set by a
+rebuild; a rollup without it was started by increments alone and must be
+rebuilt from the raw records before it is trusted, as must one written
+before the current ROLLUP_VERSION. Recipient keys are escaped with
+recipient_key so they never contain a dot.
+
+Rebuild from the command line:
+
+    python -m utils.rollups <user_id> <month> [<month> ...]
+"""
+import argparse
+from datetime import datetime
+
+from utils.storage.base import apply_increments
+
+# Bumped when rollups gain fields; older rollups are rebuilt on read
+ROLLUP_VERSION = 2
+
+def empty_rollup(month):
+    return {
+        'month': month,
+        'complete': True,
+        'version': ROLLUP_VERSION,
+        'total_spent': 0,
+        'transaction_count': 0,
+        'sum_squares': 0,
+        'bundles': {},
+        'recipients': {},
+        'days': {},
+    }
+
+def recipient_key(recipient):
+    """Rollup map key for a recipient; dots would split the dotted field paths"""
+    return (recipient or 'unknown').replace('%', '%25').replace('.', '%2E')
+
+def recipient_name(key):
+    return key.replace('%2E', '.').replace('%25', '%')
+
+def transaction_delta(transaction, sign=1):
+    """Rollup increments for adding (sign=1) or removing (sign=-1) a transaction"""
+    amount = transaction.get('amount', 0) * sign
+    bundle = transaction.get('bundle', 'uncategorized')
+    recipient = recipient_key(transaction.get('recipient'))
+    delta = {
+        'total_spent': amount,
+        'transaction_count': sign,
+        'sum_squares': sign * amount ** 2,
+        f'bundles.{bundle}.amount': amount,
+        f'bundles.{bundle}.count': sign,
+        f'recipients.{recipient}.amount': amount,
+        f'recipients.{recipient}.count': sign,
+    }
+    timestamp = transaction.get('timestamp')
+    if isinstance(timestamp, datetime):
+        delta[f"days.{timestamp.strftime('%d')}"] = amount
+    return delta
+
+def recategorize_delta(amount, old_bundle, new_bundle):
+    """Rollup increments for moving a transaction between bundles"""
+    if old_bundle == new_bundle:
+        return {}
+    return {
+        f'bundles.{old_bundle}.amount': -amount,
+        f'bundles.{old_bundle}.count': -1,
+        f'bundles.{new_bundle}.amount': amount,
+        f'bundles.{new_bundle}.count': 1,
+    }
+
+def plan_categorization(budget, records, assignments):
+    """Work out the writes for moving transactions into bundles
+
+    records maps transaction id to its stored record; assignments is a list
+    of (transaction_id, bundle), the last one winning for repeated ids.
+    Pending payments were never deducted, so they are charged to the new
+    bundle; categorized ones are refunded to their old bundle first. Charges
+    are coalesced per bundle; a balance goes negative when the charges
+    exceed it, so a later refund restores exactly what was charged.
+
+    Returns (updates, balances, rollup): record fields per transaction id,
+    the new '<bundle>_remaining' values and the rollup increments.
+    """
+    categorized_at = datetime.now()
+    updates, charges, rollup = {}, {}, {}
+    for transaction_id, bundle in dict(assignments).items():
+        record = records.get(transaction_id)
+        if record is None:
+            continue
+        amount = record.get('amount', 0)
+        old_bundle = record.get('bundle', 'uncategorized')
+        if record.get('status') == 'pending':
+            charges[bundle] = charges.get(bundle, 0) + amount
+        elif old_bundle != bundle:
+            charges[old_bundle] = charges.get(old_bundle, 0) - amount
+            charges[bundle] = charges.get(bundle, 0) + amount
+        for path, delta in recategorize_delta(amount, old_bundle, bundle).items():
+            rollup[path] = rollup.get(path, 0) + delta
+        updates[transaction_id] = {'bundle': bundle, 'status': 'categorized', 'categorized_at': categorized_at}
+    balances = {}
+    for bundle, charge in charges.items():
+        field_name = f'{bundle}_remaining'
+        if charge and budget and field_name in budget:
+            balances[field_name] = budget[field_name] - charge
+    return updates, balances, rollup
+
+def build_rollup(month, transactions):
+    """Compute a complete rollup from raw transaction records"""
+    rollup = empty_rollup(month)
+    for transaction in transactions:
+        apply_increments(rollup, transaction_delta(transaction))
+    return rollup
+
+def bundle_totals(rollup):
+    """Map bundle -> amount spent"""
+    return {bundle: totals.get('amount', 0) for bundle, totals in rollup.get('bundles', {}).items()}
+
+def rebuild_rollup(backend, user_id, month):
+    """Recompute and store the rollup for one user and month (see StorageBackend.rebuild_rollup)"""
+    return backend.rebuild_rollup(user_id, month)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild monthly spending rollups from raw transactions')
+    parser.add_argument('user_id')
+    parser.add_argument('months', nargs='+', help='months as YYYY-MM')
+    args = parser.parse_args(argv)
+    
+    from utils.firebase_config import get_backend
+    backend = get_backend()
+    for month in args.months:
+        rollup = rebuild_rollup(backend, args.user_id, month)
+        print(f"{args.user_id} {month}: {rollup['transaction_count']} transactions, ₹{rollup['total_spent']:,.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+# Storage backends
+# Backends are imported on demand: they import utils.rollups, which imports utils.storage.base
+from utils.storage.base import StorageBackend, AGGREGATE_FIELDS
+
+BACKENDS = ('firestore', 'memory', 'sqlite')
+
+def create_backend(kind, db=None, sqlite_path='budgetwise.db', validate_indexes=False, partition_by_month=False,
+                   write_timeout=None):
+    """Build a storage backend by name; write_timeout bounds each Firestore write RPC in seconds"""
+    if kind == 'memory':
+        from utils.storage.memory_backend import MemoryBackend
+        return MemoryBackend()
+    if kind == 'sqlite':
+        from utils.storage.sqlite_backend import SQLiteBackend
+        return SQLiteBackend(sqlite_path)
+    if kind == 'firestore':
+        if db is None:
+            raise ValueError('Firestore backend needs a client')
+        from utils.storage.firestore_backend import FirestoreBackend
+        return FirestoreBackend(db, validate_indexes=validate_indexes, partition_by_month=partition_by_month,
+                                write_timeout=write_timeout)
+    raise ValueError(f'Unknown storage backend {kind!r}; expected one of {BACKENDS}')
@@ -0,0 +1,209 @@
+class StorageBackend:
+    """Repository interface for users, budgets, transactions, goals and custom bundles
+
+    Documents are plain dicts. List methods return newest first where an
+    order is defined, and every listed record carries its document 'id'
+    and 'update_time' (None when the store never recorded one). Balance
+    changes are expressed as deltas so every backend can apply them
+    atomically.
+    """
+    
+    name = 'base'
+    
+    # ==================== USERS ====================
+    
+    def create_user(self, user_id, profile):
+        raise NotImplementedError
+    
+    def get_user(self, user_id):
+        raise NotImplementedError
+    
+    def increment_user(self, user_id, field, delta, updates=None):
+        """Add delta to a numeric user field, creating the profile if needed"""
+        raise NotImplementedError
+    
+    # ==================== BUDGETS ====================
+    
+    def set_budget(self, user_id, month, budget):
+        raise NotImplementedError
+    
+    def get_budget(self, user_id, month):
+        raise NotImplementedError
+    
+    def update_budget(self, user_id, month, fields):
+        raise NotImplementedError
+    
+    def increment_budget(self, user_id, month, field, delta):
+        raise NotImplementedError
+    
+    def spend_from_bundle(self, user_id, month, bundle, amount):
+        """Deduct amount from a bundle only if enough is left"""
+        raise NotImplementedError
+    
+    # ==================== TRANSACTIONS ====================
+    
+    def add_transaction(self, user_id, record):
+        """Insert a transaction record and return its id"""
+        raise NotImplementedError
+    
+    def commit_payment(self, user_id, month, record, deduct=True, rollup=None, transaction_id=None):
+        """Insert record, deduct it from its bundle and bump the rollup atomically
+
+        rollup maps dotted field paths to increments. When the month has a
+        budget, the recipient is also added to its top-recipient sketch
+        (utils.heavy_hitters). A caller-supplied transaction_id makes the
+        commit idempotent: if that record already exists nothing is written
+        and the result carries 'duplicate'.
+        """
+        raise NotImplementedError
+    
+    def categorize_transactions(self, user_id, month, assignments):
+        """Move [(transaction_id, bundle), ...] into bundles in one atomic write
+
+        Applies rollups.plan_categorization to the stored records and budget;
+        returns {'success': True, 'categorized': count, 'balances': {...}}.
+        """
+        raise NotImplementedError
+    
+    def list_transactions(self, user_id, month, limit=None, start_after=None, fields=None):
+        """Transactions of a month, newest first
+
+        limit caps the page size, start_after is the last record of the
+        previous page and fields projects each record onto those keys
+        (timestamp is always kept so it can serve as a cursor).
+        """
+        raise NotImplementedError
+    
+    def update_transaction(self, user_id, transaction_id, fields, month=None):
+        """Update a stored record; month locates it in month-partitioned stores"""
+        raise NotImplementedError
+    
+    # ==================== GOALS ====================
+    
+    def add_goal(self, user_id, goal):
+        raise NotImplementedError
+    
+    def list_goals(self, user_id, status='active'):
+        raise NotImplementedError
+    
+    def update_goal(self, user_id, goal_id, fields):
+        raise NotImplementedError
+    
+    def increment_goal(self, user_id, goal_id, field, delta):
+        """Add delta to a goal field; returns False if the goal does not exist"""
+        raise NotImplementedError
+    
+    # ==================== CUSTOM BUNDLES ====================
+    
+    def add_custom_bundle(self, user_id, bundle):
+        raise NotImplementedError
+    
+    def list_custom_bundles(self, user_id):
+        raise NotImplementedError
+    
+    # ==================== ROLLUPS ====================
+    
+    def get_rollup(self, user_id, month):
+        raise NotImplementedError
+    
+    def set_rollup(self, user_id, month, rollup):
+        raise NotImplementedError
+    
+    def rebuild_rollup(self, user_id, month):
+        """Recompute the rollup from the month's records and store it; returns the rollup
+
+        Reading the records and writing the rollup is one atomic step, so a
+        payment committed in between cannot be lost. A month without records
+        is only written when it already has a stored rollup.
+        """
+        raise NotImplementedError
+    
+    def increment_rollup(self, user_id, month, increments):
+        """Apply dotted-path increments, creating the rollup if needed"""
+        raise NotImplementedError
+    
+    # ==================== LISTENERS ====================
+    
+    def watch_budget(self, user_id, month, on_change):
+        """Call on_change(budget or None) now and after every change; returns a stop function"""
+        raise NotImplementedError
+    
+    def watch_transactions(self, user_id, month, on_change):
+        """Call on_change(records) with the month's full transaction list on every change; returns a stop function"""
+        raise NotImplementedError
+    
+    # ==================== FLEET SCANS ====================
+    
+    def scan_budgets(self, month, chunk_size=1000):
+        """Yield every user's budget for month as lists of (user_id, budget), in user id order"""
+        raise NotImplementedError
+    
+    def scan_transactions(self, month, chunk_size=1000, fields=None):
+        """Yield every user's transactions for month as lists of (user_id, record), in user id order
+
+        A user's records may span two chunks; only chunk_size records are
+        held at a time.
+        """
+        raise NotImplementedError
+    
+    def warm_up(self):
+        """Open connections ahead of the first request"""
+        pass
+    
+    def close(self):
+        pass
+
+# ==================== SHARED HELPERS ====================
+
+# Columns read by aggregate-only queries (rollups, stats, analytics)
+AGGREGATE_FIELDS = ('amount', 'bundle', 'recipient', 'timestamp')
+
+NO_BUDGET = {'success': False, 'error': 'No budget set up', 'error_code': 'NO_BUDGET'}
+
+def duplicate_payment(transaction_id):
+    return {'success': True, 'transaction_id': transaction_id, 'new_balance': None, 'duplicate': True}
+
+def insufficient_balance(remaining):
+    return {
+        'success': False,
+        'error': f'Insufficient balance. Only ₹{remaining:.0f} available.',
+        'error_code': 'INSUFFICIENT_BALANCE',
+        'balance': remaining,
+    }
+
+def projection(fields):
+    """Field list for a projected read; the cursor field is always included"""
+    if not fields:
+        return None
+    return list(dict.fromkeys([*fields, 'timestamp']))
+
+def project(record, fields):
+    if fields is None:
+        return record
+    return {field: record[field] for field in fields if field in record}
+
+def listed(record, doc_id, update_time):
+    """A list-query record: the document plus its id and last update time"""
+    return {**record, 'id': doc_id, 'update_time': update_time}
+
+def page_key(record):
+    """Newest-first sort key for transactions; the id breaks timestamp ties"""
+    return (sort_timestamp(record['timestamp']), record.get('id') or '')
+
+def sort_timestamp(timestamp):
+    """Comparable form of a record timestamp
+
+    Firestore hands naive datetimes back as UTC-aware ones with the same
+    wall-clock value, so dropping tzinfo keeps both kinds comparable.
+    """
+    return timestamp.replace(tzinfo=None) if timestamp.tzinfo else timestamp
+
+def apply_increments(doc, increments):
+    """Add each dotted-path delta in increments to the nested dict doc"""
+    for path, delta in increments.items():
+        *parents, leaf = path.split('.')
+        target = doc
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = target.get(leaf, 0) + delta
+    return doc
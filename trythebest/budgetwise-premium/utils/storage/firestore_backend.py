@@ -0,0 +1,313 @@
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from utils import rollups
+from utils.heavy_hitters import SKETCH_FIELD, record_payment
+from utils.storage import query_shapes
+from utils.storage.base import StorageBackend, NO_BUDGET, duplicate_payment, insufficient_balance, projection, listed, AGGREGATE_FIELDS
+
+def _nested_increments(increments):
+    """Turn dotted-path deltas into a nested dict of Increment transforms for set(merge=True)"""
+    nested = {}
+    for path, delta in increments.items():
+        *parents, leaf = path.split('.')
+        target = nested
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = firestore.Increment(delta)
+    return nested
+
+class FirestoreBackend(StorageBackend):
+    """Cloud Firestore storage
+
+    Layout:
+        users/{user_id}                              profile, emergency fund
+        users/{user_id}/goals/{goal_id}
+        users/{user_id}/custom_bundles/{bundle_id}
+        budgets/{user_id}/monthly/{month}
+        transactions/{user_id}/records/{transaction_id}
+        rollups/{user_id}/monthly/{month}
+
+    With partition_by_month, transactions live under
+    transactions/{user_id}/months/{month}/records/{transaction_id} instead,
+    so reading a month scans one small collection with no filter.
+    utils.storage.month_partitions moves existing records across.
+
+    Every query is built from a shape in utils.storage.query_shapes, which
+    also generates the composite indexes they need.
+
+    Writes, and the reads inside write transactions, time out after
+    write_timeout seconds. The client takes no timeout for transaction
+    commits, which keep its default deadline.
+    """
+    
+    name = 'firestore'
+    
+    def __init__(self, db, validate_indexes=False, partition_by_month=False, write_timeout=None):
+        self.db = db
+        self.write_timeout = write_timeout
+        self.validate_indexes = validate_indexes
+        self.partition_by_month = partition_by_month
+    
+    def warm_up(self):
+        # The gRPC channel is opened lazily by the first RPC; pay for it here
+        self.db.collection('users').document('_warm_up').get()
+        if self.validate_indexes:
+            problems = query_shapes.validate(self.db, self.db.project)
+            if problems:
+                raise RuntimeError('Missing Firestore indexes:\n' + '\n'.join(problems))
+    
+    def _user_ref(self, user_id):
+        return self.db.collection('users').document(user_id)
+    
+    def _budget_ref(self, user_id, month):
+        return self.db.collection('budgets').document(user_id).collection('monthly').document(month)
+    
+    def _records(self, user_id, month=None):
+        user_ref = self.db.collection('transactions').document(user_id)
+        if not self.partition_by_month:
+            return user_ref.collection('records')
+        if not month:
+            raise ValueError('Month-partitioned transactions need a month')
+        return user_ref.collection('months').document(month).collection('records')
+    
+    def _rollup_ref(self, user_id, month):
+        return self.db.collection('rollups').document(user_id).collection('monthly').document(month)
+    
+    # ==================== USERS ====================
+    
+    def create_user(self, user_id, profile):
+        self._user_ref(user_id).set(profile, timeout=self.write_timeout)
+    
+    def get_user(self, user_id):
+        doc = self._user_ref(user_id).get()
+        return doc.to_dict() if doc.exists else None
+    
+    def increment_user(self, user_id, field, delta, updates=None):
+        self._user_ref(user_id).set({field: firestore.Increment(delta), **(updates or {})}, merge=True,
+                                   timeout=self.write_timeout)
+    
+    # ==================== BUDGETS ====================
+    
+    def set_budget(self, user_id, month, budget):
+        self._budget_ref(user_id, month).set(budget, timeout=self.write_timeout)
+    
+    def get_budget(self, user_id, month):
+        doc = self._budget_ref(user_id, month).get()
+        return doc.to_dict() if doc.exists else None
+    
+    def update_budget(self, user_id, month, fields):
+        self._budget_ref(user_id, month).update(fields, timeout=self.write_timeout)
+    
+    def increment_budget(self, user_id, month, field, delta):
+        self._budget_ref(user_id, month).update({field: firestore.Increment(delta)}, timeout=self.write_timeout)
+    
+    def _spend(self, transaction, budget_ref, bundle, amount, snapshot=None, updates=None):
+        """snapshot is the budget already read in this transaction; updates are written with the deduction"""
+        snapshot = snapshot or budget_ref.get(transaction=transaction, timeout=self.write_timeout)
+        if not snapshot.exists:
+            return dict(NO_BUDGET)
+        field_name = f'{bundle}_remaining'
+        remaining = (snapshot.to_dict() or {}).get(field_name, 0)
+        if amount > remaining:
+            return insufficient_balance(remaining)
+        transaction.update(budget_ref, {field_name: firestore.Increment(-amount), **(updates or {})})
+        return {'success': True, 'new_balance': remaining - amount}
+    
+    def spend_from_bundle(self, user_id, month, bundle, amount):
+        budget_ref = self._budget_ref(user_id, month)
+        
+        @firestore.transactional
+        def _run(transaction):
+            return self._spend(transaction, budget_ref, bundle, amount)
+        
+        return _run(self.db.transaction())
+    
+    # ==================== TRANSACTIONS ====================
+    
+    def add_transaction(self, user_id, record):
+        _, ref = self._records(user_id, record.get('month')).add(record, timeout=self.write_timeout)
+        return ref.id
+    
+    def commit_payment(self, user_id, month, record, deduct=True, rollup=None, transaction_id=None):
+        budget_ref = self._budget_ref(user_id, month)
+        record_ref = self._records(user_id, month).document(transaction_id)
+        rollup_ref = self._rollup_ref(user_id, month)
+        
+        @firestore.transactional
+        def _run(transaction):
+            if transaction_id and record_ref.get(transaction=transaction, timeout=self.write_timeout).exists:
+                return duplicate_payment(transaction_id)
+            # Every read happens before the first write
+            snapshot = budget_ref.get(transaction=transaction, timeout=self.write_timeout)
+            sketch = {SKETCH_FIELD: record_payment(snapshot.to_dict() or {}, record)} if snapshot.exists else {}
+            new_balance = None
+            if deduct:
+                result = self._spend(transaction, budget_ref, record['bundle'], record['amount'], snapshot, sketch)
+                if not result['success']:
+                    return result
+                new_balance = result['new_balance']
+            elif sketch:
+                transaction.update(budget_ref, sketch)
+            transaction.set(record_ref, record)
+            if rollup:
+                transaction.set(rollup_ref, {'month': month, **_nested_increments(rollup)}, merge=True)
+            return {'success': True, 'transaction_id': record_ref.id, 'new_balance': new_balance}
+        
+        return _run(self.db.transaction())
+    
+    def list_transactions(self, user_id, month, limit=None, start_after=None, fields=None):
+        fields = projection(fields)
+        shape = query_shapes.PARTITION_TRANSACTIONS if self.partition_by_month else query_shapes.TRANSACTIONS_BY_MONTH
+        query = shape.build(self._records(user_id, month), month=month)
+        if fields:
+            query = query.select(fields)
+        if start_after is not None:
+            cursor = {'timestamp': start_after['timestamp']}
+            if start_after.get('id'):
+                cursor['__name__'] = start_after['id']
+            query = query.start_after(cursor)
+        if limit is not None:
+            query = query.limit(limit)
+        return [listed(doc.to_dict(), doc.id, doc.update_time) for doc in query.stream()]
+    
+    def categorize_transactions(self, user_id, month, assignments):
+        budget_ref = self._budget_ref(user_id, month)
+        rollup_ref = self._rollup_ref(user_id, month)
+        records_ref = self._records(user_id, month)
+        record_refs = [records_ref.document(transaction_id) for transaction_id in dict(assignments)]
+        
+        @firestore.transactional
+        def _run(transaction):
+            records = {}
+            for snapshot in transaction.get_all(record_refs, timeout=self.write_timeout):
+                record = snapshot.to_dict() if snapshot.exists else None
+                if record and record.get('month') == month:
+                    records[snapshot.id] = record
+            snapshot = budget_ref.get(transaction=transaction, timeout=self.write_timeout)
+            budget = snapshot.to_dict() if snapshot.exists else None
+            updates, balances, rollup = rollups.plan_categorization(budget, records, assignments)
+            for transaction_id, fields in updates.items():
+                transaction.update(records_ref.document(transaction_id), fields)
+            if balances:
+                transaction.update(budget_ref, balances)
+            if rollup:
+                transaction.set(rollup_ref, {'month': month, **_nested_increments(rollup)}, merge=True)
+            return {'success': True, 'categorized': len(updates), 'balances': balances}
+        
+        return _run(self.db.transaction())
+    
+    def update_transaction(self, user_id, transaction_id, fields, month=None):
+        self._records(user_id, month).document(transaction_id).update(fields, timeout=self.write_timeout)
+    
+    # ==================== LISTENERS ====================
+    
+    def watch_budget(self, user_id, month, on_change):
+        def callback(snapshots, changes, read_time):
+            snapshot = snapshots[-1]
+            on_change(snapshot.to_dict() if snapshot.exists else None)
+        return self._budget_ref(user_id, month).on_snapshot(callback).unsubscribe
+    
+    def watch_transactions(self, user_id, month, on_change):
+        def callback(snapshots, changes, read_time):
+            on_change([listed(doc.to_dict(), doc.id, doc.update_time) for doc in snapshots])
+        shape = query_shapes.PARTITION_WATCH if self.partition_by_month else query_shapes.TRANSACTIONS_WATCH
+        query = shape.build(self._records(user_id, month), month=month)
+        return query.on_snapshot(callback).unsubscribe
+    
+    # ==================== GOALS ====================
+    
+    def add_goal(self, user_id, goal):
+        _, ref = self._user_ref(user_id).collection('goals').add(goal, timeout=self.write_timeout)
+        return ref.id
+    
+    def list_goals(self, user_id, status='active'):
+        docs = query_shapes.GOALS_BY_STATUS.build(self._user_ref(user_id).collection('goals'), status=status).stream()
+        return [listed(doc.to_dict(), doc.id, doc.update_time) for doc in docs]
+    
+    def update_goal(self, user_id, goal_id, fields):
+        self._user_ref(user_id).collection('goals').document(goal_id).update(fields, timeout=self.write_timeout)
+    
+    def increment_goal(self, user_id, goal_id, field, delta):
+        try:
+            self._user_ref(user_id).collection('goals').document(goal_id).update({field: firestore.Increment(delta)},
+                                                                                 timeout=self.write_timeout)
+            return True
+        except NotFound:
+            return False
+    
+    # ==================== CUSTOM BUNDLES ====================
+    
+    def add_custom_bundle(self, user_id, bundle):
+        _, ref = self._user_ref(user_id).collection('custom_bundles').add(bundle, timeout=self.write_timeout)
+        return ref.id
+    
+    def list_custom_bundles(self, user_id):
+        docs = query_shapes.CUSTOM_BUNDLES.build(self._user_ref(user_id).collection('custom_bundles')).stream()
+        return [listed(doc.to_dict(), doc.id, doc.update_time) for doc in docs]
+    
+    # ==================== FLEET SCANS ====================
+    
+    def _scan(self, query, root, chunk_size):
+        """Page through a collection-group query in document path order, keeping documents under root"""
+        query = query.order_by(FieldPath.document_id()).limit(chunk_size)
+        last = None
+        while True:
+            docs = list((query if last is None else query.start_after(last)).stream())
+            chunk = []
+            for doc in docs:
+                path = doc.reference.path.split('/')
+                if path[0] != root:
+                    # Paths sort by top-level collection, so nothing under root is left
+                    if path[0] > root:
+                        if chunk:
+                            yield chunk
+                        return
+                    continue
+                chunk.append((path[1], doc.to_dict()))
+            if chunk:
+                yield chunk
+            if len(docs) < chunk_size:
+                return
+            last = docs[-1]
+    
+    def scan_budgets(self, month, chunk_size=1000):
+        query = query_shapes.FLEET_BUDGETS.build(self.db.collection_group('monthly'), month=month)
+        return self._scan(query, 'budgets', chunk_size)
+    
+    def scan_transactions(self, month, chunk_size=1000, fields=None):
+        query = query_shapes.FLEET_TRANSACTIONS.build(self.db.collection_group('records'), month=month)
+        if fields:
+            query = query.select(list(fields))
+        return self._scan(query, 'transactions', chunk_size)
+    
+    # ==================== ROLLUPS ====================
+    
+    def get_rollup(self, user_id, month):
+        doc = self._rollup_ref(user_id, month).get()
+        return doc.to_dict() if doc.exists else None
+    
+    def set_rollup(self, user_id, month, rollup):
+        self._rollup_ref(user_id, month).set(rollup, timeout=self.write_timeout)
+    
+    def rebuild_rollup(self, user_id, month):
+        rollup_ref = self._rollup_ref(user_id, month)
+        shape = query_shapes.PARTITION_WATCH if self.partition_by_month else query_shapes.TRANSACTIONS_WATCH
+        query = shape.build(self._records(user_id, month), month=month).select(list(AGGREGATE_FIELDS))
+        
+        @firestore.transactional
+        def _run(transaction):
+            # Reading the rollup locks it: a payment bumping it meanwhile waits or forces a retry
+            snapshot = rollup_ref.get(transaction=transaction, timeout=self.write_timeout)
+            records = [doc.to_dict() for doc in transaction.get(query, timeout=self.write_timeout)]
+            rollup = rollups.build_rollup(month, records)
+            if records or snapshot.exists:
+                transaction.set(rollup_ref, rollup)
+            return rollup
+        
+        return _run(self.db.transaction())
+    
+    def increment_rollup(self, user_id, month, increments):
+        self._rollup_ref(user_id, month).set({'month': month, **_nested_increments(increments)}, merge=True,
+                                            timeout=self.write_timeout)
@@ -0,0 +1,249 @@
+import copy
+import itertools
+import threading
+import uuid
+from datetime import datetime
+
+from utils import rollups
+from utils.heavy_hitters import SKETCH_FIELD, record_payment
+from utils.storage.base import StorageBackend, NO_BUDGET, duplicate_payment, insufficient_balance, apply_increments, projection, project, listed, page_key, AGGREGATE_FIELDS
+
+class MemoryBackend(StorageBackend):
+    """Dict-backed storage for tests, benchmarks and offline runs
+
+    Everything lives in process memory behind one lock; documents are
+    copied on the way in and out so callers never share state with the store.
+    """
+    
+    name = 'memory'
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users = {}
+        self._budgets = {}
+        self._transactions = {}
+        self._transaction_months = {}
+        self._goals = {}
+        self._custom_bundles = {}
+        self._rollups = {}
+        self._update_times = {}
+        self._sequence = itertools.count()
+    
+    @staticmethod
+    def _new_id():
+        return uuid.uuid4().hex[:20]
+    
+    def _touch(self, doc_id):
+        self._update_times[doc_id] = datetime.now()
+    
+    # ==================== USERS ====================
+    
+    def create_user(self, user_id, profile):
+        with self._lock:
+            self._users[user_id] = copy.deepcopy(profile)
+    
+    def get_user(self, user_id):
+        with self._lock:
+            return copy.deepcopy(self._users.get(user_id))
+    
+    def increment_user(self, user_id, field, delta, updates=None):
+        with self._lock:
+            user = self._users.setdefault(user_id, {})
+            user[field] = user.get(field, 0) + delta
+            user.update(copy.deepcopy(updates or {}))
+    
+    # ==================== BUDGETS ====================
+    
+    def set_budget(self, user_id, month, budget):
+        with self._lock:
+            self._budgets[(user_id, month)] = copy.deepcopy(budget)
+    
+    def get_budget(self, user_id, month):
+        with self._lock:
+            return copy.deepcopy(self._budgets.get((user_id, month)))
+    
+    def _existing_budget(self, user_id, month):
+        budget = self._budgets.get((user_id, month))
+        if budget is None:
+            raise KeyError(f'No budget for {user_id} in {month}')
+        return budget
+    
+    def update_budget(self, user_id, month, fields):
+        with self._lock:
+            self._existing_budget(user_id, month).update(copy.deepcopy(fields))
+    
+    def increment_budget(self, user_id, month, field, delta):
+        with self._lock:
+            budget = self._existing_budget(user_id, month)
+            budget[field] = budget.get(field, 0) + delta
+    
+    def spend_from_bundle(self, user_id, month, bundle, amount):
+        with self._lock:
+            budget = self._budgets.get((user_id, month))
+            if budget is None:
+                return dict(NO_BUDGET)
+            field_name = f'{bundle}_remaining'
+            remaining = budget.get(field_name, 0)
+            if amount > remaining:
+                return insufficient_balance(remaining)
+            budget[field_name] = remaining - amount
+            return {'success': True, 'new_balance': remaining - amount}
+    
+    # ==================== TRANSACTIONS ====================
+    
+    def _insert_transaction(self, user_id, record, transaction_id=None):
+        transaction_id = transaction_id or self._new_id()
+        month = record.get('month')
+        self._transactions.setdefault((user_id, month), {})[transaction_id] = (next(self._sequence), copy.deepcopy(record))
+        self._transaction_months[(user_id, transaction_id)] = month
+        self._touch(transaction_id)
+        return transaction_id
+    
+    def add_transaction(self, user_id, record):
+        with self._lock:
+            return self._insert_transaction(user_id, record)
+    
+    def commit_payment(self, user_id, month, record, deduct=True, rollup=None, transaction_id=None):
+        with self._lock:
+            if transaction_id and (user_id, transaction_id) in self._transaction_months:
+                return duplicate_payment(transaction_id)
+            new_balance = None
+            if deduct:
+                result = self.spend_from_bundle(user_id, month, record['bundle'], record['amount'])
+                if not result['success']:
+                    return result
+                new_balance = result['new_balance']
+            transaction_id = self._insert_transaction(user_id, record, transaction_id)
+            budget = self._budgets.get((user_id, month))
+            if budget is not None:
+                budget[SKETCH_FIELD] = record_payment(budget, record)
+            if rollup:
+                self.increment_rollup(user_id, month, rollup)
+            return {'success': True, 'transaction_id': transaction_id, 'new_balance': new_balance}
+    
+    def list_transactions(self, user_id, month, limit=None, start_after=None, fields=None):
+        fields = projection(fields)
+        with self._lock:
+            rows = [
+                (page_key({**record, 'id': transaction_id}), transaction_id, record)
+                for transaction_id, (_, record) in self._transactions.get((user_id, month), {}).items()
+            ]
+            rows.sort(key=lambda row: row[0], reverse=True)
+            if start_after is not None:
+                rows = [row for row in rows if row[0] < page_key(start_after)]
+            if limit is not None:
+                rows = rows[:limit]
+            return [listed(copy.deepcopy(project(record, fields)), transaction_id, self._update_times.get(transaction_id))
+                    for _, transaction_id, record in rows]
+    
+    def categorize_transactions(self, user_id, month, assignments):
+        with self._lock:
+            stored = self._transactions.get((user_id, month), {})
+            records = {transaction_id: stored[transaction_id][1]
+                       for transaction_id, _ in assignments if transaction_id in stored}
+            budget = self._budgets.get((user_id, month))
+            updates, balances, rollup = rollups.plan_categorization(budget, records, assignments)
+            for transaction_id, fields in updates.items():
+                records[transaction_id].update(fields)
+                self._touch(transaction_id)
+            if balances:
+                budget.update(balances)
+            if rollup:
+                self.increment_rollup(user_id, month, rollup)
+            return {'success': True, 'categorized': len(updates), 'balances': balances}
+    
+    def update_transaction(self, user_id, transaction_id, fields, month=None):
+        with self._lock:
+            month = self._transaction_months[(user_id, transaction_id)]
+            _, record = self._transactions[(user_id, month)][transaction_id]
+            record.update(copy.deepcopy(fields))
+            self._touch(transaction_id)
+    
+    # ==================== GOALS ====================
+    
+    def add_goal(self, user_id, goal):
+        with self._lock:
+            goal_id = self._new_id()
+            self._goals.setdefault(user_id, {})[goal_id] = copy.deepcopy(goal)
+            self._touch(goal_id)
+            return goal_id
+    
+    def list_goals(self, user_id, status='active'):
+        with self._lock:
+            return [
+                listed(copy.deepcopy(goal), goal_id, self._update_times.get(goal_id))
+                for goal_id, goal in self._goals.get(user_id, {}).items()
+                if goal.get('status') == status
+            ]
+    
+    def update_goal(self, user_id, goal_id, fields):
+        with self._lock:
+            self._goals[user_id][goal_id].update(copy.deepcopy(fields))
+            self._touch(goal_id)
+    
+    def increment_goal(self, user_id, goal_id, field, delta):
+        with self._lock:
+            goal = self._goals.get(user_id, {}).get(goal_id)
+            if goal is None:
+                return False
+            goal[field] = goal.get(field, 0) + delta
+            self._touch(goal_id)
+            return True
+    
+    # ==================== CUSTOM BUNDLES ====================
+    
+    def add_custom_bundle(self, user_id, bundle):
+        with self._lock:
+            bundle_id = self._new_id()
+            self._custom_bundles.setdefault(user_id, {})[bundle_id] = copy.deepcopy(bundle)
+            self._touch(bundle_id)
+            return bundle_id
+    
+    def list_custom_bundles(self, user_id):
+        with self._lock:
+            return [
+                listed(copy.deepcopy(bundle), bundle_id, self._update_times.get(bundle_id))
+                for bundle_id, bundle in self._custom_bundles.get(user_id, {}).items()
+            ]
+    
+    # ==================== FLEET SCANS ====================
+    
+    def scan_budgets(self, month, chunk_size=1000):
+        with self._lock:
+            rows = sorted((user_id, copy.deepcopy(budget))
+                          for (user_id, budget_month), budget in self._budgets.items() if budget_month == month)
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+    
+    def scan_transactions(self, month, chunk_size=1000, fields=None):
+        with self._lock:
+            rows = [
+                (user_id, project(copy.deepcopy(record), fields))
+                for (user_id, record_month), records in sorted(self._transactions.items())
+                if record_month == month
+                for _, (_, record) in sorted(records.items())
+            ]
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+    
+    # ==================== ROLLUPS ====================
+    
+    def get_rollup(self, user_id, month):
+        with self._lock:
+            return copy.deepcopy(self._rollups.get((user_id, month)))
+    
+    def set_rollup(self, user_id, month, rollup):
+        with self._lock:
+            self._rollups[(user_id, month)] = copy.deepcopy(rollup)
+    
+    def rebuild_rollup(self, user_id, month):
+        with self._lock:
+            records = self.list_transactions(user_id, month, fields=AGGREGATE_FIELDS)
+            rollup = rollups.build_rollup(month, records)
+            if records or (user_id, month) in self._rollups:
+                self._rollups[(user_id, month)] = copy.deepcopy(rollup)
+            return rollup
+    
+    def increment_rollup(self, user_id, month, increments):
+        with self._lock:
+            apply_increments(self._rollups.setdefault((user_id, month), {'month': month}), increments)
@@ -0,0 +1,135 @@
+"""Move Firestore transactions into the month-partitioned layout
+
+    transactions/{user_id}/records/{id}
+        -> transactions/{user_id}/months/{month}/records/{id}
+
+    python -m utils.storage.month_partitions [--users u1 u2] [--batch-size 200]
+                                             [--delete] [--checkpoint PATH]
+
+Records are streamed a page at a time in document-id order and copied with
+batched writes that keep their ids. A record whose partition copy already
+exists is never written again: after the switch the app may have
+categorized that copy, and the legacy one is stale. Copies are created
+with a must-not-exist precondition, so a batch that races such a write
+fails and is retried by the next run. After every batch the position is
+saved to the checkpoint file; an interrupted run picks up where it
+stopped. The checkpoint is removed once every user is done.
+
+Rollout: run the copy, switch the app to BUDGETWISE_TRANSACTION_LAYOUT=month,
+then run again with --delete to pick up records written in between and
+remove the old documents.
+"""
+import argparse
+import json
+import os
+
+from google.cloud.firestore_v1.field_path import FieldPath
+
+CHECKPOINT_PATH = 'month_partition_migration.json'
+
+# A write batch holds at most 500 operations; a record takes two with --delete
+MAX_BATCH_SIZE = 250
+
+def _load_checkpoint(path):
+    if not os.path.exists(path):
+        return {'done': [], 'user': None, 'after': None}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _save_checkpoint(path, checkpoint):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def migrate_user(db, user_id, after=None, batch_size=200, delete=False, on_batch=None):
+    """Copy one user's records into month partitions; returns (copied, skipped, existing)
+
+    after resumes behind that document id; on_batch(last_id) runs after
+    each committed batch. Records without a month are left in place
+    (skipped); records already in their partition are not copied again
+    (existing) but are still deleted with delete.
+    """
+    user_ref = db.collection('transactions').document(user_id)
+    legacy = user_ref.collection('records')
+    copied = skipped = existing = 0
+    while True:
+        query = legacy.order_by(FieldPath.document_id()).limit(batch_size)
+        if after is not None:
+            query = query.start_after({'__name__': legacy.document(after)})
+        docs = list(query.stream())
+        if not docs:
+            return copied, skipped, existing
+        targets = {}
+        for doc in docs:
+            month = doc.to_dict().get('month')
+            if month:
+                targets[doc.id] = user_ref.collection('months').document(month).collection('records').document(doc.id)
+        present = {snapshot.id for snapshot in db.get_all(list(targets.values())) if snapshot.exists} if targets else set()
+        batch = db.batch()
+        for doc in docs:
+            if doc.id not in targets:
+                skipped += 1
+                continue
+            if doc.id in present:
+                existing += 1
+            else:
+                batch.create(targets[doc.id], doc.to_dict())
+                copied += 1
+            if delete:
+                batch.delete(doc.reference)
+        batch.commit()
+        after = docs[-1].id
+        if on_batch:
+            on_batch(after)
+
+def migrate(db, users=None, batch_size=200, delete=False, checkpoint_path=CHECKPOINT_PATH):
+    """Migrate every user (or only users); returns {'users', 'copied', 'skipped', 'existing'} for this run"""
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+    checkpoint = _load_checkpoint(checkpoint_path)
+    done = set(checkpoint['done'])
+    if users is None:
+        # list_documents also yields user documents that only exist as parents of records
+        users = (ref.id for ref in db.collection('transactions').list_documents())
+    stats = {'users': 0, 'copied': 0, 'skipped': 0, 'existing': 0}
+
+    for user_id in users:
+        if user_id in done:
+            continue
+        after = checkpoint['after'] if checkpoint['user'] == user_id else None
+        checkpoint['user'] = user_id
+
+        def on_batch(last_id):
+            checkpoint['after'] = last_id
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+        copied, skipped, existing = migrate_user(db, user_id, after, batch_size, delete, on_batch)
+        done.add(user_id)
+        checkpoint.update({'done': sorted(done), 'user': None, 'after': None})
+        _save_checkpoint(checkpoint_path, checkpoint)
+        stats['users'] += 1
+        stats['copied'] += copied
+        stats['skipped'] += skipped
+        stats['existing'] += existing
+        print(f"{user_id}: {copied} copied, {existing} already there, {skipped} without a month")
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move transactions into month partitions')
+    parser.add_argument('--users', nargs='*', help='only these user ids (default: all)')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--delete', action='store_true', help='remove each record from the old layout once copied')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    args = parser.parse_args(argv)
+
+    from utils.firebase_config import get_db
+    stats = migrate(get_db(), args.users, args.batch_size, args.delete, args.checkpoint)
+    print(f"Migrated {stats['copied']} records for {stats['users']} users "
+          f"({stats['existing']} already there, {stats['skipped']} without a month)")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,235 @@
+"""Registry of every Firestore query shape the app issues
+
+FirestoreBackend builds its queries from the shapes below, so the registry
+cannot drift from the code. From the registry we can:
+
+    python -m utils.storage.query_shapes generate [firestore.indexes.json]
+        write the index definitions (deploy with
+        `firebase deploy --only firestore:indexes`)
+
+    python -m utils.storage.query_shapes check [firestore.indexes.json]
+        verify the definitions file covers every shape
+
+    python -m utils.storage.query_shapes validate
+        list the indexes deployed to the project (or run each query once
+        against FIRESTORE_EMULATOR_HOST) and report shapes without support
+
+Single-field equality filters are served by Firestore's automatic
+indexes; a shape that filters on one field and orders by another needs
+a composite index. Queries are ordered by document id last, which every
+composite index includes implicitly. Automatic indexes only cover single
+collections, so a collection-group shape filtering on one field needs a
+field override that adds a COLLECTION_GROUP index for it.
+"""
+import argparse
+import json
+import os
+from collections import namedtuple
+
+INDEX_FILE = 'firestore.indexes.json'
+
+# Automatic single-field indexes, which a field override replaces and so must repeat
+AUTOMATIC_FIELD_INDEXES = [
+    {'order': 'ASCENDING', 'queryScope': 'COLLECTION'},
+    {'order': 'DESCENDING', 'queryScope': 'COLLECTION'},
+    {'arrayConfig': 'CONTAINS', 'queryScope': 'COLLECTION'},
+]
+
+class QueryShape(namedtuple('QueryShape', 'name collection_group equals orders scope', defaults=('COLLECTION',))):
+    """equals: fields compared with ==; orders: (field, 'ASCENDING'|'DESCENDING') pairs
+
+    scope is 'COLLECTION' or 'COLLECTION_GROUP' (queried with db.collection_group).
+    """
+
+    def needs_composite_index(self):
+        ordered = [field for field, _ in self.orders if field not in self.equals]
+        return len(self.equals) + len(ordered) > 1 and bool(ordered)
+
+    def needs_field_override(self):
+        return self.scope == 'COLLECTION_GROUP' and not self.needs_composite_index() and bool(self.index_fields())
+
+    def index_fields(self):
+        return ([{'fieldPath': field, 'order': 'ASCENDING'} for field in self.equals]
+                + [{'fieldPath': field, 'order': order} for field, order in self.orders if field not in self.equals])
+
+    def build(self, collection, **values):
+        """Apply this shape's filters and orders to a collection reference"""
+        from google.cloud.firestore_v1.field_path import FieldPath
+        query = collection
+        for field in self.equals:
+            query = query.where(field, '==', values[field])
+        for field, order in self.orders:
+            query = query.order_by(field, direction=order)
+        if self.orders:
+            query = query.order_by(FieldPath.document_id(), direction=self.orders[-1][1])
+        return query
+
+TRANSACTIONS_BY_MONTH = QueryShape('transactions_by_month', 'records', ('month',), (('timestamp', 'DESCENDING'),))
+# The watch shapes also serve rollup rebuilds, which need no order
+TRANSACTIONS_WATCH = QueryShape('transactions_watch', 'records', ('month',), ())
+# Month-partitioned layout: the collection already holds a single month
+PARTITION_TRANSACTIONS = QueryShape('partition_transactions', 'records', (), (('timestamp', 'DESCENDING'),))
+PARTITION_WATCH = QueryShape('partition_watch', 'records', (), ())
+GOALS_BY_STATUS = QueryShape('goals_by_status', 'goals', ('status',), ())
+CUSTOM_BUNDLES = QueryShape('custom_bundles', 'custom_bundles', (), ())
+# Fleet scans (utils.fleet_report); 'monthly' also matches rollups, which the scan skips
+FLEET_TRANSACTIONS = QueryShape('fleet_transactions', 'records', ('month',), (), 'COLLECTION_GROUP')
+FLEET_BUDGETS = QueryShape('fleet_budgets', 'monthly', ('month',), (), 'COLLECTION_GROUP')
+
+QUERY_SHAPES = (TRANSACTIONS_BY_MONTH, TRANSACTIONS_WATCH, PARTITION_TRANSACTIONS, PARTITION_WATCH,
+                GOALS_BY_STATUS, CUSTOM_BUNDLES, FLEET_TRANSACTIONS, FLEET_BUDGETS)
+
+# Sample values used when probing queries against an emulator or project
+PROBE_VALUES = {'month': '2000-01', 'status': 'active'}
+
+# ==================== INDEX DEFINITIONS ====================
+
+def index_definitions(shapes=QUERY_SHAPES):
+    """firestore.indexes.json content for the shapes that need composite indexes or field overrides"""
+    indexes, overrides = [], []
+    for shape in shapes:
+        if shape.needs_composite_index():
+            index = {'collectionGroup': shape.collection_group, 'queryScope': shape.scope,
+                     'fields': shape.index_fields()}
+            if index not in indexes:
+                indexes.append(index)
+        elif shape.needs_field_override():
+            override = {'collectionGroup': shape.collection_group, 'fieldPath': shape.index_fields()[0]['fieldPath'],
+                        'indexes': AUTOMATIC_FIELD_INDEXES + [{'order': 'ASCENDING', 'queryScope': 'COLLECTION_GROUP'}]}
+            if override not in overrides:
+                overrides.append(override)
+    return {'indexes': indexes, 'fieldOverrides': overrides}
+
+def write_index_file(path=INDEX_FILE, shapes=QUERY_SHAPES):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(index_definitions(shapes), f, indent=2)
+        f.write('\n')
+
+def _covers(index, shape):
+    return (index.get('collectionGroup') == shape.collection_group
+            and index.get('queryScope', 'COLLECTION') == shape.scope
+            and [(field['fieldPath'], field.get('order')) for field in index.get('fields', [])
+                 if field['fieldPath'] != '__name__']
+            == [(field['fieldPath'], field['order']) for field in shape.index_fields()])
+
+def _overrides(override, shape):
+    return (override.get('collectionGroup') == shape.collection_group
+            and override.get('fieldPath') == shape.index_fields()[0]['fieldPath']
+            and any(index.get('queryScope') == 'COLLECTION_GROUP' and index.get('order')
+                    for index in override.get('indexes', [])))
+
+def missing_indexes(indexes, shapes=QUERY_SHAPES, field_overrides=()):
+    """Shapes whose index is not among indexes / field_overrides (firestore.indexes.json entries)"""
+    missing = []
+    for shape in shapes:
+        if shape.needs_composite_index() and not any(_covers(index, shape) for index in indexes):
+            missing.append(shape)
+        elif shape.needs_field_override() and not any(_overrides(override, shape) for override in field_overrides):
+            missing.append(shape)
+    return missing
+
+def check_index_file(path=INDEX_FILE, shapes=QUERY_SHAPES):
+    """Shapes the definitions file at path does not cover"""
+    with open(path, encoding='utf-8') as f:
+        definitions = json.load(f)
+    return missing_indexes(definitions.get('indexes', []), shapes, definitions.get('fieldOverrides', []))
+
+# ==================== LIVE VALIDATION ====================
+
+def _index_entry(index):
+    from google.cloud.firestore_admin_v1.types import Index
+    return {
+        'queryScope': Index.QueryScope(index.query_scope).name,
+        'fields': [{'fieldPath': field.field_path, 'order': Index.IndexField.Order(field.order).name}
+                   for field in index.fields],
+    }
+
+def app_credentials():
+    """google-auth credentials of the initialized firebase_admin app (the service-account key), or None"""
+    try:
+        import firebase_admin
+        return firebase_admin.get_app().credential.get_credential()
+    except (ImportError, ValueError):
+        return None
+
+def deployed_indexes(project_id, shapes=QUERY_SHAPES, database='(default)', credentials=None):
+    """READY composite indexes and field overrides in the project, as firestore.indexes.json entries
+
+    The admin API is called with credentials, by default the app's own
+    (Application Default Credentials only when no firebase_admin app exists).
+    """
+    from google.cloud.firestore_admin_v1 import FirestoreAdminClient
+    from google.cloud.firestore_admin_v1.types import Index
+    client = FirestoreAdminClient(credentials=credentials or app_credentials())
+    indexes, overrides = [], []
+    for group in sorted({shape.collection_group for shape in shapes}):
+        parent = f'projects/{project_id}/databases/{database}/collectionGroups/{group}'
+        for index in client.list_indexes(parent=parent):
+            if index.state == Index.State.READY:
+                indexes.append({'collectionGroup': group, **_index_entry(index)})
+    for shape in shapes:
+        if not shape.needs_field_override():
+            continue
+        field_path = shape.index_fields()[0]['fieldPath']
+        parent = f'projects/{project_id}/databases/{database}/collectionGroups/{shape.collection_group}'
+        field = client.get_field(name=f'{parent}/fields/{field_path}')
+        ready = [index for index in field.index_config.indexes if index.state == Index.State.READY]
+        overrides.append({'collectionGroup': shape.collection_group, 'fieldPath': field_path,
+                          'indexes': [{'queryScope': entry['queryScope'], 'order': entry['fields'][0]['order']}
+                                      for entry in map(_index_entry, ready) if entry['fields']]})
+    return indexes, overrides
+
+def probe_queries(db, shapes=QUERY_SHAPES):
+    """Run every shape once (limit 1); returns {shape name: error} for the ones that fail
+
+    Works against the emulator and real projects; a missing composite
+    index shows up as a FAILED_PRECONDITION error naming the index.
+    """
+    failures = {}
+    for shape in shapes:
+        if shape.scope == 'COLLECTION_GROUP':
+            collection = db.collection_group(shape.collection_group)
+        else:
+            collection = db.collection('_probe').document('_probe').collection(shape.collection_group)
+        try:
+            list(shape.build(collection, **PROBE_VALUES).limit(1).stream())
+        except Exception as e:
+            failures[shape.name] = str(e)
+    return failures
+
+def validate(db, project_id=None, shapes=QUERY_SHAPES, credentials=None):
+    """Missing index problems as a list of messages (empty when every shape is supported)"""
+    if os.getenv('FIRESTORE_EMULATOR_HOST') or project_id is None:
+        return [f'{name}: {error}' for name, error in probe_queries(db, shapes).items()]
+    indexes, overrides = deployed_indexes(project_id, shapes, credentials=credentials)
+    return [f'{shape.name}: no READY {shape.scope} index on {shape.collection_group} '
+            f'({", ".join(field["fieldPath"] + " " + field["order"] for field in shape.index_fields())})'
+            for shape in missing_indexes(indexes, shapes, overrides)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Firestore query-shape registry and index tooling')
+    parser.add_argument('command', choices=('generate', 'check', 'validate'))
+    parser.add_argument('path', nargs='?', default=INDEX_FILE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        write_index_file(args.path)
+        definitions = index_definitions()
+        print(f"Wrote {len(definitions['indexes'])} composite index(es) and "
+              f"{len(definitions['fieldOverrides'])} field override(s) to {args.path}")
+        return 0
+    if args.command == 'check':
+        missing = check_index_file(args.path)
+    else:
+        from utils.firebase_config import get_db
+        db = get_db()
+        problems = validate(db, db.project)
+        for problem in problems:
+            print(problem)
+        return 1 if problems else 0
+    for shape in missing:
+        print(f"{shape.name}: not covered by {args.path}")
+    return 1 if missing else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
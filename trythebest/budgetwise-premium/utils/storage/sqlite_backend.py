@@ -0,0 +1,396 @@
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from utils import rollups
+from utils.heavy_hitters import SKETCH_FIELD, record_payment
+from utils.storage.base import StorageBackend, NO_BUDGET, duplicate_payment, insufficient_balance, apply_increments, projection, project, listed, AGGREGATE_FIELDS
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS budgets (
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, month)
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at TEXT
+);
+DROP INDEX IF EXISTS idx_transactions_user_month_ts;
+CREATE INDEX IF NOT EXISTS idx_transactions_user_month_ts_id
+    ON transactions (user_id, month, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_transactions_month_user_id ON transactions (month, user_id, id);
+CREATE INDEX IF NOT EXISTS idx_budgets_month_user ON budgets (month, user_id);
+CREATE TABLE IF NOT EXISTS goals (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    status TEXT,
+    data TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_goals_user_status ON goals (user_id, status);
+CREATE TABLE IF NOT EXISTS custom_bundles (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_custom_bundles_user ON custom_bundles (user_id);
+CREATE TABLE IF NOT EXISTS rollups (
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, month)
+);
+"""
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'$date': value.strftime(TIMESTAMP_FORMAT)}
+    raise TypeError(f'Cannot store {type(value).__name__}')
+
+def _decode(obj):
+    if len(obj) == 1 and '$date' in obj:
+        return datetime.strptime(obj['$date'], TIMESTAMP_FORMAT)
+    return obj
+
+# Tables created before update times were tracked get the column on open
+UPDATED_AT_TABLES = ('transactions', 'goals', 'custom_bundles')
+
+def _now():
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+def _update_time(value):
+    return datetime.strptime(value, TIMESTAMP_FORMAT) if value else None
+
+def dumps_document(doc):
+    return json.dumps(doc, default=_encode)
+
+def loads_document(data):
+    return json.loads(data, object_hook=_decode)
+
+class SQLiteBackend(StorageBackend):
+    """Embedded SQLite storage in WAL mode
+
+    Documents are stored as JSON next to the indexed key columns. One
+    connection is shared between threads behind a lock; read-modify-write
+    operations run inside BEGIN IMMEDIATE so they are atomic across
+    processes too.
+    """
+    
+    name = 'sqlite'
+    
+    def __init__(self, path='budgetwise.db'):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        for table in UPDATED_AT_TABLES:
+            columns = [row[1] for row in self._conn.execute(f'PRAGMA table_info({table})')]
+            if columns and 'updated_at' not in columns:
+                self._conn.execute(f'ALTER TABLE {table} ADD COLUMN updated_at TEXT')
+        self._conn.executescript(SCHEMA)
+    
+    @staticmethod
+    def _new_id():
+        return uuid.uuid4().hex[:20]
+    
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+    
+    def _fetch_doc(self, sql, params):
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return loads_document(row[0]) if row else None
+    
+    # ==================== USERS ====================
+    
+    def create_user(self, user_id, profile):
+        with self._write() as conn:
+            conn.execute('INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)', (user_id, dumps_document(profile)))
+    
+    def get_user(self, user_id):
+        return self._fetch_doc('SELECT data FROM users WHERE user_id = ?', (user_id,))
+    
+    def increment_user(self, user_id, field, delta, updates=None):
+        with self._write() as conn:
+            row = conn.execute('SELECT data FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            user = loads_document(row[0]) if row else {}
+            user[field] = user.get(field, 0) + delta
+            user.update(updates or {})
+            conn.execute('INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)', (user_id, dumps_document(user)))
+    
+    # ==================== BUDGETS ====================
+    
+    def set_budget(self, user_id, month, budget):
+        with self._write() as conn:
+            conn.execute('INSERT OR REPLACE INTO budgets (user_id, month, data) VALUES (?, ?, ?)',
+                         (user_id, month, dumps_document(budget)))
+    
+    def get_budget(self, user_id, month):
+        return self._fetch_doc('SELECT data FROM budgets WHERE user_id = ? AND month = ?', (user_id, month))
+    
+    def _locked_budget(self, conn, user_id, month):
+        row = conn.execute('SELECT data FROM budgets WHERE user_id = ? AND month = ?', (user_id, month)).fetchone()
+        return loads_document(row[0]) if row else None
+    
+    def _store_budget(self, conn, user_id, month, budget):
+        conn.execute('UPDATE budgets SET data = ? WHERE user_id = ? AND month = ?', (dumps_document(budget), user_id, month))
+    
+    def update_budget(self, user_id, month, fields):
+        with self._write() as conn:
+            budget = self._locked_budget(conn, user_id, month)
+            if budget is None:
+                raise KeyError(f'No budget for {user_id} in {month}')
+            budget.update(fields)
+            self._store_budget(conn, user_id, month, budget)
+    
+    def increment_budget(self, user_id, month, field, delta):
+        with self._write() as conn:
+            budget = self._locked_budget(conn, user_id, month)
+            if budget is None:
+                raise KeyError(f'No budget for {user_id} in {month}')
+            budget[field] = budget.get(field, 0) + delta
+            self._store_budget(conn, user_id, month, budget)
+    
+    def _spend(self, conn, user_id, month, bundle, amount):
+        budget = self._locked_budget(conn, user_id, month)
+        if budget is None:
+            return dict(NO_BUDGET)
+        field_name = f'{bundle}_remaining'
+        remaining = budget.get(field_name, 0)
+        if amount > remaining:
+            return insufficient_balance(remaining)
+        budget[field_name] = remaining - amount
+        self._store_budget(conn, user_id, month, budget)
+        return {'success': True, 'new_balance': remaining - amount}
+    
+    def spend_from_bundle(self, user_id, month, bundle, amount):
+        with self._write() as conn:
+            return self._spend(conn, user_id, month, bundle, amount)
+    
+    # ==================== TRANSACTIONS ====================
+    
+    def _insert_transaction(self, conn, user_id, record, transaction_id=None):
+        transaction_id = transaction_id or self._new_id()
+        conn.execute(
+            'INSERT INTO transactions (id, user_id, month, timestamp, data, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (transaction_id, user_id, record.get('month', ''),
+             record['timestamp'].strftime(TIMESTAMP_FORMAT), dumps_document(record), _now()))
+        return transaction_id
+    
+    def add_transaction(self, user_id, record):
+        with self._write() as conn:
+            return self._insert_transaction(conn, user_id, record)
+    
+    def commit_payment(self, user_id, month, record, deduct=True, rollup=None, transaction_id=None):
+        with self._write() as conn:
+            if transaction_id and conn.execute('SELECT 1 FROM transactions WHERE id = ?', (transaction_id,)).fetchone():
+                return duplicate_payment(transaction_id)
+            new_balance = None
+            if deduct:
+                result = self._spend(conn, user_id, month, record['bundle'], record['amount'])
+                if not result['success']:
+                    return result
+                new_balance = result['new_balance']
+            transaction_id = self._insert_transaction(conn, user_id, record, transaction_id)
+            budget = self._locked_budget(conn, user_id, month)
+            if budget is not None:
+                self._store_budget(conn, user_id, month, {**budget, SKETCH_FIELD: record_payment(budget, record)})
+            if rollup:
+                self._increment_rollup(conn, user_id, month, rollup)
+            return {'success': True, 'transaction_id': transaction_id, 'new_balance': new_balance}
+    
+    def list_transactions(self, user_id, month, limit=None, start_after=None, fields=None):
+        fields = projection(fields)
+        params = []
+        if fields:
+            # Project inside SQLite so only the requested keys are decoded
+            column = 'json_object({})'.format(', '.join("?, json_extract(data, ?)" for _ in fields))
+            for field in fields:
+                params.extend([field, f'$.{field}'])
+        else:
+            column = 'data'
+        sql = f'SELECT id, updated_at, {column} FROM transactions WHERE user_id = ? AND month = ?'
+        params.extend([user_id, month])
+        if start_after is not None:
+            # Records sharing the cursor's timestamp continue in id order
+            cursor = start_after['timestamp'].strftime(TIMESTAMP_FORMAT)
+            sql += ' AND (timestamp < ? OR (timestamp = ? AND id < ?))'
+            params.extend([cursor, cursor, start_after.get('id') or ''])
+        sql += ' ORDER BY timestamp DESC, id DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        if fields:
+            return [listed({key: value for key, value in loads_document(data).items() if value is not None},
+                           transaction_id, _update_time(updated_at))
+                    for transaction_id, updated_at, data in rows]
+        return [listed(loads_document(data), transaction_id, _update_time(updated_at))
+                for transaction_id, updated_at, data in rows]
+    
+    def categorize_transactions(self, user_id, month, assignments):
+        ids = list(dict(assignments))
+        with self._write() as conn:
+            rows = conn.execute(
+                'SELECT id, data FROM transactions WHERE user_id = ? AND month = ? AND id IN ({})'.format(
+                    ', '.join('?' for _ in ids)),
+                (user_id, month, *ids)).fetchall()
+            records = {transaction_id: loads_document(data) for transaction_id, data in rows}
+            budget = self._locked_budget(conn, user_id, month)
+            updates, balances, rollup = rollups.plan_categorization(budget, records, assignments)
+            for transaction_id, fields in updates.items():
+                conn.execute('UPDATE transactions SET data = ?, updated_at = ? WHERE id = ?',
+                             (dumps_document({**records[transaction_id], **fields}), _now(), transaction_id))
+            if balances:
+                self._store_budget(conn, user_id, month, {**budget, **balances})
+            if rollup:
+                self._increment_rollup(conn, user_id, month, rollup)
+            return {'success': True, 'categorized': len(updates), 'balances': balances}
+    
+    def update_transaction(self, user_id, transaction_id, fields, month=None):
+        with self._write() as conn:
+            row = conn.execute('SELECT data FROM transactions WHERE id = ? AND user_id = ?',
+                               (transaction_id, user_id)).fetchone()
+            if row is None:
+                raise KeyError(f'No transaction {transaction_id}')
+            record = loads_document(row[0])
+            record.update(fields)
+            conn.execute('UPDATE transactions SET data = ?, updated_at = ? WHERE id = ?',
+                         (dumps_document(record), _now(), transaction_id))
+    
+    # ==================== GOALS ====================
+    
+    def add_goal(self, user_id, goal):
+        with self._write() as conn:
+            goal_id = self._new_id()
+            conn.execute('INSERT INTO goals (id, user_id, status, data, updated_at) VALUES (?, ?, ?, ?, ?)',
+                         (goal_id, user_id, goal.get('status'), dumps_document(goal), _now()))
+            return goal_id
+    
+    def list_goals(self, user_id, status='active'):
+        with self._lock:
+            rows = self._conn.execute('SELECT id, updated_at, data FROM goals WHERE user_id = ? AND status = ?',
+                                      (user_id, status)).fetchall()
+        return [listed(loads_document(data), goal_id, _update_time(updated_at)) for goal_id, updated_at, data in rows]
+    
+    def _update_goal(self, conn, user_id, goal_id, change):
+        row = conn.execute('SELECT data FROM goals WHERE id = ? AND user_id = ?', (goal_id, user_id)).fetchone()
+        if row is None:
+            return False
+        goal = change(loads_document(row[0]))
+        conn.execute('UPDATE goals SET status = ?, data = ?, updated_at = ? WHERE id = ?',
+                     (goal.get('status'), dumps_document(goal), _now(), goal_id))
+        return True
+    
+    def update_goal(self, user_id, goal_id, fields):
+        with self._write() as conn:
+            if not self._update_goal(conn, user_id, goal_id, lambda goal: {**goal, **fields}):
+                raise KeyError(f'No goal {goal_id}')
+    
+    def increment_goal(self, user_id, goal_id, field, delta):
+        with self._write() as conn:
+            return self._update_goal(conn, user_id, goal_id,
+                                     lambda goal: {**goal, field: goal.get(field, 0) + delta})
+    
+    # ==================== CUSTOM BUNDLES ====================
+    
+    def add_custom_bundle(self, user_id, bundle):
+        with self._write() as conn:
+            bundle_id = self._new_id()
+            conn.execute('INSERT INTO custom_bundles (id, user_id, data, updated_at) VALUES (?, ?, ?, ?)',
+                         (bundle_id, user_id, dumps_document(bundle), _now()))
+            return bundle_id
+    
+    def list_custom_bundles(self, user_id):
+        with self._lock:
+            rows = self._conn.execute('SELECT id, updated_at, data FROM custom_bundles WHERE user_id = ?',
+                                      (user_id,)).fetchall()
+        return [listed(loads_document(data), bundle_id, _update_time(updated_at)) for bundle_id, updated_at, data in rows]
+    
+    # ==================== FLEET SCANS ====================
+    
+    def scan_budgets(self, month, chunk_size=1000):
+        after = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT user_id, data FROM budgets WHERE month = ? AND user_id > ? ORDER BY user_id LIMIT ?',
+                    (month, after, chunk_size)).fetchall()
+            if not rows:
+                return
+            yield [(user_id, loads_document(data)) for user_id, data in rows]
+            after = rows[-1][0]
+    
+    def scan_transactions(self, month, chunk_size=1000, fields=None):
+        # Keyset pagination on (user_id, id) keeps every page an index range scan
+        after = ('', '')
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT user_id, id, data FROM transactions WHERE month = ? AND (user_id, id) > (?, ?) '
+                    'ORDER BY user_id, id LIMIT ?',
+                    (month, *after, chunk_size)).fetchall()
+            if not rows:
+                return
+            yield [(user_id, project(loads_document(data), fields)) for user_id, _, data in rows]
+            after = rows[-1][:2]
+    
+    # ==================== ROLLUPS ====================
+    
+    def get_rollup(self, user_id, month):
+        return self._fetch_doc('SELECT data FROM rollups WHERE user_id = ? AND month = ?', (user_id, month))
+    
+    def set_rollup(self, user_id, month, rollup):
+        with self._write() as conn:
+            conn.execute('INSERT OR REPLACE INTO rollups (user_id, month, data) VALUES (?, ?, ?)',
+                         (user_id, month, dumps_document(rollup)))
+    
+    def rebuild_rollup(self, user_id, month):
+        with self._write() as conn:
+            records = self.list_transactions(user_id, month, fields=AGGREGATE_FIELDS)
+            rollup = rollups.build_rollup(month, records)
+            stored = conn.execute('SELECT 1 FROM rollups WHERE user_id = ? AND month = ?', (user_id, month)).fetchone()
+            if records or stored:
+                conn.execute('INSERT OR REPLACE INTO rollups (user_id, month, data) VALUES (?, ?, ?)',
+                             (user_id, month, dumps_document(rollup)))
+            return rollup
+    
+    def _increment_rollup(self, conn, user_id, month, increments):
+        row = conn.execute('SELECT data FROM rollups WHERE user_id = ? AND month = ?', (user_id, month)).fetchone()
+        doc = apply_increments(loads_document(row[0]) if row else {'month': month}, increments)
+        conn.execute('INSERT OR REPLACE INTO rollups (user_id, month, data) VALUES (?, ?, ?)',
+                     (user_id, month, dumps_document(doc)))
+    
+    def increment_rollup(self, user_id, month, increments):
+        with self._write() as conn:
+            self._increment_rollup(conn, user_id, month, increments)
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from utils.storage.base import sort_timestamp
+
+# Columns kept from each record; missing ones are filled with these defaults
+COLUMNS = {
+    'amount': 0.0,
+    'bundle': 'uncategorized',
+    'recipient': '',
+    'status': '',
+    'timestamp': None,
+}
+
+CATEGORICAL_COLUMNS = ('bundle', 'recipient', 'status')
+
+class TransactionFrame:
+    """Columnar view of a month's transactions
+
+    Built once from the record dicts the data layer returns (full or
+    projected); bundle, recipient and status are categoricals so group-bys
+    work on integer codes. Timestamps are naive datetime64 values.
+    """
+
+    def __init__(self, df):
+        self.df = df
+
+    @classmethod
+    def from_records(cls, records):
+        columns = {}
+        for name, default in COLUMNS.items():
+            values = [record.get(name, default) for record in records]
+            if name == 'timestamp':
+                columns[name] = pd.to_datetime([sort_timestamp(value) if value is not None else None
+                                                for value in values])
+            elif name == 'amount':
+                columns[name] = np.asarray(values, dtype='float64')
+            else:
+                columns[name] = pd.Categorical(values)
+        return cls(pd.DataFrame(columns, index=pd.RangeIndex(len(records))))
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def amounts(self):
+        return self.df['amount'].to_numpy()
+
+    @property
+    def total(self):
+        return float(self.amounts.sum())
+
+    @property
+    def mean(self):
+        return float(self.amounts.mean()) if len(self) else 0.0
+
+    def bundle_stats(self):
+        """DataFrame indexed by bundle with count, total, mean and max amount"""
+        grouped = self.df.groupby('bundle', observed=True)['amount']
+        return grouped.agg(count='count', total='sum', mean='mean', max='max')
+
+    def recipient_stats(self):
+        """DataFrame indexed by recipient with count and total amount"""
+        grouped = self.df.groupby('recipient', observed=True)['amount']
+        return grouped.agg(count='count', total='sum')
+
+    def daily_matrix(self, bundles, days):
+        """Array (len(bundles), days) of spend per bundle and day of month
+
+        Assumes the frame holds one month; other bundles and later days are dropped.
+        """
+        matrix = np.zeros((len(bundles), days))
+        if not days or not len(self):
+            return matrix
+        day = self.df['timestamp'].dt.day.to_numpy(dtype='float64', na_value=np.nan)
+        row = pd.Categorical(self.df['bundle'], categories=list(bundles)).codes
+        keep = (row >= 0) & (day <= days)
+        np.add.at(matrix, (row[keep], day[keep].astype(int) - 1), self.amounts[keep])
+        return matrix
+    
+    def daily_totals(self):
+        """Series of spend per calendar day, indexed by date"""
+        dated = self.df.dropna(subset=['timestamp'])
+        return dated.groupby(dated['timestamp'].dt.normalize())['amount'].sum()